@@ -53,10 +53,46 @@ __contributors__ = {}
 __url__ = 'https://github.com/cottongin/NHL'
 
 from . import config
+from . import alerts
+from . import cache
+from . import client
+from . import engine
+from . import feedparse
+from . import gameindex
+from . import livefeed
+from . import metrics
+from . import output
+from . import playoffs
+from . import poller
+from . import report
+from . import resilience
+from . import seasonstats
+from . import shortener
+from . import snapshot
+from . import store
+from . import teams
 from . import plugin
 from imp import reload
 # In case we're being reloaded.
 reload(config)
+reload(alerts)
+reload(cache)
+reload(client)
+reload(engine)
+reload(feedparse)
+reload(gameindex)
+reload(livefeed)
+reload(metrics)
+reload(output)
+reload(playoffs)
+reload(poller)
+reload(report)
+reload(resilience)
+reload(seasonstats)
+reload(shortener)
+reload(snapshot)
+reload(store)
+reload(teams)
 reload(plugin)
 # Add more reloads here if you add third-party modules and want them to be
 # reloaded when this plugin is reloaded.  Don't forget to import them as well!
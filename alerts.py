@@ -0,0 +1,101 @@
+###
+# Copyright (c) 2017, cottongin
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE
+###
+
+###
+# Includes contributions from Santiago Gil and Jonathan "grateful" Surman
+###
+
+
+"""
+Announcements of goals, game starts and final scores.
+
+Channels follow teams (the channel-specific alerts.teams setting). The
+poller hands every new GameSnapshot of the games it tracks to an
+AlertWatcher, which compares it with the previous one of the same game and
+returns what happened since. The plugin sends those lines once to each
+channel following either team. So the upstream cost depends on the number of
+games being played, not on the number of channels or users.
+"""
+
+import threading
+
+import supybot.ircutils as ircutils
+
+
+class GameWatch(object):
+    """What was last seen of a game."""
+    __slots__ = ('state', 'goals')
+
+    def __init__(self, game):
+        self.state = game.state
+        self.goals = set(goal.event for goal in game.goals)
+
+
+class AlertWatcher(object):
+    """Turns the successive snapshots of each game into announcements."""
+
+    def __init__(self):
+        self._games = {}
+        self._lock = threading.Lock()
+
+    def update(self, game):
+        """Returns the lines announcing what happened in game (a
+        GameSnapshot) since its previous snapshot. Nothing is announced the
+        first time a game is seen, so that a restart doesn't repeat the
+        goals already scored."""
+        with self._lock:
+            watch = self._games.get(game.gamepk)
+            if game.state == 'Final':
+                self._games.pop(game.gamepk, None)
+            else:
+                self._games[game.gamepk] = GameWatch(game)
+        if watch is None:
+            return []
+        (away, home) = (game.away, game.home)
+        score = '{} {} {} {}'.format(away.abbreviation, away.goals,
+                                     home.abbreviation, home.goals)
+        lines = []
+        if watch.state != 'Live' and game.state == 'Live':
+            lines.append('{}: {} at {} is under way'.format(
+                ircutils.bold('Puck drop'), away.abbreviation,
+                home.abbreviation))
+        for goal in game.goals:
+            if goal.event not in watch.goals:
+                lines.append('{}: {} | {}'.format(ircutils.bold('Goal'),
+                                                  goal.format(), score))
+        if watch.state != 'Final' and game.state == 'Final':
+            lines.append('{}: {}'.format(ircutils.bold(game.status), score))
+        return lines
+
+    def forget(self, gamepk):
+        with self._lock:
+            self._games.pop(gamepk, None)
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
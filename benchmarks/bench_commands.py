@@ -0,0 +1,254 @@
+###
+# Copyright (c) 2017, cottongin
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE
+###
+
+###
+# Includes contributions from Santiago Gil and Jonathan "grateful" Surman
+###
+
+
+"""
+Measures the bot commands end to end against the local stub API.
+
+    python benchmarks/bench_commands.py [--iterations N] [--latency MS]
+                                        [--fixtures DIR] [--engine]
+
+The plugin is loaded in a throwaway Limnoria test environment, the same one
+supybot-test builds, and its HTTP client is pointed at a StubServer (see
+stubserver.py) so no request leaves the machine. Every command is timed
+from the moment the message is fed to the bot until its last reply line is
+queued, first with cold caches (everything the plugin remembers is dropped
+before each run) and then warm. The p50/p95/mean latency and the peak
+memory allocated during a run (tracemalloc) are reported. With --engine,
+the requests go through the shared event loop (fetch.engine).
+
+A "command" starting with an underscore is a method of the plugin, called
+directly with the rest of the line, like '_findGamepk BOS'.
+"""
+
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import time
+import tracemalloc
+import urllib.parse
+
+# Sets up a temporary registry and data directory, like supybot-test does.
+from supybot.scripts import limnoria_test
+
+import supybot.conf as conf
+import supybot.drivers as drivers
+import supybot.ircmsgs as ircmsgs
+import supybot.log as log
+import supybot.test as test
+import supybot.world as world
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import stubserver
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COMMANDS = ['_findGamepk BOS', 'summary BOS', 'summary NYR', 'nhlplayoffs']
+
+
+def _stubClient(base, client):
+    """Returns an HTTPClient class sending every request to base."""
+    class StubClient(client.HTTPClient):
+        def get(self, url, headers=None, timeout=None):
+            parts = urllib.parse.urlsplit(url)
+            url = urllib.parse.urlunsplit(('http', base) + parts[2:])
+            return super().get(url, headers=headers, timeout=timeout)
+    return StubClient
+
+
+class CommandBench(test.ChannelPluginTestCase):
+    plugins = ('NHL',)
+    timeout = 30
+    # Whether the requests go through an engine.Engine
+    engine = False
+
+    def runTest(self):
+        pass
+
+    def setUp(self):
+        super().setUp()
+        self.cb = self.irc.getCallback('NHL')
+        self.package = sys.modules[self.cb.__module__.rpartition('.')[0]]
+        self.cb._http.close()
+        io_engine = self.package.engine.Engine() if self.engine else None
+        # The stub isn't rate limited (every run would otherwise wait for
+        # the token bucket once the burst is used up).
+        guards = self.package.resilience.HostGuards(rate=1e6, burst=10**6)
+        self.cb._http = _stubClient(urllib.parse.urlsplit(self.base).netloc,
+                                    self.package.client)(
+                                        4, 8, 5.0, 10.0, guards=guards,
+                                        engine=io_engine)
+        # Finished games would otherwise be served from disk from the
+        # second run on, which is a different benchmark.
+        self.cb._store.close()
+        self.cb._store = None
+        self.forget()
+
+    def forget(self):
+        """Drops everything the plugin remembers between commands."""
+        (cb, package) = (self.cb, self.package)
+        cb._cache = package.cache.ResponseCache(
+            cb.registryValue('cache.maxEntries'),
+            cb.registryValue('cache.maxBytes') or None,
+            cb.registryValue('cache.compress'))
+        cb._shortener = package.shortener.LinkShortener(cb._requestShortURL)
+        cb._reports = package.report.ReportCache()
+        cb._games = package.gameindex.ScheduleIndex(cb._fetchSchedule)
+        cb._brackets = package.playoffs.BracketCache()
+        cb._snapshots = package.snapshot.SnapshotCache()
+        cb._feeds = package.livefeed.LiveFeeds()
+        cb._teams = None
+        cb._teamsExpire = 0
+
+    def run(self, command, lines, quiet=0):
+        """Runs command and returns (seconds, replies). Once lines replies
+        arrived, waits for more until none came for quiet seconds; the time
+        is that of the last reply."""
+        self.irc.feedMsg(ircmsgs.privmsg(self.channel, '@' + command,
+                                         prefix=self.prefix))
+        started = last = time.perf_counter()
+        replies = []
+        while time.perf_counter() - started < self.timeout:
+            drivers.run()
+            msg = self.irc.takeMsg()
+            while msg is not None:
+                replies.append(msg.args[1])
+                last = time.perf_counter()
+                msg = self.irc.takeMsg()
+            if len(replies) >= lines and \
+                    time.perf_counter() - last >= quiet:
+                break
+            time.sleep(0.0005)
+        return (last - started, replies)
+
+    def call(self, command):
+        """Calls the plugin method named by the first word of command with
+        the rest of it, and returns (seconds, [repr of the result])."""
+        (name, args) = (command.split(None, 1) + [''])[:2]
+        started = time.perf_counter()
+        result = getattr(self.cb, name)(args)
+        return (time.perf_counter() - started, [repr(result)])
+
+    def count(self, command, quiet=1.0):
+        """Runs command once and counts its reply lines."""
+        (elapsed, replies) = self.run(command, 1)
+        deadline = time.perf_counter() + quiet
+        while time.perf_counter() < deadline:
+            drivers.run()
+            msg = self.irc.takeMsg()
+            if msg is not None:
+                replies.append(msg.args[1])
+                deadline = time.perf_counter() + quiet
+            time.sleep(0.01)
+        return replies
+
+
+def measure(bench, command, iterations, cold, quiet=0.1):
+    """Times command. The number of reply messages may vary from one run to
+    the next (see output.coalesce), so a run lasts until its last reply,
+    followed by quiet seconds without any."""
+    timings = []
+    peak = 0
+    lines = 0
+    for _ in range(iterations):
+        if cold:
+            bench.forget()
+        tracemalloc.start()
+        if command.startswith('_'):
+            (elapsed, replies) = bench.call(command)
+        else:
+            (elapsed, replies) = bench.run(command, 1, quiet)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        if not replies:
+            raise RuntimeError('{!r} timed out'.format(command))
+        lines = max(lines, len(replies))
+        timings.append(elapsed)
+    timings.sort()
+    return (statistics.median(timings),
+            timings[max(0, int(round(len(timings) * 0.95)) - 1)],
+            statistics.mean(timings), peak, lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip(),
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0,
+                        help='milliseconds added to every stub response')
+    parser.add_argument('--fixtures', help='directory of recorded responses')
+    parser.add_argument('--engine', action='store_true',
+                        help='send the requests from the shared event loop')
+    parser.add_argument('commands', nargs='*', default=COMMANDS)
+    options = parser.parse_args()
+
+    world.testing = True
+    world.myVerbose = test.verbosity.NONE
+    log.testing = True
+    plugins = os.path.join(limnoria_test.main_temp_dir.name, 'plugins')
+    os.mkdir(plugins)
+    os.symlink(REPO, os.path.join(plugins, 'NHL'))
+    conf.supybot.directories.plugins.setValue([plugins])
+    server = stubserver.StubServer(
+        stubserver.StubAPI(options.fixtures, options.latency / 1000)).start()
+    CommandBench.base = server.url
+    CommandBench.engine = options.engine
+    bench = CommandBench()
+    bench.setUp()
+    try:
+        print('{:<16} {:>5} {:>5} {:>9} {:>9} {:>8} {:>10}'.format(
+            'command', 'cache', 'lines', 'p50 ms', 'p95 ms', 'mean ms',
+            'peak KiB'))
+        for command in options.commands:
+            for cold in (True, False):
+                (p50, p95, mean, peak, lines) = measure(
+                    bench, command, options.iterations, cold)
+                print('{:<16} {:>5} {:>5} {:>9.2f} {:>9.2f} {:>8.2f} '
+                      '{:>10.1f}'.format(command, 'cold' if cold else 'warm',
+                                         lines, p50 * 1000, p95 * 1000,
+                                         mean * 1000, peak / 1024))
+        print('{} requests served by the stub'.format(server.api.requests))
+    finally:
+        bench.tearDown()
+        server.stop()
+        shutil.rmtree(plugins)
+
+
+if __name__ == '__main__':
+    main()
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
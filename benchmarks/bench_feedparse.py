@@ -0,0 +1,120 @@
+###
+# Copyright (c) 2017, cottongin
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE
+###
+
+###
+# Includes contributions from Santiago Gil and Jonathan "grateful" Surman
+###
+
+
+"""
+Compares json.loads with feedparse.parseFeed on a live feed document.
+
+    python benchmarks/bench_feedparse.py [--repeat N] [--plays N] [FEED ...]
+
+Each FEED is a recorded 'feed/live' response; without any, synthetic feeds
+of a first period, a late third period and an overtime marathon are used.
+For each document and parser, the median parse time and the peak memory
+allocated while parsing (tracemalloc) are reported.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import feedparse
+import fixtures
+
+
+PARSERS = [
+    ('json.loads', lambda body: json.loads(body.decode('utf-8'))),
+    ('feedparse.parseFeed', feedparse.parseFeed),
+]
+
+
+def measure(parse, body, repeat):
+    """Returns (median seconds, peak bytes) for parse(body)."""
+    times = []
+    for n in range(repeat):
+        start = time.perf_counter()
+        parse(body)
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    parse(body)
+    (current, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (statistics.median(times), peak)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('feeds', nargs='*', help='recorded feed/live files')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--plays', type=int, nargs='+', default=[80, 350, 600])
+    options = parser.parse_args()
+
+    documents = []
+    for filename in options.feeds:
+        with open(filename, 'rb') as fd:
+            documents.append((os.path.basename(filename), fd.read()))
+    if not documents:
+        for plays in options.plays:
+            body = json.dumps(fixtures.feed(plays=plays), indent=2)
+            documents.append(('synthetic, {} plays'.format(plays),
+                              body.encode('utf-8')))
+
+    print('{:<28} {:>9} {:<20} {:>9} {:>10}'.format(
+        'document', 'size (KB)', 'parser', 'time (ms)', 'peak (KB)'))
+    for (name, body) in documents:
+        results = [(label, measure(parse, body, options.repeat))
+                   for (label, parse) in PARSERS]
+        assert feedparse.parseFeed(body)['liveData']['plays']['allPlays'] == \
+            [play for play in json.loads(body.decode('utf-8'))['liveData']
+                              ['plays']['allPlays']
+             if play['result']['eventTypeId'] == 'GOAL']
+        for (label, (seconds, peak)) in results:
+            print('{:<28} {:>9.0f} {:<20} {:>9.2f} {:>10.0f}'.format(
+                name, len(body) / 1024, label, seconds * 1000, peak / 1024))
+        ((_, (base_time, base_peak)), (_, (new_time, new_peak))) = results
+        print('{:<28} {:>9} {:<20} {:>9} {:>10}'.format(
+            '', '', 'change', '{:+.0%}'.format(new_time / base_time - 1),
+            '{:+.0%}'.format(new_peak / base_peak - 1)))
+
+
+if __name__ == '__main__':
+    main()
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -0,0 +1,373 @@
+###
+# Copyright (c) 2017, cottongin
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE
+###
+
+###
+# Includes contributions from Santiago Gil and Jonathan "grateful" Surman
+###
+
+
+"""
+Synthetic statsapi payloads for the benchmarks.
+
+The documents mimic the shape and the size of the real ones (a late-game
+live feed has a few hundred plays and full rosters), so the benchmarks can
+run without network access. They are deterministic for a given seed.
+"""
+
+import random
+
+
+TEAMS = {
+    'BOS': (6, 'Boston Bruins', 'Bruins', 'Boston', 'TD Garden'),
+    'OTT': (9, 'Ottawa Senators', 'Senators', 'Ottawa',
+            'Canadian Tire Centre'),
+    'NYR': (3, 'New York Rangers', 'Rangers', 'New York',
+            'Madison Square Garden'),
+    'MTL': (8, 'Montréal Canadiens', 'Canadiens', 'Montréal',
+            'Bell Centre'),
+}
+
+EVENTS = ['FACEOFF', 'SHOT', 'HIT', 'GIVEAWAY', 'TAKEAWAY', 'BLOCKED_SHOT',
+          'MISSED_SHOT', 'STOP', 'PENALTY']
+
+
+def team(abbreviation):
+    (tid, name, nickname, city, arena) = TEAMS[abbreviation]
+    return {'id': tid, 'name': name, 'link': '/api/v1/teams/{}'.format(tid),
+            'abbreviation': abbreviation, 'triCode': abbreviation,
+            'teamName': nickname, 'locationName': city, 'shortName': city,
+            'firstYearOfPlay': '1924', 'officialSiteUrl': 'http://www.nhl.com',
+            'venue': {'name': arena, 'city': city,
+                      'link': '/api/v1/venues/null',
+                      'timeZone': {'id': 'America/New_York', 'offset': -4,
+                                   'tz': 'EDT'}},
+            'division': {'id': 17, 'name': 'Atlantic',
+                         'link': '/api/v1/divisions/17'},
+            'conference': {'id': 6, 'name': 'Eastern',
+                           'link': '/api/v1/conferences/6'},
+            'franchise': {'franchiseId': tid, 'teamName': nickname,
+                          'link': '/api/v1/franchises/{}'.format(tid)},
+            'active': True}
+
+
+def person(number, abbreviation):
+    pid = 8470000 + TEAMS[abbreviation][0] * 100 + number
+    first = 'Player{}'.format(number)
+    if number % 9 == 0:
+        first += ' Van'
+    return {'id': pid, 'fullName': '{} {}{}'.format(first, abbreviation.title(),
+                                                    number),
+            'link': '/api/v1/people/{}'.format(pid)}
+
+
+def _play(rnd, index, period, event, abbreviation, goals):
+    players = [{'player': person(rnd.randint(1, 23), abbreviation),
+                'playerType': 'Scorer' if event == 'GOAL' else 'Shooter',
+                'seasonTotal': rnd.randint(1, 40)}]
+    result = {'event': event.replace('_', ' ').title(),
+              'eventCode': 'BOS{}'.format(index), 'eventTypeId': event,
+              'description': '{} {} by {} at the blue line'.format(
+                  event.title(), 'attempt', players[0]['player']['fullName'])}
+    if event == 'GOAL':
+        for n in range(rnd.randint(0, 2)):
+            players.append({'player': person(rnd.randint(1, 23),
+                                             abbreviation),
+                            'playerType': 'Assist',
+                            'seasonTotal': rnd.randint(1, 50)})
+        players.append({'player': person(rnd.choice([1, 31]), abbreviation),
+                        'playerType': 'Goalie'})
+        result['secondaryType'] = 'Wrist Shot'
+        result['strength'] = {'code': rnd.choice(['EVEN'] * 4 +
+                                                 ['PPG', 'SHG']),
+                              'name': 'Even'}
+        result['gameWinningGoal'] = False
+        result['emptyNet'] = False
+    else:
+        players.append({'player': person(rnd.randint(1, 23), abbreviation),
+                        'playerType': 'Hittee'})
+    return {'players': players, 'result': result,
+            'about': {'eventIdx': index, 'eventId': index + 50,
+                      'period': period, 'periodType': 'REGULAR',
+                      'ordinalNum': ['1st', '2nd', '3rd'][period - 1],
+                      'periodTime': '{:02d}:{:02d}'.format(
+                          rnd.randint(0, 19), rnd.randint(0, 59)),
+                      'periodTimeRemaining': '{:02d}:{:02d}'.format(
+                          rnd.randint(0, 19), rnd.randint(0, 59)),
+                      'dateTime': '2017-04-12T23:45:00Z',
+                      'goals': dict(goals)},
+            'coordinates': {'x': rnd.uniform(-99, 99),
+                            'y': rnd.uniform(-42, 42)},
+            'team': {'id': TEAMS[abbreviation][0],
+                     'name': TEAMS[abbreviation][1],
+                     'link': '/api/v1/teams/{}'.format(
+                         TEAMS[abbreviation][0]),
+                     'triCode': abbreviation}}
+
+
+def _skater(rnd, number, abbreviation):
+    stats = dict((stat, rnd.randint(0, 5)) for stat in (
+        'assists', 'goals', 'shots', 'hits', 'powerPlayGoals',
+        'powerPlayAssists', 'penaltyMinutes', 'faceOffWins', 'faceoffTaken',
+        'takeaways', 'giveaways', 'shortHandedGoals', 'shortHandedAssists',
+        'blocked', 'plusMinus'))
+    stats.update(timeOnIce='15:32', evenTimeOnIce='12:01',
+                 powerPlayTimeOnIce='2:10', shortHandedTimeOnIce='1:21')
+    return {'person': dict(person(number, abbreviation),
+                           shootsCatches='L', rosterStatus='Y'),
+            'jerseyNumber': str(number),
+            'position': {'code': 'C', 'name': 'Center', 'type': 'Forward',
+                         'abbreviation': 'C'},
+            'stats': {'skaterStats': stats}}
+
+
+def feed(gamepk=2016030111, away='OTT', home='BOS', plays=350,
+         state='Final', timestamp='20170412_234500', seed=1):
+    """Returns a live feed document for a game with the given number of
+    plays."""
+    rnd = random.Random(seed)
+    all_plays = []
+    scoring = []
+    goals = {'away': 0, 'home': 0}
+    for index in range(plays):
+        period = min(3, 1 + index * 3 // max(plays, 1))
+        event = rnd.choice(EVENTS * 4 + ['GOAL'])
+        side = rnd.choice(['away', 'home'])
+        if event == 'GOAL':
+            goals[side] += 1
+            scoring.append(index)
+        all_plays.append(_play(rnd, index, period, event,
+                               away if side == 'away' else home, goals))
+
+    def stats(side):
+        return {'teamSkaterStats': {
+            'goals': goals[side], 'pim': rnd.randint(0, 20),
+            'shots': rnd.randint(20, 40), 'powerPlayPercentage': '25.0',
+            'powerPlayGoals': 1.0, 'powerPlayOpportunities': 4.0,
+            'faceOffWinPercentage': '{:.1f}'.format(rnd.uniform(40, 60)),
+            'blocked': rnd.randint(5, 20), 'takeaways': rnd.randint(2, 10),
+            'giveaways': rnd.randint(2, 10), 'hits': rnd.randint(10, 35)}}
+
+    def boxscore(side, abbreviation):
+        return {'team': team(abbreviation), 'teamStats': stats(side),
+                'players': dict(('ID{}'.format(person(n, abbreviation)['id']),
+                                 _skater(rnd, n, abbreviation))
+                                for n in range(1, 24)),
+                'goalies': [person(1, abbreviation)['id']],
+                'skaters': [person(n, abbreviation)['id']
+                            for n in range(2, 24)],
+                'coaches': [{'person': {'fullName': 'Coach'},
+                             'position': {'code': 'HC'}}]}
+
+    players = {}
+    for abbreviation in (away, home):
+        for n in range(1, 24):
+            p = person(n, abbreviation)
+            players['ID{}'.format(p['id'])] = dict(
+                p, firstName='Player', lastName=abbreviation, primaryNumber=n,
+                birthDate='1990-01-01', currentAge=27, birthCity='Somewhere',
+                birthCountry='CAN', nationality='CAN', height='6\' 1"',
+                weight=200, active=True, rookie=False, shootsCatches='L',
+                rosterStatus='Y', currentTeam=team(abbreviation),
+                primaryPosition={'code': 'C', 'name': 'Center',
+                                 'type': 'Forward', 'abbreviation': 'C'})
+    coded = {'Final': '7', 'Scheduled': '1', 'Pre-Game': '2'}.get(state, '3')
+    abstract = {'7': 'Final', '1': 'Preview', '2': 'Preview'}.get(coded,
+                                                                  'Live')
+    decisions = {}
+    if coded == '7':
+        decisions = dict((key, person(n, home)) for (key, n) in (
+            ('winner', 1), ('loser', 31), ('firstStar', 5),
+            ('secondStar', 9), ('thirdStar', 12)))
+    return {
+        'copyright': 'NHL and the NHL Shield are registered trademarks.',
+        'gamePk': gamepk,
+        'link': '/api/v1/game/{}/feed/live'.format(gamepk),
+        'metaData': {'wait': 10, 'timeStamp': timestamp},
+        'gameData': {
+            'game': {'pk': gamepk, 'season': '20162017', 'type': 'P'},
+            'datetime': {'dateTime': '2017-04-12T23:00:00Z'},
+            'status': {'abstractGameState': abstract,
+                       'codedGameState': coded, 'detailedState': state,
+                       'statusCode': coded, 'startTimeTBD': False},
+            'teams': {'away': team(away), 'home': team(home)},
+            'players': players,
+            'venue': {'name': TEAMS[home][4], 'link': '/api/v1/venues/null'}},
+        'liveData': {
+            'plays': {'allPlays': all_plays, 'scoringPlays': scoring,
+                      'penaltyPlays': [],
+                      'playsByPeriod': [
+                          {'startIndex': 0, 'endIndex': plays - 1,
+                           'plays': list(range(plays))}],
+                      'currentPlay': all_plays[-1] if all_plays else {}},
+            'linescore': {
+                'currentPeriod': 3, 'currentPeriodOrdinal': '3rd',
+                'currentPeriodTimeRemaining':
+                    'Final' if coded == '7' else '12:34',
+                'periods': [],
+                'teams': {'home': {'team': team(home),
+                                   'goals': goals['home'],
+                                   'shotsOnGoal': 30},
+                          'away': {'team': team(away),
+                                   'goals': goals['away'],
+                                   'shotsOnGoal': 28}},
+                'powerPlayStrength': 'Even', 'hasShootout': False,
+                'intermissionInfo': {'intermissionTimeRemaining': 0,
+                                     'intermissionTimeElapsed': 0,
+                                     'inIntermission': False}},
+            'boxscore': {'teams': {'away': boxscore('away', away),
+                                   'home': boxscore('home', home)},
+                         'officials': [
+                             {'official': {'fullName': 'Tim Peel'},
+                              'officialType': 'Referee'}]},
+            'decisions': decisions}}
+
+
+# The two games played every day of the synthetic schedule.
+MATCHUPS = [('OTT', 'BOS'), ('NYR', 'MTL')]
+
+
+def gamepk(date, index):
+    """Returns the gamePk of the index-th game of date (a datetime.date)."""
+    return 2016020000 + (date.toordinal() % 1000) * 10 + index
+
+
+def matchup(pk):
+    """Returns (away, home) for a gamePk made by gamepk()."""
+    return MATCHUPS[int(pk) % 10 % len(MATCHUPS)]
+
+
+def schedule(dates, today=None):
+    """Returns a schedule document for the given datetime.date objects.
+    Games before today are Final, today's are in progress and later ones
+    are scheduled."""
+    days = []
+    for date in dates:
+        games = []
+        for (index, (away, home)) in enumerate(MATCHUPS):
+            if today is not None and date > today:
+                status = ('Preview', '1', 'Scheduled')
+            elif today is not None and date == today:
+                status = ('Live', '3', 'In Progress')
+            else:
+                status = ('Final', '7', 'Final')
+            games.append({
+                'gamePk': gamepk(date, index),
+                'link': '/api/v1/game/{}/feed/live'.format(
+                    gamepk(date, index)),
+                'gameType': 'R', 'season': '20162017',
+                'gameDate': '{}T23:00:00Z'.format(date.isoformat()),
+                'status': {'abstractGameState': status[0],
+                           'codedGameState': status[1],
+                           'detailedState': status[2],
+                           'statusCode': status[1]},
+                'teams': {
+                    'away': {'score': 2, 'team': team(away),
+                             'leagueRecord': {'wins': 40, 'losses': 30,
+                                              'ot': 5, 'type': 'league'}},
+                    'home': {'score': 3, 'team': team(home),
+                             'leagueRecord': {'wins': 44, 'losses': 31,
+                                              'ot': 7, 'type': 'league'}}},
+                'linescore': {
+                    'currentPeriod': 2, 'currentPeriodOrdinal': '2nd',
+                    'currentPeriodTimeRemaining': '08:12',
+                    'teams': {'home': {'goals': 3, 'shotsOnGoal': 20},
+                              'away': {'goals': 2, 'shotsOnGoal': 15}},
+                    'intermissionInfo': {'inIntermission': False}},
+                'venue': {'name': TEAMS[home][4]}})
+        days.append({'date': date.isoformat(), 'totalGames': len(games),
+                     'games': games})
+    total = sum(day['totalGames'] for day in days)
+    return {'totalItems': total, 'totalGames': total, 'dates': days}
+
+
+def boxscore(gamepk, away='OTT', home='BOS'):
+    """Returns the /boxscore document of a game (that of its live
+    feed)."""
+    document = feed(gamepk, away, home, plays=40, seed=gamepk)
+    return document['liveData']['boxscore']
+
+
+def teams():
+    """Returns the /teams document."""
+    return {'teams': [team(abbreviation) for abbreviation in sorted(TEAMS)]}
+
+
+def playoffs():
+    """Returns a playoffs tournament document (first round, 8 series)."""
+    series = []
+    for n in range(8):
+        (away, home) = MATCHUPS[n % len(MATCHUPS)]
+        series.append({
+            'seriesNumber': n + 1, 'seriesCode': 'ABCDEFGH'[n],
+            'names': {'matchupName': '{} (1) vs. {} (4)'.format(
+                          TEAMS[home][1], TEAMS[away][1]),
+                      'matchupShortName': '{} v {}'.format(home, away),
+                      'seriesSlug': 'series-{}'.format(n)},
+            'currentGame': {'seriesSummary': {
+                'gamePk': 2016030111 + n * 10, 'gameNumber': 3,
+                'gameLabel': 'Game 3', 'gameTime': '2017-04-17T23:00:00Z',
+                'seriesStatus': '{} leads 2-{}'.format(home, n % 2),
+                'seriesStatusShort': '{} 2-{}'.format(home, n % 2)}},
+            'matchupTeams': [{'team': team(home)}, {'team': team(away)}]})
+    return {'id': 1, 'name': 'Playoffs', 'season': '20162017',
+            'defaultRound': 1,
+            'rounds': [{'number': 1, 'code': 1,
+                        'names': {'name': 'First Round',
+                                  'shortName': 'R1'},
+                        'format': {'name': 'BO7', 'numberOfGames': 7,
+                                   'numberOfWins': 4},
+                        'series': series}]}
+
+
+def report(attendance='17,565'):
+    """Returns a GS HTML report, padded with event rows to the size of a
+    real one."""
+    rows = ''.join(
+        '<tr class="evenColor"><td align="center">{0}</td>'
+        '<td align="center">{1}</td><td align="center">EV</td>'
+        '<td align="center">BOS</td><td>#63 MARCHAND(20), Wrist, Off. '
+        'Zone, 12 ft.</td><td>A: #46 KREJCI(30); #88 PASTRNAK(40)</td>'
+        '</tr>\n'.format(n, '{}:{:02d}'.format(n % 20, n % 60))
+        for n in range(200))
+    return ('<html><head><title>Game Summary</title></head><body>'
+            '<table id="GameInfo"><tr><td align="center">Saturday, April '
+            '12, 2017</td></tr><tr><td align="center">Attendance {} at TD '
+            'Garden</td></tr></table>\n'
+            '<table>{}</table>\n'
+            '<table><tr><td align="center" class="bold">Referee</td>'
+            '<td align="center" class="bold">Linesperson</td></tr>'
+            '<tr><td align="center"><table><tr><td align="left">#20 Tim '
+            'Peel</td></tr><tr><td align="left">#9 Dan O&#39;Rourke</td>'
+            '</tr></table></td><td align="center"><table><tr>'
+            '<td align="left">#50 Scott Cherrey</td></tr><tr>'
+            '<td align="left">#95 Jonny Murray</td></tr></table></td></tr>'
+            '</table></body></html>'.format(attendance, rows))
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -0,0 +1,242 @@
+###
+# Copyright (c) 2017, cottongin
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE
+###
+
+###
+# Includes contributions from Santiago Gil and Jonathan "grateful" Surman
+###
+
+
+"""
+Local stand-in for the upstream APIs the plugin talks to.
+
+It answers the statsapi schedule, live feed (and diffPatch), boxscore,
+teams and playoffs endpoints, the GS HTML reports of nhl.com and tinyurl's
+api-create.php on a single local port, with the synthetic documents of
+fixtures.py. A recorded response can be used instead by putting it in the
+fixtures directory, named after the endpoint: schedule.json, feed_live.json,
+teams.json, playoffs.json or GS.HTM.
+
+Like the real servers it sends ETags (and answers If-None-Match with 304),
+compresses with gzip when asked to and keeps connections alive. An
+artificial latency can be added to every response to mimic the network.
+
+    python benchmarks/stubserver.py [--port PORT] [--latency MS]
+"""
+
+import argparse
+import datetime
+import gzip
+import hashlib
+import http.server
+import json
+import os
+import re
+import sys
+import threading
+import time
+import urllib.parse
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fixtures
+
+
+class StubAPI(object):
+    """Routes a request path to a response body."""
+
+    def __init__(self, fixtures_dir=None, latency=0.0, plays=350):
+        self.fixtures_dir = fixtures_dir
+        self.latency = latency
+        self.plays = plays
+        self.requests = 0
+        self._bodies = {}
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def _recorded(self, name):
+        if self.fixtures_dir is None:
+            return None
+        filename = os.path.join(self.fixtures_dir, name)
+        if not os.path.exists(filename):
+            return None
+        with open(filename, 'rb') as fd:
+            return fd.read()
+
+    def _memoize(self, key, build):
+        with self._lock:
+            body = self._bodies.get(key)
+        if body is None:
+            body = build()
+            with self._lock:
+                self._bodies[key] = body
+        return body
+
+    def route(self, path, query):
+        """Returns (status, content type, body) for a GET request."""
+        with self._lock:
+            self.requests += 1
+        match = re.match(r'/api/v1/game/(\d+)/feed/live$', path)
+        if match:
+            return (200, 'application/json', self.feed(match.group(1)))
+        match = re.match(r'/api/v1/game/(\d+)/boxscore$', path)
+        if match:
+            gamepk = match.group(1)
+            return (200, 'application/json', self._memoize(
+                ('boxscore', gamepk), lambda: json.dumps(fixtures.boxscore(
+                    int(gamepk), *fixtures.matchup(gamepk))).encode()))
+        elif re.match(r'/api/v1/game/\d+/feed/live/diffPatch$', path):
+            # The synthetic feeds never change.
+            return (200, 'application/json', b'[]')
+        elif path == '/api/v1/schedule':
+            return (200, 'application/json', self.schedule(query))
+        elif path == '/api/v1/teams':
+            return (200, 'application/json', self._recorded('teams.json')
+                    or self._memoize('teams', lambda: json.dumps(
+                        fixtures.teams(), indent=2).encode()))
+        elif path == '/api/v1/tournaments/playoffs':
+            return (200, 'application/json', self._recorded('playoffs.json')
+                    or self._memoize('playoffs', lambda: json.dumps(
+                        fixtures.playoffs(), indent=2).encode()))
+        elif re.match(r'/scores/htmlreports/\d+/GS\d+\.HTM$', path):
+            return (200, 'text/html', self._recorded('GS.HTM') or
+                    self._memoize('report',
+                                  lambda: fixtures.report().encode()))
+        elif path == '/api-create.php':
+            digest = hashlib.md5(query.get('url', [''])[0].encode())
+            return (200, 'text/plain', 'http://tinyurl.com/{}'.format(
+                    digest.hexdigest()[:7]).encode())
+        return (404, 'text/plain', b'Not found')
+
+    def schedule(self, query):
+        recorded = self._recorded('schedule.json')
+        if recorded is not None:
+            return recorded
+        def date(name):
+            return datetime.datetime.strptime(query[name][0],
+                                              '%Y-%m-%d').date()
+        (start, end) = (date('startDate'), date('endDate'))
+        dates = [start + datetime.timedelta(days=n)
+                 for n in range((end - start).days + 1)]
+        document = fixtures.schedule(dates, datetime.date.today())
+        if 'teamId' in query:
+            team_id = int(query['teamId'][0])
+            for day in document['dates']:
+                day['games'] = [game for game in day['games']
+                                if team_id in (game['teams'][side]['team']['id']
+                                               for side in ('away', 'home'))]
+        with self._lock:
+            for day in document['dates']:
+                for game in day['games']:
+                    self._states[str(game['gamePk'])] = \
+                        game['status']['detailedState']
+        return json.dumps(document, indent=2).encode()
+
+    def feed(self, gamepk):
+        recorded = self._recorded('feed_live.json')
+        if recorded is not None:
+            return recorded
+        with self._lock:
+            state = self._states.get(gamepk, 'Final')
+        (away, home) = fixtures.matchup(gamepk)
+        return self._memoize(('feed', gamepk, state), lambda: json.dumps(
+            fixtures.feed(int(gamepk), away, home, plays=self.plays,
+                          state=state), indent=2).encode())
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        api = self.server.api
+        if api.latency:
+            time.sleep(api.latency)
+        url = urllib.parse.urlsplit(self.path)
+        (status, content_type, body) = api.route(
+            url.path, urllib.parse.parse_qs(url.query))
+        etag = '"{}"'.format(hashlib.md5(body).hexdigest())
+        if status == 200 and self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('ETag', etag)
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = gzip.compress(body, 5)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(object):
+    """Runs a StubAPI on a local port in a background thread."""
+
+    def __init__(self, api=None, port=0):
+        self.api = api or StubAPI()
+        self.httpd = http.server.ThreadingHTTPServer(('127.0.0.1', port),
+                                                     _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.api = self.api
+        self.url = 'http://127.0.0.1:{}'.format(self.httpd.server_port)
+        self._thread = threading.Thread(target=self.httpd.serve_forever,
+                                        daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stub NHL API server.')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0,
+                        help='milliseconds added to every response')
+    parser.add_argument('--fixtures', help='directory of recorded responses')
+    options = parser.parse_args()
+    server = StubServer(StubAPI(options.fixtures, options.latency / 1000),
+                        options.port)
+    print('Serving the stub NHL API on {}'.format(server.url))
+    server.httpd.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
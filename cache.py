@@ -0,0 +1,384 @@
+###
+# Copyright (c) 2017, cottongin
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE
+###
+
+###
+# Includes contributions from Santiago Gil and Jonathan "grateful" Surman
+###
+
+
+"""
+A small, thread-safe response cache keyed by URL.
+
+Entries expire after a per-entry TTL and the least recently used entry is
+evicted once the cache is full. Each entry also remembers the 'Last-Modified'
+and 'ETag' headers it was served with, so an expired entry can be revalidated
+with a conditional request instead of downloaded again.
+
+When the upstream server fails, an expired entry may still be served; it is
+then flagged as stale until it is refreshed.
+
+Bodies may be kept zlib-compressed (live feeds shrink about tenfold). The
+most recently used ones are also kept decompressed, up to a fraction of the
+memory budget, so that a body that is requested over and over isn't
+decompressed each time. The compressed and the decompressed bodies together
+stay under max_bytes.
+"""
+
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+
+# Bodies shorter than this are never compressed
+COMPRESS_MIN_SIZE = 1024
+
+COMPRESS_LEVEL = 6
+
+# Part of the memory budget that may hold decompressed bodies
+HOT_FRACTION = 0.25
+
+
+class CacheEntry(object):
+    """A cached response body along with its validators."""
+    __slots__ = ('url', 'packed', 'compressed', 'size', 'expires',
+                 'last_modified', 'etag', 'stored', 'stale')
+
+    def __init__(self, url, data, ttl, last_modified=None, etag=None,
+                 compress=False):
+        self.url = url
+        # The body, compressed if that makes it smaller
+        self.packed = data
+        self.compressed = False
+        self.size = len(data)
+        if compress and self.size >= COMPRESS_MIN_SIZE:
+            packed = zlib.compress(data, COMPRESS_LEVEL)
+            if len(packed) < self.size:
+                (self.packed, self.compressed) = (packed, True)
+        self.stored = time.time()
+        self.expires = self.stored + ttl
+        self.last_modified = last_modified
+        self.etag = etag
+        # Served past its expiry because the server failed
+        self.stale = False
+
+    @property
+    def data(self):
+        """The body (decompressed on every access; see
+        ResponseCache.peek)."""
+        if self.compressed:
+            return zlib.decompress(self.packed)
+        return self.packed
+
+    @property
+    def footprint(self):
+        """Number of bytes the entry's body takes in memory."""
+        return len(self.packed)
+
+    def isFresh(self, now=None):
+        return (now or time.time()) < self.expires
+
+    def hasValidators(self):
+        return self.last_modified is not None or self.etag is not None
+
+    def conditionalHeaders(self):
+        """Returns the headers needed to revalidate this entry."""
+        headers = {}
+        if self.etag is not None:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified is not None:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class ResponseCache(object):
+    """Bounded LRU cache of response bodies with per-entry TTLs, holding at
+    most max_entries entries and max_bytes bytes of bodies (if not
+    None)."""
+
+    def __init__(self, max_entries=256, max_bytes=None, compress=False):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self._entries = OrderedDict()
+        # url -> decompressed body of the most recently used compressed
+        # entries
+        self._hot = OrderedDict()
+        self._lock = threading.Lock()
+        # Sizes of the stored bodies, of the decompressed copies and of the
+        # bodies before compression
+        self._bytes = 0
+        self._hotBytes = 0
+        self._rawBytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.revalidations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, url):
+        return url in self._entries
+
+    def get(self, url):
+        """Returns the cached body for url if it is still fresh, otherwise
+        None. Counts as a hit or a miss."""
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is None or not entry.isFresh():
+                self.misses += 1
+                return None
+            self._entries.move_to_end(url)
+            self.hits += 1
+        return self._body(entry)
+
+    def lookup(self, url):
+        """Returns the entry for url whether it is fresh or not, without
+        touching the counters. Used to build conditional requests."""
+        with self._lock:
+            return self._entries.get(url)
+
+    def peek(self, url):
+        """Returns the body for url whether it is fresh or not, or None,
+        without touching the counters."""
+        with self._lock:
+            entry = self._entries.get(url)
+        if entry is None:
+            return None
+        return self._body(entry)
+
+    def _body(self, entry):
+        """Returns the body of entry, decompressed once and kept while it is
+        among the most recently used ones."""
+        if not entry.compressed:
+            return entry.packed
+        with self._lock:
+            data = self._hot.get(entry.url)
+            if data is not None:
+                self._hot.move_to_end(entry.url)
+                return data
+        data = zlib.decompress(entry.packed)
+        with self._lock:
+            if self._entries.get(entry.url) is entry:
+                # Unless another thread did it in the meantime
+                data = self._keepHot(entry.url, data)
+        return data
+
+    def _keepHot(self, url, data):
+        current = self._hot.get(url)
+        if current is not None:
+            self._hot.move_to_end(url)
+            return current
+        self._hot[url] = data
+        self._hotBytes += len(data)
+        self._trim()
+        return data
+
+    def _dropHot(self, url):
+        data = self._hot.pop(url, None)
+        if data is not None:
+            self._hotBytes -= len(data)
+
+    def _drop(self, url):
+        entry = self._entries.pop(url, None)
+        if entry is not None:
+            self._bytes -= entry.footprint
+            self._rawBytes -= entry.size
+        self._dropHot(url)
+
+    def _trim(self):
+        """Evicts decompressed copies, then entries, until the cache is
+        within its limits."""
+        if self.max_bytes is not None:
+            hot_limit = self.max_bytes * HOT_FRACTION
+            while self._hot and (self._hotBytes > hot_limit or
+                                 self._bytes + self._hotBytes >
+                                 self.max_bytes):
+                self._dropHot(next(iter(self._hot)))
+        while self._entries and (
+                len(self._entries) > self.max_entries or
+                (self.max_bytes is not None and
+                 self._bytes + self._hotBytes > self.max_bytes)):
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+
+    def put(self, url, data, ttl, last_modified=None, etag=None):
+        """Stores a freshly downloaded body, evicting the least recently
+        used entries if the cache is full."""
+        entry = CacheEntry(url, data, ttl, last_modified, etag, self.compress)
+        with self._lock:
+            self._drop(url)
+            self._entries[url] = entry
+            self._bytes += entry.footprint
+            self._rawBytes += entry.size
+            if entry.compressed:
+                # The caller is about to use data
+                self._hot[url] = data
+                self._hotBytes += len(data)
+            self._trim()
+        return entry
+
+    def revalidate(self, url, ttl, last_modified=None, etag=None):
+        """Marks the entry for url as fresh again after the server answered
+        a conditional request with '304 Not Modified'. Returns its body."""
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is None:
+                return None
+            entry.expires = time.time() + ttl
+            entry.stale = False
+            if last_modified is not None:
+                entry.last_modified = last_modified
+            if etag is not None:
+                entry.etag = etag
+            self._entries.move_to_end(url)
+            self.revalidations += 1
+        return self._body(entry)
+
+    def extend(self, url, ttl):
+        """Keeps the entry for url fresh for ttl more seconds without
+        touching the counters. Used by the background poller."""
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is not None:
+                entry.expires = time.time() + ttl
+
+    def markStale(self, url):
+        """Flags the entry for url as served past its expiry. Returns its
+        body, or None if there is no entry."""
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is None:
+                return None
+            entry.stale = True
+        return self._body(entry)
+
+    def isStale(self, url):
+        with self._lock:
+            entry = self._entries.get(url)
+            return entry is not None and entry.stale
+
+    def invalidate(self, url):
+        with self._lock:
+            self._drop(url)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._hot.clear()
+            self._bytes = self._hotBytes = self._rawBytes = 0
+
+    def resize(self, max_entries, max_bytes=None):
+        """Changes the maximum number of entries (and bytes), evicting if
+        needed."""
+        with self._lock:
+            self.max_entries = max_entries
+            self.max_bytes = max_bytes
+            self._trim()
+
+    def stats(self):
+        """Returns a dict with the cache counters."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'revalidations': self.revalidations,
+                'hit_ratio': (self.hits / lookups) if lookups else 0.0,
+                'bytes': self._bytes,
+                'hot_bytes': self._hotBytes,
+                'raw_bytes': self._rawBytes,
+                'max_bytes': self.max_bytes,
+                # How much smaller the bodies are in the cache
+                'compression_ratio': ((self._rawBytes / self._bytes)
+                                      if self._bytes else 1.0),
+            }
+
+
+class _Call(object):
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """Coalesces concurrent calls for the same key: the first caller runs
+    the function and every caller that arrives while it is running waits
+    for it and gets the same result (or exception)."""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.saved = 0
+
+    def do(self, key, f, *args):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                leader = True
+                self.calls += 1
+            else:
+                leader = False
+                self.saved += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = f(*args)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def inFlight(self):
+        with self._lock:
+            return len(self._calls)
+
+    def stats(self):
+        with self._lock:
+            return {'calls': self.calls, 'saved': self.saved,
+                    'in_flight': len(self._calls)}
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -0,0 +1,152 @@
+###
+# Copyright (c) 2017, cottongin
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE
+###
+
+###
+# Includes contributions from Santiago Gil and Jonathan "grateful" Surman
+###
+
+
+"""
+Shared HTTP client used for every upstream request the plugin makes.
+
+A single requests.Session keeps a pool of keep-alive connections per host,
+so repeated calls to statsapi.web.nhl.com, nhl.com and tinyurl.com reuse an
+open TCP/TLS connection instead of doing a new handshake every time.
+Responses are negotiated with gzip/deflate and decompressed transparently.
+
+Requests go through the HostGuard of their host (see the resilience module)
+and transient failures (connection errors, timeouts, 429 and 5xx statuses)
+are retried a few times with an exponential backoff.
+
+If an Engine is given (see the engine module and fetch.engine), it sends
+the requests instead of the session, from its event loop.
+"""
+
+import random
+import time
+import urllib.parse
+
+import requests
+import requests.adapters
+
+from . import resilience
+
+
+USER_AGENT = ('Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:45.0) '
+              'Gecko/20100101 Firefox/45.0')
+
+# Statuses worth retrying (and counting as a failure of the host)
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+
+class HTTPClient(object):
+    """Thin wrapper around a pooled requests.Session."""
+
+    def __init__(self, pool_connections=4, pool_maxsize=8,
+                 connect_timeout=5.0, read_timeout=10.0, retries=2,
+                 backoff=0.5, guards=None, engine=None):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        # Delay before the first retry, doubled for each next one
+        self.backoff = backoff
+        self.guards = guards or resilience.HostGuards()
+        self.engine = engine
+        self.session = requests.Session()
+        self.session.headers.update({
+            'User-Agent': USER_AGENT,
+            'Accept-Encoding': 'gzip, deflate',
+        })
+        # pool_connections is the number of hosts that keep a pool,
+        # pool_maxsize the number of connections kept open per host.
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def get(self, url, headers=None, timeout=None):
+        """Issues a GET request and returns the requests.Response. Redirects
+        are followed; HTTP error statuses are left to the caller (once the
+        retries are exhausted). Raises UpstreamUnavailable if the host's
+        guard doesn't let the request through."""
+        if timeout is None:
+            timeout = (self.connect_timeout, self.read_timeout)
+        guard = self.guards.get(urllib.parse.urlsplit(url).netloc)
+        attempt = 0
+        while True:
+            guard.enter(self.read_timeout)
+            try:
+                response = self._send(url, headers, timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                (response, error) = (None, e)
+            except Exception:
+                # Not worth retrying, but it's a failure of the host all the
+                # same (and it must end a probe, or the circuit would stay
+                # half-open).
+                guard.breaker.failure()
+                raise
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    guard.breaker.success()
+                    return response
+                error = None
+            if guard.breaker.failure() or attempt >= self.retries:
+                if error is not None:
+                    raise error
+                return response
+            attempt += 1
+            time.sleep(self._delay(attempt, response))
+
+    def _send(self, url, headers, timeout):
+        if self.engine is None:
+            return self.session.get(url, headers=headers, timeout=timeout)
+        merged = dict(self.session.headers)
+        merged.update(headers or {})
+        return self.engine.get(url, merged, timeout)
+
+    def _delay(self, attempt, response):
+        """Returns the number of seconds to wait before the attempt-th
+        retry: the server's Retry-After if it's a reasonable number of
+        seconds, otherwise an exponential backoff with some jitter."""
+        delay = (self.backoff * 2 ** (attempt - 1) *
+                 random.uniform(0.75, 1.0))
+        if response is not None:
+            try:
+                delay = max(delay, float(response.headers['Retry-After']))
+            except (KeyError, ValueError):
+                pass
+        return min(delay, self.read_timeout)
+
+    def close(self):
+        self.session.close()
+        if self.engine is not None:
+            self.engine.close()
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
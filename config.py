@@ -56,5 +56,194 @@ NHL = conf.registerPlugin('NHL')
 # conf.registerGlobalValue(NBA, 'someConfigVariableName',
 #     registry.Boolean(False, _("""Help for someConfigVariableName.""")))
 
+conf.registerGroup(NHL, 'fetch')
+conf.registerGlobalValue(NHL.fetch, 'timeout',
+    registry.PositiveFloat(10.0, _("""Maximum number of seconds to wait for
+    upstream data (game feed, HTML report, short links) before replying
+    without it.""")))
+conf.registerGlobalValue(NHL.fetch, 'connectTimeout',
+    registry.PositiveFloat(5.0, _("""Maximum number of seconds to wait for a
+    connection to an upstream server to be established.""")))
+conf.registerGlobalValue(NHL.fetch, 'poolConnections',
+    registry.PositiveInteger(4, _("""Number of upstream hosts for which a
+    pool of keep-alive connections is kept. Takes effect when the plugin is
+    reloaded.""")))
+conf.registerGlobalValue(NHL.fetch, 'poolSize',
+    registry.PositiveInteger(8, _("""Number of keep-alive connections kept
+    open per upstream host. Takes effect when the plugin is reloaded.""")))
+conf.registerGlobalValue(NHL.fetch, 'workers',
+    registry.PositiveInteger(8, _("""Number of threads used to fetch
+    upstream data concurrently. Takes effect when the plugin is
+    reloaded.""")))
+conf.registerGlobalValue(NHL.fetch, 'engine',
+    registry.Boolean(False, _("""Determines whether the upstream requests
+    are sent from a single shared event loop (in a thread of its own)
+    instead of from the thread of each command, which bounds the number of
+    open sockets and requests in flight under load. Takes effect when the
+    plugin is reloaded.""")))
+conf.registerGlobalValue(NHL.fetch, 'engineConcurrency',
+    registry.PositiveInteger(16, _("""Number of upstream requests the event
+    loop (see fetch.engine) sends at once. Takes effect when the plugin is
+    reloaded.""")))
+conf.registerGlobalValue(NHL.fetch, 'engineBacklog',
+    registry.PositiveInteger(64, _("""Number of upstream requests that may
+    wait for the event loop (see fetch.engine). Past that, commands wait at
+    most fetch.timeout seconds and then fail (or reply with stale data).
+    Takes effect when the plugin is reloaded.""")))
+conf.registerGlobalValue(NHL.fetch, 'retries',
+    registry.NonNegativeInteger(2, _("""Number of times a request that
+    failed with a connection error, a timeout or a 429/5xx status is retried
+    (with an exponential backoff). Takes effect when the plugin is
+    reloaded.""")))
+conf.registerGlobalValue(NHL.fetch, 'rateLimit',
+    registry.PositiveFloat(5.0, _("""Sustained number of requests per second
+    sent to each upstream host. Takes effect when the plugin is
+    reloaded.""")))
+conf.registerGlobalValue(NHL.fetch, 'rateBurst',
+    registry.PositiveInteger(10, _("""Number of requests that may be sent to
+    an upstream host at once, above the sustained rate. Takes effect when
+    the plugin is reloaded.""")))
+conf.registerGlobalValue(NHL.fetch, 'breakerThreshold',
+    registry.PositiveInteger(5, _("""Number of consecutive failures after
+    which requests to an upstream host are no longer sent for a while (and
+    stale data is served from the cache instead). Takes effect when the
+    plugin is reloaded.""")))
+conf.registerGlobalValue(NHL.fetch, 'breakerCooldown',
+    registry.PositiveInteger(30, _("""Number of seconds to wait before trying
+    a failing upstream host again. The wait doubles each time the host
+    still fails, up to 10 minutes. Takes effect when the plugin is
+    reloaded.""")))
+
+conf.registerGroup(NHL, 'cache')
+conf.registerGlobalValue(NHL.cache, 'maxEntries',
+    registry.PositiveInteger(256, _("""Maximum number of upstream responses
+    kept in memory. The least recently used response is dropped when the
+    cache is full. Takes effect when the plugin is reloaded.""")))
+conf.registerGlobalValue(NHL.cache, 'maxBytes',
+    registry.NonNegativeInteger(32 * 2**20, _("""Maximum number of bytes
+    the cached upstream responses take in memory (0 means no limit). The
+    least recently used responses are dropped beyond that. Takes effect when
+    the plugin is reloaded.""")))
+conf.registerGlobalValue(NHL.cache, 'compress',
+    registry.Boolean(True, _("""Determines whether the cached upstream
+    responses are kept zlib-compressed in memory. Takes effect when the
+    plugin is reloaded.""")))
+conf.registerGlobalValue(NHL.cache, 'maxStale',
+    registry.NonNegativeInteger(3600, _("""Number of seconds past its expiry
+    a cached response may still be served, marked as stale, when the
+    upstream server fails. 0 disables it.""")))
+conf.registerGlobalValue(NHL.cache, 'staleWhileRevalidate',
+    registry.NonNegativeInteger(0, _("""Number of seconds past its expiry a
+    cached response is served right away while it is revalidated in the
+    background. 0 always waits for the revalidation.""")))
+
+conf.registerGroup(NHL.cache, 'ttl')
+conf.registerGlobalValue(NHL.cache.ttl, 'schedule',
+    registry.NonNegativeInteger(60, _("""Number of seconds a schedule
+    response is served from the cache before it is revalidated.""")))
+conf.registerGlobalValue(NHL.cache.ttl, 'liveFeed',
+    registry.NonNegativeInteger(10, _("""Number of seconds a game's live
+    feed is served from the cache before it is revalidated.""")))
+conf.registerGlobalValue(NHL.cache.ttl, 'report',
+    registry.NonNegativeInteger(300, _("""Number of seconds an HTML game
+    report is served from the cache before it is revalidated.""")))
+conf.registerGlobalValue(NHL.cache.ttl, 'playoffs',
+    registry.NonNegativeInteger(300, _("""Number of seconds the playoffs
+    bracket is served from the cache before it is revalidated while a series
+    game is being played. Otherwise it is kept until the next game
+    starts.""")))
+conf.registerGlobalValue(NHL.cache.ttl, 'teams',
+    registry.NonNegativeInteger(7 * 24 * 3600, _("""Number of seconds the
+    list of teams (used to recognize team names, nicknames and cities) is
+    kept, in memory and in the store, before it is downloaded again.""")))
+conf.registerGlobalValue(NHL.cache.ttl, 'default',
+    registry.NonNegativeInteger(60, _("""Number of seconds any other
+    response is served from the cache before it is revalidated.""")))
+
+conf.registerGroup(NHL, 'schedule')
+conf.registerGlobalValue(NHL.schedule, 'daysBefore',
+    registry.NonNegativeInteger(1, _("""Number of days before today included
+    in the schedule window, which is downloaded and indexed in a single
+    request.""")))
+conf.registerGlobalValue(NHL.schedule, 'daysAfter',
+    registry.NonNegativeInteger(6, _("""Number of days after today included
+    in the schedule window, which is downloaded and indexed in a single
+    request.""")))
+conf.registerGlobalValue(NHL.schedule, 'maxAge',
+    registry.PositiveInteger(3600, _("""Number of seconds after which the
+    indexed schedule is downloaded again (to pick up postponed or
+    rescheduled games).""")))
+
+conf.registerGroup(NHL, 'store')
+conf.registerGlobalValue(NHL.store, 'enable',
+    registry.Boolean(True, _("""Determines whether the data of finished
+    games (live feed, HTML report, short links) is kept on disk and served
+    from there instead of being downloaded again. Takes effect when the
+    plugin is reloaded.""")))
+conf.registerGlobalValue(NHL.store, 'maxSize',
+    registry.PositiveInteger(64 * 1024 * 1024, _("""Maximum size in bytes of
+    the stored (compressed) data. The games stored the longest ago are
+    dropped first.""")))
+conf.registerGlobalValue(NHL.store, 'warmGames',
+    registry.NonNegativeInteger(20, _("""Number of most recently stored games
+    loaded into the memory cache when the plugin is loaded.""")))
+
+conf.registerGroup(NHL, 'poller')
+conf.registerGlobalValue(NHL.poller, 'enable',
+    registry.Boolean(False, _("""Determines whether the live feeds of the
+    games in progress are refreshed in the background, so that commands
+    about them are answered without waiting on the NHL API.""")))
+conf.registerGlobalValue(NHL.poller, 'scanInterval',
+    registry.PositiveInteger(300, _("""Number of seconds between two scans
+    of today's schedule looking for games to track. Takes effect when the
+    plugin is reloaded.""")))
+conf.registerGlobalValue(NHL.poller, 'lookahead',
+    registry.NonNegativeInteger(30, _("""Number of minutes before the start
+    of a game at which the poller starts tracking it.""")))
+conf.registerGlobalValue(NHL.poller, 'diffPatch',
+    registry.Boolean(True, _("""Determines whether the poller only downloads
+    the changes to the live feed of a game (from the diffPatch endpoint)
+    once it has downloaded the whole feed, instead of the whole feed every
+    time.""")))
+conf.registerGroup(NHL.poller, 'interval')
+conf.registerGlobalValue(NHL.poller.interval, 'live',
+    registry.PositiveInteger(15, _("""Number of seconds between two refreshes
+    of a game's live feed while the game is being played.""")))
+conf.registerGlobalValue(NHL.poller.interval, 'intermission',
+    registry.PositiveInteger(120, _("""Number of seconds between two
+    refreshes of a game's live feed during an intermission.""")))
+conf.registerGlobalValue(NHL.poller.interval, 'pregame',
+    registry.PositiveInteger(300, _("""Number of seconds between two
+    refreshes of a game's live feed before the game starts.""")))
+
+conf.registerGroup(NHL, 'alerts')
+conf.registerGlobalValue(NHL.alerts, 'enable',
+    registry.Boolean(False, _("""Determines whether the goals, game starts
+    and final scores of the teams followed by channels (see nhlfollow) are
+    announced. The games of the followed teams are then tracked by the
+    poller even if poller.enable is off.""")))
+conf.registerChannelValue(NHL.alerts, 'teams',
+    registry.SpaceSeparatedSetOfStrings(set(), _("""Abbreviations of the
+    teams whose goals, game starts and final scores are announced in the
+    channel.""")))
+
+conf.registerGroup(NHL, 'output')
+conf.registerChannelValue(NHL.output, 'coalesce',
+    registry.Boolean(True, _("""Determines whether the lines of a reply
+    (summary, nhlplayoffs, alerts) are joined into as few messages as the
+    line length allows, so that the whole reply isn't slowed down by the
+    flood protection.""")))
+conf.registerChannelValue(NHL.output, 'compact',
+    registry.Boolean(False, _("""Determines whether the replies are sent
+    without formatting (bold, colors) and padding, so that more of them fits
+    in each message.""")))
+
+conf.registerGroup(NHL, 'metrics')
+conf.registerGlobalValue(NHL.metrics, 'logSpans',
+    registry.Boolean(False, _("""Determines whether the duration of every
+    timed step (upstream fetches, parsing, reply formatting, commands) is
+    logged as a 'span=<name> ms=<duration> key=value...' line, in addition to
+    being counted in the statistics shown by the nhlstats command.""")))
+
 
 # vim:set shiftwidth=4 tabstop=4 expandtab textwidth=79:
@@ -0,0 +1,287 @@
+###
+# Copyright (c) 2017, cottongin
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE
+###
+
+###
+# Includes contributions from Santiago Gil and Jonathan "grateful" Surman
+###
+
+
+"""
+Optional asyncio engine for the upstream requests (see fetch.engine).
+
+Limnoria runs every command of a threaded plugin in a thread of its own, and
+each of those threads used to block on its own sockets. With the engine,
+the requests of every thread run on a single event loop in one dedicated
+thread: the command threads only submit them and wait for the result.
+
+* At most `concurrency` requests are on the network at once, over a pool of
+  keep-alive connections per host.
+* At most `backlog` more wait for their turn. Past that, a caller waits up
+  to its read timeout for room and then gets EngineBusy, a
+  requests.RequestException, so it is handled like any failed request.
+
+The engine speaks just enough HTTP/1.1 for the plugin's GET requests
+(keep-alive, chunked bodies, gzip/deflate, redirects) and returns
+requests.Response objects, so it is a drop-in for requests.Session.get in
+HTTPClient.
+"""
+
+import asyncio
+import concurrent.futures
+import ssl
+import threading
+import urllib.parse
+import zlib
+
+import requests
+import requests.structures
+import requests.utils
+
+
+# Redirections followed before giving up
+MAX_REDIRECTS = 5
+
+_REDIRECTS = frozenset([301, 302, 303, 307, 308])
+
+
+class EngineBusy(requests.RequestException):
+    """Too many requests are waiting for the engine."""
+
+
+class _Origin(object):
+    """Where a URL's requests go: (scheme, host, port) and the request
+    target."""
+    __slots__ = ('key', 'host', 'target')
+
+    def __init__(self, url):
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            raise requests.exceptions.InvalidSchema(url)
+        port = parts.port or (443 if parts.scheme == 'https' else 80)
+        self.key = (parts.scheme, parts.hostname, port)
+        self.host = parts.netloc
+        self.target = parts.path or '/'
+        if parts.query:
+            self.target += '?' + parts.query
+
+
+class Engine(object):
+    """An event loop running in its own thread, and the connections it keeps
+    open."""
+
+    def __init__(self, concurrency=16, backlog=64, pool_maxsize=8):
+        self.concurrency = concurrency
+        self.backlog = backlog
+        self.pool_maxsize = pool_maxsize
+        # Room for the requests being sent and those waiting for their turn
+        self._slots = threading.BoundedSemaphore(concurrency + backlog)
+        # Created on the loop (see _limit)
+        self._running = None
+        # (scheme, host, port) -> idle (reader, writer) pairs
+        self._idle = {}
+        self._ssl = ssl.create_default_context()
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run,
+                                        name='NHL I/O engine', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+        self._loop.close()
+
+    def get(self, url, headers=None, timeout=(5.0, 10.0)):
+        """Sends a GET request from the loop and waits for the
+        requests.Response. timeout is a number of seconds or a (connect,
+        read) tuple, like for requests."""
+        if not isinstance(timeout, tuple):
+            timeout = (timeout, timeout)
+        if not self._slots.acquire(timeout=timeout[1]):
+            raise EngineBusy('{} requests are already waiting'.format(
+                             self.backlog))
+        try:
+            future = asyncio.run_coroutine_threadsafe(
+                self._get(url, dict(headers or {}), timeout), self._loop)
+            try:
+                # Bounds the wait for a turn too
+                return future.result(2 * sum(timeout))
+            except concurrent.futures.TimeoutError:
+                future.cancel()
+                raise requests.Timeout(url)
+        finally:
+            self._slots.release()
+
+    async def _get(self, url, headers, timeout):
+        if self._running is None:
+            self._running = asyncio.Semaphore(self.concurrency)
+        async with self._running:
+            for i in range(MAX_REDIRECTS + 1):
+                response = await self._request(url, headers, timeout)
+                location = response.headers.get('location')
+                if response.status_code not in _REDIRECTS or not location:
+                    return response
+                url = urllib.parse.urljoin(url, location)
+            raise requests.TooManyRedirects(url)
+
+    async def _request(self, url, headers, timeout):
+        origin = _Origin(url)
+        lines = ['GET {} HTTP/1.1'.format(origin.target),
+                 'Host: {}'.format(origin.host)]
+        lines.extend('{}: {}'.format(name, value)
+                     for (name, value) in headers.items())
+        request = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+        (connection, reused) = await self._connect(origin, timeout[0])
+        try:
+            (reader, writer) = connection
+            writer.write(request)
+            (response, reusable) = await asyncio.wait_for(
+                self._response(reader, url), timeout[1])
+        except asyncio.TimeoutError:
+            connection[1].close()
+            raise requests.ReadTimeout(url)
+        except zlib.error as e:
+            connection[1].close()
+            raise requests.exceptions.ContentDecodingError(e)
+        except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+            connection[1].close()
+            if reused:
+                # The server closed the idle connection: try a new one.
+                return await self._request(url, headers, timeout)
+            raise requests.ConnectionError(e)
+        except BaseException:
+            # Cancelled (the caller gave up waiting) or anything else: the
+            # connection is left mid-response, so it can't be reused.
+            connection[1].close()
+            raise
+        if reusable and \
+                response.headers.get('connection', '').lower() != 'close':
+            self._release(origin, connection)
+        else:
+            connection[1].close()
+        return response
+
+    async def _connect(self, origin, timeout):
+        """Returns ((reader, writer), reused): an idle connection to origin,
+        or a new one."""
+        idle = self._idle.get(origin.key)
+        while idle:
+            connection = idle.pop()
+            if not connection[1].is_closing():
+                return (connection, True)
+        (scheme, host, port) = origin.key
+        try:
+            connection = await asyncio.wait_for(asyncio.open_connection(
+                host, port, ssl=self._ssl if scheme == 'https' else None),
+                timeout)
+        except asyncio.TimeoutError:
+            raise requests.ConnectTimeout(origin.host)
+        except OSError as e:
+            raise requests.ConnectionError(e)
+        return (connection, False)
+
+    def _release(self, origin, connection):
+        idle = self._idle.setdefault(origin.key, [])
+        if len(idle) < self.pool_maxsize:
+            idle.append(connection)
+        else:
+            connection[1].close()
+
+    async def _response(self, reader, url):
+        """Reads a response off reader. Returns (response, whether the
+        connection can be reused)."""
+        status_line = (await reader.readuntil(b'\r\n')).decode('latin-1')
+        (version, status, reason) = (status_line.strip().split(' ', 2) +
+                                     [''])[:3]
+        headers = requests.structures.CaseInsensitiveDict()
+        while True:
+            line = (await reader.readuntil(b'\r\n')).decode('latin-1')
+            if line == '\r\n':
+                break
+            (name, value) = line.split(':', 1)
+            (name, value) = (name.strip(), value.strip())
+            if name in headers:
+                value = headers[name] + ', ' + value
+            headers[name] = value
+
+        reusable = True
+        status = int(status)
+        if status in (204, 304) or 100 <= status < 200:
+            body = b''
+        elif headers.get('transfer-encoding', '').lower() == 'chunked':
+            body = await self._chunked(reader)
+        elif 'content-length' in headers:
+            body = await reader.readexactly(int(headers['content-length']))
+        else:
+            body = await reader.read()
+            reusable = False
+
+        encoding = headers.get('content-encoding', '').lower()
+        if encoding == 'gzip':
+            body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+        elif encoding == 'deflate':
+            body = zlib.decompress(body)
+
+        response = requests.Response()
+        response.status_code = status
+        response.reason = reason
+        response.headers = headers
+        response.url = url
+        response._content = body
+        response.encoding = requests.utils.get_encoding_from_headers(headers)
+        return (response, reusable)
+
+    async def _chunked(self, reader):
+        chunks = []
+        while True:
+            size = int((await reader.readuntil(b'\r\n')).split(b';')[0], 16)
+            if not size:
+                # Skip the trailers
+                while await reader.readuntil(b'\r\n') != b'\r\n':
+                    pass
+                return b''.join(chunks)
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+
+    def idleConnections(self):
+        return sum(len(idle) for idle in list(self._idle.values()))
+
+    def close(self):
+        """Closes the connections and stops the loop."""
+        def stop():
+            for idle in self._idle.values():
+                for (reader, writer) in idle:
+                    writer.close()
+            self._idle.clear()
+            self._loop.stop()
+        if self._loop.is_running():
+            self._loop.call_soon_threadsafe(stop)
+            self._thread.join(5)
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
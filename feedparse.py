@@ -0,0 +1,289 @@
+###
+# Copyright (c) 2017, cottongin
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE
+###
+
+###
+# Includes contributions from Santiago Gil and Jonathan "grateful" Surman
+###
+
+
+"""
+Selective parsing of the game 'feed/live' document.
+
+Late in a game the live feed is several megabytes, most of it being every
+event of the game (liveData.plays.allPlays) and per-player data that the
+plugin never reads. json.loads would turn all of it into Python objects.
+parseFeed walks the document with the C scanner of the json module instead,
+and only materializes the subtrees listed in a spec. Unwanted values are
+decoded one member at a time and dropped right away, and allPlays is reduced
+to the scoring plays (using the liveData.plays.scoringPlays indices).
+
+The result has the same shape as the full document, restricted to the
+selected keys, so code reading the full document keeps working. Note that in
+the result allPlays only holds the scoring plays, in order, while
+scoringPlays still holds their indices in the full allPlays list.
+
+Plays are only ever appended to allPlays while a game goes on. Given the
+PlayIndex of the previous version of a game's feed, parseFeed checks that
+the new allPlays starts with the same text (comparing a hash) and only
+decodes the plays that were appended since.
+"""
+
+import json
+import re
+
+
+# A spec maps the keys to keep to True (keep the whole value), to another
+# spec (keep only some keys of an object) or to SCORING_PLAYS (keep only
+# the scoring plays of the array).
+SCORING_PLAYS = object()
+
+_TEAM = {'team': True, 'teamStats': True}
+
+FEED_SPEC = {
+    'gamePk': True,
+    'link': True,
+    'metaData': True,
+    'gameData': {
+        'game': True,
+        'datetime': True,
+        'status': True,
+        'teams': True,
+        'venue': True,
+    },
+    'liveData': {
+        'plays': {
+            'allPlays': SCORING_PLAYS,
+            'scoringPlays': True,
+        },
+        'linescore': True,
+        'boxscore': {
+            'teams': {'away': _TEAM, 'home': _TEAM},
+            'officials': True,
+        },
+        'decisions': True,
+    },
+}
+
+class PlayIndex(object):
+    """What parseFeed learned from the allPlays array of the previous
+    version of a game's feed: the number of plays, the length and hash of
+    their text, and the kept (scoring) plays among them with their
+    positions. It is updated by each parseFeed it is given to."""
+    __slots__ = ('count', 'length', 'digest', 'positions', 'plays')
+
+    def __init__(self):
+        self.count = 0
+        self.length = 0
+        self.digest = None
+        self.positions = ()
+        self.plays = ()
+
+
+_decoder = json.JSONDecoder()
+_scanstring = json.decoder.scanstring
+_whitespace = re.compile(r'[ \t\n\r]*')
+_scoring_key = re.compile(r'"scoringPlays"\s*:\s*')
+
+
+def parseFeed(body, spec=FEED_SPEC, index=None):
+    """Parses body (bytes or str), keeping only what spec selects. index is
+    the PlayIndex of the game, if the previous version of its feed was
+    parsed with one."""
+    if isinstance(body, bytes):
+        body = body.decode('utf-8')
+    selector = _Selector(body, _scoringPlays(body), index)
+    (value, end) = selector.value(0, spec)
+    end = selector.skipWhitespace(end)
+    if end != len(body):
+        raise ValueError('Extra data at char {}'.format(end))
+    return value
+
+
+def _scoringPlays(text):
+    """Returns the set of indices listed in liveData.plays.scoringPlays, or
+    None if they can't be found (plays are then filtered by type)."""
+    idx = text.rfind('"scoringPlays"')
+    if idx == -1:
+        return None
+    match = _scoring_key.match(text, idx)
+    if match is None:
+        return None
+    try:
+        (indices, end) = _decoder.raw_decode(text, match.end())
+    except ValueError:
+        return None
+    if not isinstance(indices, list):
+        return None
+    return set(indices)
+
+
+class _Selector(object):
+    def __init__(self, text, scoring, index=None):
+        self.text = text
+        self.scoring = scoring
+        self.index = index
+        # End of the last element decoded by array() and the number of
+        # elements up to it
+        self.last = None
+        self.count = 0
+
+    def skipWhitespace(self, idx):
+        return _whitespace.match(self.text, idx).end()
+
+    def value(self, idx, spec):
+        """Returns (value, end) for the value at idx, pruned by spec."""
+        idx = self.skipWhitespace(idx)
+        opening = self.text[idx:idx + 1]
+        if isinstance(spec, dict) and opening == '{':
+            return self.object(idx, spec)
+        elif spec is SCORING_PLAYS and opening == '[':
+            return self.plays(idx)
+        # spec is True, or the document doesn't have the expected shape:
+        # keep the value as it is.
+        return _decoder.raw_decode(self.text, idx)
+
+    def object(self, idx, spec):
+        """Returns (object, end) for the object at idx, keeping only the
+        members listed in spec. If spec is None every member is decoded
+        and dropped right away."""
+        text = self.text
+        skip = self.skipWhitespace
+        result = {}
+        idx = skip(idx + 1)
+        if text[idx] == '}':
+            return (result, idx + 1)
+        while True:
+            if text[idx] != '"':
+                raise ValueError('Expecting property name at char '
+                                 '{}'.format(idx))
+            (key, idx) = _scanstring(text, idx + 1)
+            idx = skip(idx)
+            if text[idx] != ':':
+                raise ValueError("Expecting ':' at char {}".format(idx))
+            if spec is None:
+                idx = _decoder.raw_decode(text, skip(idx + 1))[1]
+            elif key in spec:
+                (result[key], idx) = self.value(idx + 1, spec[key])
+            else:
+                idx = self.skip(skip(idx + 1))
+            idx = skip(idx)
+            if text[idx] == ',':
+                idx = skip(idx + 1)
+            elif text[idx] == '}':
+                return (result, idx + 1)
+            else:
+                raise ValueError("Expecting ',' or '}}' at char "
+                                 "{}".format(idx))
+
+    def array(self, idx, keep, position=0, result=None):
+        """Returns (list, end) for the array at idx, keeping the elements
+        for which keep(position, element) is true. With a position, idx is
+        the end of the element before it and result what was kept so far."""
+        text = self.text
+        skip = self.skipWhitespace
+        if result is None:
+            result = []
+        if position:
+            idx = skip(idx)
+        else:
+            idx = skip(idx + 1)
+            if text[idx] == ']':
+                return (result, idx + 1)
+        while position:
+            # Resuming: there is a separator to go past first.
+            if text[idx] == ',':
+                idx = skip(idx + 1)
+                break
+            elif text[idx] == ']':
+                return (result, idx + 1)
+            raise ValueError("Expecting ',' or ']' at char {}".format(idx))
+        while True:
+            (element, idx) = _decoder.raw_decode(text, idx)
+            if keep(position, element):
+                result.append(element)
+            position += 1
+            (self.last, self.count) = (idx, position)
+            idx = skip(idx)
+            if text[idx] == ',':
+                idx = skip(idx + 1)
+            elif text[idx] == ']':
+                return (result, idx + 1)
+            else:
+                raise ValueError("Expecting ',' or ']' at char "
+                                 "{}".format(idx))
+
+    def plays(self, idx):
+        if self.scoring is not None:
+            scoring = self.scoring
+            wanted = lambda position, play: position in scoring
+        else:
+            wanted = lambda position, play: (play.get('result', {})
+                                             .get('eventTypeId') == 'GOAL')
+        index = self.index
+        if index is None:
+            return self.array(idx, wanted)
+        (position, start, result, positions) = (0, idx, None, [])
+        if index.count and \
+                hash(self.text[idx:idx + index.length]) == index.digest and \
+                (self.scoring is None or
+                 tuple(p for p in sorted(self.scoring)
+                       if p < index.count) == index.positions):
+            # Same first plays as last time: carry on after them.
+            (position, start) = (index.count, idx + index.length)
+            (result, positions) = (list(index.plays), list(index.positions))
+        def keep(position, play):
+            if wanted(position, play):
+                positions.append(position)
+                return True
+            return False
+        self.last = None
+        self.count = position
+        (result, end) = self.array(start, keep, position, result)
+        if self.last is not None:
+            # Remember the plays of this version for the next one.
+            index.count = self.count
+            index.length = self.last - idx
+            index.digest = hash(self.text[idx:self.last])
+            index.positions = tuple(positions)
+            index.plays = tuple(result)
+        return (result, end)
+
+    def skip(self, idx):
+        """Returns the end of the value at idx without keeping it. The
+        members of a container are decoded and dropped one at a time, so
+        that a large unwanted subtree is never held in memory as a whole."""
+        opening = self.text[idx:idx + 1]
+        if opening == '{':
+            return self.object(idx, None)[1]
+        elif opening == '[':
+            return self.array(idx, lambda position, element: False)[1]
+        return _decoder.raw_decode(self.text, idx)[1]
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -0,0 +1,131 @@
+###
+# Copyright (c) 2017, cottongin
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE
+###
+
+###
+# Includes contributions from Santiago Gil and Jonathan "grateful" Surman
+###
+
+
+"""
+In-memory index of the NHL schedule over a window of dates.
+
+The schedule endpoint accepts a date range, so the whole window (by default
+yesterday through next week) is downloaded in a single request and indexed
+by date and by (date, team abbreviation). Resolving a team to its game is then
+a dict lookup instead of a download and a scan of the league's slate. As the
+window rolls forward only the dates that are new to it are fetched.
+"""
+
+import datetime
+import threading
+import time
+
+
+def dateRange(start, end):
+    """Returns the 'YYYY-MM-DD' strings from start to end, both included."""
+    first = datetime.datetime.strptime(start, '%Y-%m-%d').date()
+    last = datetime.datetime.strptime(end, '%Y-%m-%d').date()
+    return [(first + datetime.timedelta(days=n)).isoformat()
+            for n in range((last - first).days + 1)]
+
+
+class ScheduleIndex(object):
+    """Games of a window of dates, indexed by date and by (date, team).
+
+    fetch(start, end) must return the parsed schedule payload for the dates
+    from start to end."""
+
+    def __init__(self, fetch):
+        self._fetch = fetch
+        self._lock = threading.Lock()
+        # date -> list of game records, in schedule order
+        self._days = {}
+        # (date, team abbreviation) -> list of game records
+        self._teams = {}
+        # date -> time it was last fetched
+        self._fetched = {}
+
+    def ensure(self, start, end, max_age):
+        """Makes sure every date from start to end is indexed and was fetched
+        less than max_age seconds ago. The missing or outdated dates are
+        fetched with a single request."""
+        now = time.time()
+        with self._lock:
+            stale = [d for d in dateRange(start, end)
+                     if now - self._fetched.get(d, 0) > max_age]
+        if not stale:
+            return
+        payload = self._fetch(stale[0], stale[-1])
+        self.update(payload, dateRange(stale[0], stale[-1]), now)
+
+    def update(self, payload, dates, fetched=None):
+        """Replaces the games of the given dates with those in payload."""
+        days = dict((d, []) for d in dates)
+        for day in payload.get('dates', []):
+            days.setdefault(day['date'], []).extend(day['games'])
+        fetched = fetched or time.time()
+        with self._lock:
+            for (date, games) in days.items():
+                self._drop(date)
+                self._days[date] = games
+                self._fetched[date] = fetched
+                for game in games:
+                    for side in ('away', 'home'):
+                        team = game['teams'][side]['team']
+                        key = (date, team.get('abbreviation', '').upper())
+                        self._teams.setdefault(key, []).append(game)
+
+    def prune(self, start, end):
+        """Forgets every date outside of the window from start to end."""
+        keep = set(dateRange(start, end))
+        with self._lock:
+            for date in [d for d in self._days if d not in keep]:
+                self._drop(date)
+
+    def _drop(self, date):
+        for game in self._days.pop(date, []):
+            for side in ('away', 'home'):
+                team = game['teams'][side]['team']
+                self._teams.pop((date, team.get('abbreviation', '').upper()),
+                                None)
+        self._fetched.pop(date, None)
+
+    def games(self, date, team=None):
+        """Returns the games of date, or only those of team (an abbreviation)
+        if it is given."""
+        with self._lock:
+            if team is None:
+                return list(self._days.get(date, []))
+            return list(self._teams.get((date, team.upper()), []))
+
+    def __contains__(self, date):
+        return date in self._days
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
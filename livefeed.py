@@ -0,0 +1,269 @@
+###
+# Copyright (c) 2017, cottongin
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE
+###
+
+###
+# Includes contributions from Santiago Gil and Jonathan "grateful" Surman
+###
+
+
+"""
+Live feeds kept up to date with the statsapi 'diffPatch' endpoint.
+
+Rather than downloading a game's whole 'feed/live' document every few
+seconds, the poller keeps the last full document of each game it tracks and
+asks for the changes since its metaData.timeStamp. They come as a list of
+JSON Patch (RFC 6902) operation lists, applied here in order.
+
+Patching copies on write: the containers along the path of an operation are
+copied and everything else is shared with the previous version, which is
+left untouched. So a failed or inconsistent patch simply leaves the previous
+document in place (the caller then falls back to a full download), threads
+reading the previous version are never disturbed, and a play that no patch
+touched is the very same object from one version to the next (which
+snapshot.GameSnapshot relies on to reuse its goals).
+"""
+
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+
+class PatchError(ValueError):
+    """A patch doesn't apply to the document."""
+
+
+def _tokens(path):
+    """Splits a JSON pointer into its reference tokens."""
+    if path == '':
+        return []
+    if not path.startswith('/'):
+        raise PatchError('Invalid path {!r}'.format(path))
+    return [token.replace('~1', '/').replace('~0', '~')
+            for token in path[1:].split('/')]
+
+
+def _index(container, token, path, append=False):
+    """Returns the list index that token designates in container."""
+    if append and token == '-':
+        return len(container)
+    if not token.isdigit() or (len(token) > 1 and token[0] == '0'):
+        raise PatchError('Invalid index in {!r}'.format(path))
+    index = int(token)
+    if index > len(container) or (index == len(container) and not append):
+        raise PatchError('Index out of range in {!r}'.format(path))
+    return index
+
+
+class _Patcher(object):
+    def __init__(self, document):
+        # Containers copied during this patch, by id; they can be modified
+        # in place. (They are kept here so that their ids stay unique.)
+        self.fresh = {}
+        self.document = self._own(document)
+
+    def _own(self, container):
+        if id(container) in self.fresh:
+            return container
+        if isinstance(container, dict):
+            container = dict(container)
+        elif isinstance(container, list):
+            container = list(container)
+        else:
+            return container
+        self.fresh[id(container)] = container
+        return container
+
+    def _get(self, container, token, path):
+        if isinstance(container, dict):
+            if token not in container:
+                raise PatchError('No member {!r} in {!r}'.format(token, path))
+            return container[token]
+        elif isinstance(container, list):
+            return container[_index(container, token, path)]
+        raise PatchError('Not a container in {!r}'.format(path))
+
+    def _parent(self, path):
+        """Returns (parent container, last token) of path, owning every
+        container on the way."""
+        tokens = _tokens(path)
+        if not tokens:
+            raise PatchError('Operation on the whole document')
+        parent = self.document
+        for token in tokens[:-1]:
+            child = self._own(self._get(parent, token, path))
+            if isinstance(parent, dict):
+                parent[token] = child
+            else:
+                parent[_index(parent, token, path)] = child
+            parent = child
+        if not isinstance(parent, (dict, list)):
+            raise PatchError('Not a container in {!r}'.format(path))
+        return (parent, tokens[-1])
+
+    def value(self, path):
+        node = self.document
+        for token in _tokens(path):
+            node = self._get(node, token, path)
+        return node
+
+    def add(self, path, value):
+        (parent, token) = self._parent(path)
+        if isinstance(parent, dict):
+            parent[token] = value
+        else:
+            parent.insert(_index(parent, token, path, append=True), value)
+
+    def remove(self, path):
+        (parent, token) = self._parent(path)
+        value = self._get(parent, token, path)
+        if isinstance(parent, dict):
+            del parent[token]
+        else:
+            del parent[_index(parent, token, path)]
+        return value
+
+    def replace(self, path, value):
+        (parent, token) = self._parent(path)
+        self._get(parent, token, path)
+        if isinstance(parent, dict):
+            parent[token] = value
+        else:
+            parent[_index(parent, token, path)] = value
+
+    def apply(self, operation):
+        try:
+            op = operation['op']
+            path = operation['path']
+            if op == 'add':
+                self.add(path, operation['value'])
+            elif op == 'remove':
+                self.remove(path)
+            elif op == 'replace':
+                self.replace(path, operation['value'])
+            elif op == 'move':
+                self.add(path, self.remove(operation['from']))
+            elif op == 'copy':
+                self.add(path,
+                         copy.deepcopy(self.value(operation['from'])))
+            elif op == 'test':
+                if self.value(path) != operation['value']:
+                    raise PatchError('Test failed for {!r}'.format(path))
+            else:
+                raise PatchError('Unknown operation {!r}'.format(op))
+        except (KeyError, TypeError, AttributeError) as e:
+            raise PatchError('Malformed operation {!r}: {!r}'.format(
+                             operation, e))
+
+
+def patch(document, operations):
+    """Returns a new version of document with the JSON Patch operations
+    applied, or raises PatchError. document itself is not modified."""
+    patcher = _Patcher(document)
+    for operation in operations:
+        patcher.apply(operation)
+    return patcher.document
+
+
+class LiveFeed(object):
+    """The full live feed document of a game, as of its timestamp."""
+    __slots__ = ('document', 'timestamp', 'expires')
+
+    def __init__(self, document, ttl=0):
+        self.document = document
+        self.timestamp = document['metaData']['timeStamp']
+        self.expires = time.time() + ttl
+
+    def update(self, diffs):
+        """Applies the response of diffPatch (a list of {'diff': [...]}),
+        all or nothing. Raises PatchError if it doesn't apply."""
+        if not isinstance(diffs, list):
+            raise PatchError('Unexpected diffPatch response')
+        document = self.document
+        for item in diffs:
+            if not isinstance(item, dict) or \
+                    not isinstance(item.get('diff'), list):
+                raise PatchError('Unexpected diffPatch response')
+            document = patch(document, item['diff'])
+        try:
+            timestamp = document['metaData']['timeStamp']
+            document['gameData']['status']
+            document['liveData']['plays']['allPlays']
+        except (KeyError, TypeError):
+            raise PatchError('Patched document is not a live feed')
+        if diffs and timestamp == self.timestamp:
+            raise PatchError('Patches did not move the timestamp')
+        (self.document, self.timestamp) = (document, timestamp)
+
+
+class LiveFeeds(object):
+    """The LiveFeed of each game tracked by the poller, at most max_entries
+    of them (the least recently updated one is dropped first; its feed is
+    then downloaded whole again)."""
+
+    def __init__(self, max_entries=16):
+        self.max_entries = max_entries
+        self._feeds = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._feeds)
+
+    def get(self, gamepk):
+        with self._lock:
+            return self._feeds.get(gamepk)
+
+    def fresh(self, gamepk):
+        """Returns the LiveFeed of gamepk if it is being kept up to date."""
+        with self._lock:
+            feed = self._feeds.get(gamepk)
+        if feed is not None and feed.expires >= time.time():
+            return feed
+        return None
+
+    def put(self, gamepk, feed):
+        with self._lock:
+            self._feeds[gamepk] = feed
+            self._feeds.move_to_end(gamepk)
+            while len(self._feeds) > self.max_entries:
+                self._feeds.popitem(last=False)
+
+    def extend(self, gamepk, ttl):
+        with self._lock:
+            feed = self._feeds.get(gamepk)
+            if feed is not None:
+                feed.expires = time.time() + ttl
+
+    def drop(self, gamepk):
+        """Stops keeping gamepk's feed and returns it (if there was one)."""
+        with self._lock:
+            return self._feeds.pop(gamepk, None)
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
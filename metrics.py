@@ -0,0 +1,164 @@
+###
+# Copyright (c) 2017, cottongin
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE
+###
+
+###
+# Includes contributions from Santiago Gil and Jonathan "grateful" Surman
+###
+
+
+"""
+Timing of the plugin's hot paths.
+
+Each timed step (an upstream fetch, a parse, the formatting of a reply, a
+whole command) is a named span. The durations of a span are kept in a
+histogram with fixed buckets, so recording is cheap and the memory used does
+not grow with the number of samples, at the cost of percentiles only being
+known up to the bucket they fall in.
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Histogram(object):
+    """Distribution of durations (in seconds) over fixed buckets."""
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    # Upper bounds of the buckets; the last bucket has no upper bound.
+    BOUNDS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+              1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.counts[bisect.bisect_left(self.BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def mean(self):
+        return (self.total / self.count) if self.count else 0.0
+
+    def percentile(self, p):
+        """Returns the upper bound of the bucket holding the p-th percentile
+        (0 < p <= 100), or the maximum if that is the last bucket."""
+        if not self.count:
+            return 0.0
+        rank = self.count * p / 100.0
+        seen = 0
+        for (index, count) in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                if index == len(self.BOUNDS):
+                    return self.max
+                return min(self.BOUNDS[index], self.max)
+        return self.max
+
+
+class Metrics(object):
+    """Thread-safe collection of span histograms, plus the number of spans
+    of each name currently open."""
+
+    def __init__(self, log=None, logSpans=None):
+        self._log = log
+        # Callable telling whether each finished span should be logged.
+        self._logSpans = logSpans
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._open = {}
+        self.started = time.time()
+
+    @contextmanager
+    def span(self, name, **fields):
+        """Times the body of the 'with' statement as the span name. fields
+        are only used in the log line, and the body may add to them (the
+        context value is the fields dict)."""
+        with self._lock:
+            self._open[name] = self._open.get(name, 0) + 1
+        started = time.perf_counter()
+        failed = True
+        try:
+            yield fields
+            failed = False
+        finally:
+            if failed:
+                fields['error'] = 'yes'
+            self.observe(name, time.perf_counter() - started, True, **fields)
+
+    def observe(self, name, seconds, opened=False, **fields):
+        """Records a duration for name (closing a span opened by span()) and
+        logs it if spans are logged."""
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram()
+            histogram.add(seconds)
+            if opened:
+                self._open[name] -= 1
+        if self._logSpans is not None and self._logSpans():
+            self._log.info('NHL span={} ms={:.1f}{}'.format(
+                name, seconds * 1000,
+                ''.join(' {}={}'.format(key, value)
+                        for (key, value) in sorted(fields.items()))))
+
+    def histograms(self, prefix=''):
+        """Returns a sorted list of (name, Histogram copy) for the spans whose
+        name starts with prefix (which is stripped)."""
+        with self._lock:
+            result = []
+            for (name, histogram) in sorted(self._histograms.items()):
+                if name.startswith(prefix):
+                    copy = Histogram()
+                    copy.counts = list(histogram.counts)
+                    copy.count = histogram.count
+                    copy.total = histogram.total
+                    copy.max = histogram.max
+                    result.append((name[len(prefix):], copy))
+            return result
+
+    def inFlight(self):
+        """Returns a dict of span name -> number of spans open right now."""
+        with self._lock:
+            return dict((name, count) for (name, count) in self._open.items()
+                        if count)
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self.started = time.time()
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
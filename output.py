@@ -0,0 +1,109 @@
+###
+# Copyright (c) 2017, cottongin
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE
+###
+
+###
+# Includes contributions from Santiago Gil and Jonathan "grateful" Surman
+###
+
+
+"""
+Packing of multi-line replies into as few IRC messages as possible.
+
+Limnoria's flood protection spaces the messages it queues out, so a reply
+of six lines arrives seconds after it was asked for. pack joins consecutive
+lines as long as the result fits in the number of bytes a message can
+carry. The length is counted in UTF-8 bytes, formatting codes included.
+A reset code is inserted after a line that leaves bold, colors, etc. on, so
+they don't spill over onto the next one.
+
+compact additionally strips the formatting codes and the padding of a line,
+for the channels that prefer more data per message to colors.
+"""
+
+import re
+
+import supybot.ircutils as ircutils
+
+
+# Separates two packed lines
+SEPARATOR = ' || '
+
+RESET = '\x0f'
+
+# Codes that toggle an attribute on and off
+_TOGGLES = '\x02\x11\x16\x1d\x1e\x1f'
+
+_COLOR = re.compile('\x03(\\d{1,2}(,\\d{1,2})?)?')
+
+
+def byteLength(s):
+    """Returns the number of bytes s takes in a message."""
+    return len(s.encode('utf-8'))
+
+
+def leavesFormatting(line):
+    """Returns whether some formatting is still on at the end of line."""
+    last_reset = line.rfind(RESET)
+    if last_reset != -1:
+        line = line[last_reset + 1:]
+    if any(line.count(code) % 2 for code in _TOGGLES):
+        return True
+    colors = _COLOR.findall(line)
+    # A bare \x03 turns the color off
+    return bool(colors) and colors[-1][0] != ''
+
+
+def pack(lines, length, separator=SEPARATOR):
+    """Joins consecutive lines with separator into messages of at most
+    length bytes. Lines that are already too long are left alone (Limnoria
+    splits them)."""
+    messages = []
+    current = None
+    for line in lines:
+        if current is not None:
+            joined = current
+            if leavesFormatting(joined):
+                joined += RESET
+            joined += separator + line
+            if byteLength(joined) <= length:
+                current = joined
+                continue
+            messages.append(current)
+        current = line
+    if current is not None:
+        messages.append(current)
+    return messages
+
+
+def compact(line):
+    """Returns line without its formatting codes and extra spaces."""
+    return ' '.join(ircutils.stripFormatting(line).split())
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
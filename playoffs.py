@@ -0,0 +1,138 @@
+###
+# Copyright (c) 2017, cottongin
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE
+###
+
+###
+# Includes contributions from Santiago Gil and Jonathan "grateful" Surman
+###
+
+
+"""
+Playoffs bracket, kept until the next series game.
+
+The bracket only changes when a series game ends, and the tournament
+document says when the next game of each series starts. So a Bracket stays
+fresh until the earliest of those start times; while a game is on (its start
+time is past but its series isn't over) it is refreshed every few minutes
+instead. The lines of each round are rendered once per Bracket.
+"""
+
+import threading
+import time
+
+import dateutil.parser
+
+
+def seasonFor(date):
+    """Returns the season (like '20162017') that date belongs to, for the
+    purpose of the playoffs: a new season starts in September, so the
+    summer months still belong to the season whose playoffs just ended."""
+    year = date.year if date.month >= 9 else date.year - 1
+    return '{}{}'.format(year, year + 1)
+
+
+def playoffsURL(season):
+    return ("https://statsapi.web.nhl.com/api/v1/tournaments/playoffs" +
+            "?expand=round.series&season={}&site=en_nhl".format(season))
+
+
+def _nextGames(data):
+    """Returns the start times (as timestamps) of the next game of each
+    series that isn't over."""
+    times = []
+    for round_info in data.get('rounds', []):
+        for series in round_info.get('series', []):
+            summary = series.get('currentGame', {}).get('seriesSummary', {})
+            if 'wins' in summary.get('seriesStatus', '') or \
+                    'gameTime' not in summary:
+                continue
+            times.append(dateutil.parser.parse(
+                summary['gameTime']).timestamp())
+    return times
+
+
+class Bracket(object):
+    """The rounds of a season's playoffs, with their rendered lines."""
+    __slots__ = ('season', 'default_round', 'rounds', 'expires', '_lines')
+
+    def __init__(self, season, data, ttl, idle_ttl, now=None):
+        """data is the tournament document. The bracket expires at the start
+        of the next game, or after ttl seconds if a game is on, or after
+        idle_ttl seconds if no game is scheduled."""
+        if now is None:
+            now = time.time()
+        self.season = season
+        self.default_round = data.get('defaultRound')
+        self.rounds = dict((round_info['number'], round_info)
+                           for round_info in data.get('rounds', []))
+        times = _nextGames(data)
+        upcoming = [t for t in times if t > now]
+        if len(upcoming) < len(times):
+            self.expires = now + ttl
+        elif upcoming:
+            self.expires = min(upcoming)
+        else:
+            self.expires = now + idle_ttl
+        self._lines = {}
+
+    def isFresh(self):
+        return self.expires >= time.time()
+
+    def lines(self, number, render):
+        """Returns the lines of round number, rendered by render(round) the
+        first time, or None if there is no such round."""
+        lines = self._lines.get(number)
+        if lines is None:
+            round_info = self.rounds.get(number)
+            if round_info is None:
+                return None
+            lines = self._lines[number] = render(round_info)
+        return lines
+
+
+class BracketCache(object):
+    """The latest Bracket of each season."""
+
+    def __init__(self):
+        self._brackets = {}
+        self._lock = threading.Lock()
+
+    def get(self, season):
+        """Returns the bracket of season if it is still fresh."""
+        with self._lock:
+            bracket = self._brackets.get(season)
+        if bracket is not None and bracket.isFresh():
+            return bracket
+        return None
+
+    def put(self, bracket):
+        with self._lock:
+            self._brackets[bracket.season] = bracket
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -31,9 +31,11 @@
 # Includes contributions from Santiago Gil and Jonathan "grateful" Surman
 ###
 
+import os
 import time
 import re
-import urllib.request as urlreq
+import threading
+import concurrent.futures
 import requests
 
 import datetime
@@ -41,18 +43,36 @@ import dateutil.parser
 import pytz
 
 import urllib.parse as urlparse
-import urllib
 import supybot.ircdb as ircdb
 import supybot.schedule as schedule
 import json
 import supybot.registry as registry
 import supybot.conf as conf
-import supybot.utils as utils
 from supybot.commands import *
 import supybot.plugins as plugins
 import supybot.ircutils as ircutils
 import supybot.callbacks as callbacks
 import supybot.ircmsgs as ircmsgs
+import supybot.world as world
+
+from . import alerts
+from . import cache
+from . import client
+from . import engine
+from . import feedparse
+from . import gameindex
+from . import livefeed
+from . import metrics
+from . import output
+from . import playoffs
+from . import poller
+from . import report
+from . import resilience
+from . import seasonstats
+from . import shortener
+from . import snapshot
+from . import store
+from . import teams
 try:
     from supybot.i18n import PluginInternationalization
     _ = PluginInternationalization('NHL')
@@ -65,26 +85,183 @@ class NHL(callbacks.Plugin):
     """Plugin provides stats and game summaries for NHL games and players"""
     threaded = True
 
+    # How long responses loaded from the store stay in the memory cache.
+    # They never change, so this is only bounded by the LRU eviction.
+    _FINAL_TTL = 24 * 3600
+
+    # What identifies the URLs of each endpoint (the first match wins),
+    # their name in the timings and their cache.ttl setting
+    _URL_CLASSES = (
+        ('/feed/live', 'feed', 'liveFeed'),
+        ('/htmlreports/', 'report', 'report'),
+        ('/tournaments/playoffs', 'playoffs', 'playoffs'),
+        ('/schedule?', 'schedule', 'schedule'),
+        ('/api/v1/teams', 'teams', 'teams'),
+    )
+
+    # Endpoints whose responses the store keeps for finished games (see
+    # _saveFinalGame)
+    _STORED_ENDPOINTS = frozenset(['feed', 'report'])
+
+    # How long the playoffs bracket is kept when no series game is
+    # scheduled.
+    _PLAYOFFS_IDLE_TTL = 6 * 3600
+
+    # How long an old list of teams is used before trying to download it
+    # again, when that failed.
+    _TEAMS_RETRY = 300
+
+    # How often nhlteamstats looks for games played since the last backfill
+    _STATS_TOP_UP = 3600
+
     def __init__(self, irc):
         self.__parent = super(NHL, self)
         self.__parent.__init__(irc)
         self._SCOREBOARD_ENDPOINT = ("https://statsapi.web.nhl.com/api/v1/schedule?" +
-                                     "startDate={}&endDate={}" +
-                                     "&expand=schedule.teams,schedule.linescore," + 
-                                     "schedule.broadcasts.all,schedule.ticket," + 
-                                     "schedule.game.content.media.epg" +
-                                     "&leaderCategories=&site=en_nhl&teamId=")
+                                     "startDate={}&endDate={}&site=en_nhl")
+        # What each kind of schedule lookup needs from the API: the
+        # expansions to request and the fields to keep (all of them if
+        # empty). Each profile has its own URL, and so its own cache entry.
+        self._SCHEDULE_PROFILES = {
+            # Finding a team's game and whether it is on
+            'games': (['schedule.teams'],
+                      ['dates', 'date', 'games', 'gamePk', 'gameDate',
+                       'status', 'abstractGameState', 'codedGameState',
+                       'detailedState', 'teams', 'away', 'home', 'team',
+                       'id', 'abbreviation']),
+            # The scoreboard of a day (see nhlscores)
+            'scores': (['schedule.teams', 'schedule.linescore'],
+                       ['dates', 'date', 'games', 'gamePk', 'gameDate',
+                        'status', 'abstractGameState', 'detailedState',
+                        'teams', 'away', 'home', 'team', 'abbreviation',
+                        'score', 'linescore', 'currentPeriodOrdinal',
+                        'currentPeriodTimeRemaining', 'intermissionInfo',
+                        'inIntermission']),
+            # The final games of a season (see _backfillStats)
+            'results': (['schedule.linescore'],
+                        ['dates', 'date', 'games', 'gamePk', 'gameType',
+                         'status', 'abstractGameState', 'teams', 'away',
+                         'home', 'score', 'linescore', 'currentPeriod']),
+        }
+        self._LIVE_FEED_ENDPOINT = ("https://statsapi.web.nhl.com/api/v1/game/" +
+                                    "{}/feed/live")
         self._FUZZY_DAYS = ['yesterday', 'tonight', 'today', 'tomorrow']
 
-        # These two variables store the latest data acquired from the server
-        # and its modification time. It's a one-element cache.
-        # They are used to employ HTTP's 'If-Modified-Since' header and
-        # avoid unnecessary downloads for today's information (which will be
-        # requested all the time to update the scores).
-        self._today_scores_cached_url = None
-        self._today_scores_last_modified_time = None
-        self._today_scores_last_modified_data = None
-        
+        # Durations of the upstream fetches, parsing, reply formatting and
+        # commands (see the nhlstats command and metrics.logSpans).
+        self._metrics = metrics.Metrics(
+            self.log, lambda: self.registryValue('metrics.logSpans'))
+
+        # Responses are cached per URL with a TTL that depends on the
+        # endpoint (see _ttlFor). Expired entries are revalidated with
+        # 'If-None-Match'/'If-Modified-Since' to avoid unnecessary downloads
+        # for data that is requested all the time to update the scores.
+        self._cache = cache.ResponseCache(
+            self.registryValue('cache.maxEntries'),
+            self.registryValue('cache.maxBytes') or None,
+            self.registryValue('cache.compress'))
+
+        # Concurrent requests for the same URL share a single fetch (and
+        # the parsed JSON) instead of each going upstream.
+        self._flights = cache.SingleFlight()
+
+        # Data of finished games never changes, so it is kept on disk and
+        # the most recent games are loaded into the cache right away.
+        self._store = None
+        if self.registryValue('store.enable'):
+            self._store = store.GameStore(
+                conf.supybot.directories.data.dirize('NHL.sqlite3'),
+                self.registryValue('store.maxSize'))
+            for (url, data) in self._store.recent(
+                    self.registryValue('store.warmGames')):
+                self._cache.put(url, data, self._FINAL_TTL)
+
+        # Every upstream request goes through this client, which keeps
+        # connections to each host alive between commands, retries transient
+        # failures and stops hammering a host that keeps failing. The
+        # requests may all go through a shared event loop (fetch.engine).
+        io_engine = None
+        if self.registryValue('fetch.engine'):
+            io_engine = engine.Engine(
+                self.registryValue('fetch.engineConcurrency'),
+                self.registryValue('fetch.engineBacklog'),
+                self.registryValue('fetch.poolSize'))
+        self._http = client.HTTPClient(
+            pool_connections=self.registryValue('fetch.poolConnections'),
+            pool_maxsize=self.registryValue('fetch.poolSize'),
+            connect_timeout=self.registryValue('fetch.connectTimeout'),
+            read_timeout=self.registryValue('fetch.timeout'),
+            retries=self.registryValue('fetch.retries'),
+            guards=resilience.HostGuards(
+                self.registryValue('fetch.rateLimit'),
+                self.registryValue('fetch.rateBurst'),
+                self.registryValue('fetch.breakerThreshold'),
+                self.registryValue('fetch.breakerCooldown')),
+            engine=io_engine)
+
+        # URLs being revalidated in the background (see _getURL)
+        self._revalidating = set()
+        self._revalidatingLock = threading.Lock()
+
+        # Short links are requested once per long URL and remembered (on
+        # disk too when the store is enabled).
+        self._shortener = shortener.LinkShortener(self._requestShortURL,
+                                                  self._store)
+
+        # Attendance and officials parsed out of the HTML game reports
+        self._reports = report.ReportCache()
+
+        # The team directory and when it must be built again (see
+        # _getTeams)
+        self._teams = None
+        self._teamsExpire = 0
+
+        # Season stats of the teams (see _getSeasonStats), and when they
+        # were last topped up
+        self._seasonStats = {}
+        self._statsToppedUp = {}
+
+        # Playoffs brackets with their rendered rounds (see _getBracket)
+        self._brackets = playoffs.BracketCache()
+
+        # The latest GameSnapshot of each game (see _getSnapshot)
+        self._snapshots = snapshot.SnapshotCache()
+
+        # Full live feeds of the games tracked by the poller, kept up to
+        # date with diffPatch (see _refreshFeed)
+        self._feeds = livefeed.LiveFeeds()
+
+        # Games of the days around today, indexed by date and team, so that
+        # finding a game doesn't need a download and a scan of the slate.
+        self._games = gameindex.ScheduleIndex(self._fetchSchedule)
+
+        # Bounded pool used to run independent upstream fetches at the same
+        # time (see _fanOut).
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.registryValue('fetch.workers'))
+
+        # Goals, starts and final scores of the games the poller tracks, for
+        # the channels following their teams (see _announce).
+        self._alerts = alerts.AlertWatcher()
+
+        # Optional background refresh of the games in progress (see the
+        # poller.* settings).
+        self._poller = poller.LiveGamePoller(self)
+        self._poller.start()
+
+    def die(self):
+        self._poller.stop()
+        self._executor.shutdown(wait=False)
+        self._http.close()
+        if self._store is not None:
+            self._store.close()
+        self.__parent.die()
+
+    def _callCommand(self, command, irc, msg, *args, **kwargs):
+        with self._metrics.span('command.' + ' '.join(command),
+                                channel=msg.args[0]):
+            self.__parent._callCommand(command, irc, msg, *args, **kwargs)
+
     def _bold(self, string):
         """Returns a bold string."""
         return ircutils.bold(string)
@@ -111,13 +288,13 @@ class NHL(callbacks.Plugin):
     def _pacificTimeNow(self):
         return datetime.datetime.now(pytz.timezone('US/Pacific'))
 
-    def _ISODateToEasternTime(self, iso):
+    def _ISODateToEasternTime(self, iso, format='%A %-I:%M %p'):
         """Convert the ISO date in UTC time that the API outputs into an
         Eastern time formatted with am/pm. (The default human-readable format
         for the listing of games)."""
         date = dateutil.parser.parse(iso)
         date_eastern = date.astimezone(pytz.timezone('US/Eastern'))
-        eastern_time = date_eastern.strftime('%A %-I:%M %p')
+        eastern_time = date_eastern.strftime(format)
         return "{} ET".format(eastern_time) # Strip the seconds
 
     def _stripDateSeparators(self, date_string):
@@ -161,113 +338,44 @@ class NHL(callbacks.Plugin):
 
         return date
 
-    def _goalSummary(self, data):
-        """ parses goals """
-
-        # get all scoring plays
-        scores = []
-        for item in data['liveData']['plays']['allPlays']:
-            if item['result']['eventTypeId'] == 'GOAL':
-                scores.append(item)
-
-        # parse scoring plays into relevant data
-        scores_list = []
-        for item in scores:
-            names = []
-            for player in item['players']:
-                # we don't care about the goalie
-                if 'Goalie' not in player['playerType']:
-                    name = player['player']['fullName']
-                    # if the player is the goal scorer, add the number of goals
-                    # he has on the year
-                    if 'Scorer' in player['playerType']:
-                        num = '(' + str(player['seasonTotal']) + ')'
-                    else:
-                        num = ''
-                    # parse their name
-                    fname = name[0] + '.'
-                    if len(name.split()) > 2:
-                        fname += name.split()[1:-1][0] + ' '
-                    lname = name.split()[-1]
-                    pname = fname + lname + num
-                    # append their name to the names list
-                    names.append(pname)
-            # parse if it's a special goal or not
-            if 'PPG' in item['result']['strength']['code']:
-                GT = ' PP'
-            elif 'SHG' in item['result']['strength']['code']:
-                GT = ' SH'
-            else:
-                GT = ''
-            # parse time and add PP
-            time = ('[' + item['about']['ordinalNum'] +
-                    '/' + item['about']['periodTime'] + GT +
-                    ']')
-            # append the team, time, and names to the scores list
-            scores_list.append([item['team']['triCode'], time, names])
-
-        # parse the scores list and format to reply
-        reply = []
-        for item in scores_list:
-            # if more than one player there were assists, put those in ()
-            if len(item[2]) > 1:
-                reply_names = '{} ({})'.format(self._bold(item[2][0]),
-                                               ', '.join(name for name in item[2][1:]))
+    def _parseTeamAndDate(self, args):
+        """Splits '[<team>] [<date>]' (in any order) into (team, date). The
+        date is None if it isn't given; a malformed date raises
+        ValueError."""
+        args = args.split() if args else []
+        if len(args) > 2:
+            raise ValueError("Too many arguments, expected [<team>] "
+                             "[<date>].")
+        (team, date) = (None, None)
+        for arg in args:
+            parsed = self._checkDateInput(arg)
+            if parsed is not None and date is None:
+                date = parsed
+            elif team is None:
+                team = arg
             else:
-                reply_names = '{}'.format(self._bold(item[2][0]))
-            reply.append('{0} {2} {1}'.format(self._bold(item[0]), item[1], reply_names))
-
-        if len(reply) > 5:
-            goals_string = []
-            goals_string.append(' | '.join(item for item in reply[:5]))
-            goals_string.append(' | '.join(item for item in reply[5:]))
-        else:
-            goals_string = ' | '.join(item for item in reply)
-
-        return goals_string
+                raise ValueError("Expected a team and a date, got "
+                                 "{}.".format(" ".join(args)))
+        return (team, date)
 
     def _findGamepk(self, args):
-
-        num_args = len(args.split())
-        if num_args > 2:
-            return 'too many args'
-        elif num_args == 2:
-            # got team and date
-            optional_team = args.split()[0]
-            optional_date = args.split()[1]
-        elif num_args == 1:
-            # got team
-            optional_team = args
-        else:
-            pass
-            # someone's an idiot
-
-        if optional_team is None:
-            team = "all"
-            try:
-                date = self._checkDateInput(optional_date)
-            except ValueError as e:
-                print('ERROR: {0!s}'.format(e))
-                return
-        else:
-            date = self._checkDateInput(optional_team)
-            if date:
-                team = "all"
-            else:
-                team = optional_team.upper()
-                try:
-                    date = self._checkDateInput(optional_date)
-                except ValueError as e:
-                    print('ERROR: {0!s}'.format(e))
-                    return
+        """Resolves '<team> [<date>]' (in any order, see _parseTeamAndDate)
+        to the gamePk (a string) of that team's game, or None if it doesn't
+        play that day. The date defaults to today; a malformed date or a
+        missing team raises ValueError."""
+        (team, date) = self._parseTeamAndDate(args)
+        if team is None:
+            raise ValueError("A team is required.")
 
         if date is None:
             games = self._getTodayGames(team)
         else:
             games = self._getGamesForDate(team, date)
-        return games
+        if not games:
+            return None
+        return str(games[0]['gamePk'])
 
-    def _getTodayGames(self, team):
+    def _getTodayGames(self, team=None):
         games = self._getGames(team, self._getTodayDate())
         return games
 
@@ -276,108 +384,491 @@ class NHL(callbacks.Plugin):
         return games
 
     def _getGames(self, team, date):
-        """Given a date, populate the url with it and try to download its
-        content. If successful, parse the JSON data and extract the relevant
-        fields for each game. Returns a list of games."""
-        url = self._getEndpointURL(date)
-
-        # (If asking for today's results, enable the 'If-Mod.-Since' flag)
-        use_cache = (date == self._getTodayDate())
-        response = self._getURL(url, use_cache)
-
-        json = self._extractJSON(response)
-        games = self._parseGames(json, team)
-        return games
-
-    def _getEndpointURL(self, date):
-        return self._SCOREBOARD_ENDPOINT.format(date, date)
-
-    def _getURL(self, url, use_cache=False):
-        """Use urllib to download the URL's content. The use_cache flag enables
-        the use of the one-element cache, which will be reserved for today's
-        games URL. (In the future we could implement a real cache with TTLs)."""
-        user_agent = 'Mozilla/5.0 \
-                      (X11; Ubuntu; Linux x86_64; rv:45.0) \
-                      Gecko/20100101 Firefox/45.0'
-        header = {'User-Agent': user_agent}
-
-        # ('If-Modified-Since' to avoid unnecessary downloads.)
-        if use_cache and self._haveCachedData(url):
-            header['If-Modified-Since'] = self._today_scores_last_modified_time
+        """Returns the games of date (all of them, or only team's) from the
+        schedule index. Dates inside the window around today are fetched
+        together; other dates are fetched on their own."""
+        (start, end) = self._scheduleWindow()
+        max_age = self.registryValue('schedule.maxAge')
+        if team is not None:
+            team = self._normalizeTeam(team)
+        if start <= date <= end:
+            self._games.prune(start, end)
+            self._games.ensure(start, end, max_age)
+        elif team is not None and self._teamId(team) is not None:
+            # Only this team's games are needed, not the league's slate.
+            payload = self._getJSON(self._getEndpointURL(
+                date, team_id=self._teamId(team)))
+            return [game for day in payload.get('dates', [])
+                    for game in day['games']]
+        else:
+            self._games.ensure(date, date, max_age)
+        return self._games.games(date, team)
 
-        request = urllib.request.Request(url, headers=header)
+    def _scheduleWindow(self):
+        """Returns the first and last dates of the schedule window."""
+        today = self._pacificTimeNow().date()
+        start = today - datetime.timedelta(
+            days=self.registryValue('schedule.daysBefore'))
+        end = today + datetime.timedelta(
+            days=self.registryValue('schedule.daysAfter'))
+        return (start.isoformat(), end.isoformat())
+
+    def _fetchSchedule(self, start, end, profile='games'):
+        return self._getJSON(self._getEndpointURL(start, end, profile))
+
+    def _getTeams(self):
+        """Returns the TeamDirectory (see the teams module), or None if the
+        teams couldn't be downloaded. It is built once per cache.ttl.teams,
+        from the copy in the store if that one is recent enough. After a
+        failed download, the next one is only tried _TEAMS_RETRY seconds
+        later."""
+        directory = self._teams
+        if time.time() < self._teamsExpire:
+            return directory
+        ttl = self.registryValue('cache.ttl.teams')
+        def build():
+            document = None
+            if self._store is not None:
+                document = self._store.getDocument('teams')
+            if document is not None and time.time() - document[1] < ttl:
+                (body, expires) = (document[0], document[1] + ttl)
+            else:
+                try:
+                    body = self._getURL(teams.TEAMS_URL)
+                except requests.RequestException as e:
+                    if document is None:
+                        raise
+                    # An old list beats none at all.
+                    self.log.warning("NHL: using the stored teams, "
+                                     "downloading them failed: {}".format(e))
+                    (body, expires) = (document[0],
+                                       time.time() + self._TEAMS_RETRY)
+                else:
+                    expires = time.time() + ttl
+                    if self._store is not None:
+                        self._store.saveDocument('teams', body)
+            with self._metrics.span('parse.teams'):
+                built = teams.TeamDirectory.fromJSON(body)
+            (self._teams, self._teamsExpire) = (built, expires)
+            return built
+        try:
+            return self._flights.do('teams', build)
+        except requests.RequestException as e:
+            self.log.warning("NHL: couldn't download the teams: {}".format(e))
+            self._teamsExpire = time.time() + self._TEAMS_RETRY
+            return directory
+
+    def _normalizeTeam(self, team):
+        """Returns the abbreviation of the team named team (abbreviation,
+        name, nickname, city or a prefix of them). Unknown names are only
+        upper-cased."""
+        directory = self._getTeams()
+        if directory is not None:
+            resolved = directory.resolve(team)
+            if resolved is not None:
+                return resolved.abbreviation
+        team = team.upper()
+        if team == "GNJD":
+            team = 'NJD'
+        return team
 
+    def _teamId(self, abbreviation):
+        """Returns the id of the team with that abbreviation, or None."""
+        directory = self._teams
+        if directory is None or abbreviation not in directory.byAbbreviation:
+            return None
+        return directory.byAbbreviation[abbreviation].id
+
+    def _getEndpointURL(self, date, end=None, profile='games', team_id=None):
+        """Returns the schedule URL for the dates from date to end (or only
+        date), requesting only what the profile needs, and only the games of
+        the team with id team_id if it is given."""
+        (expands, fields) = self._SCHEDULE_PROFILES[profile]
+        url = self._SCOREBOARD_ENDPOINT.format(date, end or date)
+        if team_id is not None:
+            url += "&teamId={}".format(team_id)
+        if expands:
+            url += "&expand=" + ",".join(expands)
+        if fields:
+            url += "&fields=" + ",".join(fields)
+        return url
+
+    def _getFeedURL(self, gamepk):
+        return self._LIVE_FEED_ENDPOINT.format(gamepk)
+
+    def _classify(self, url):
+        """Returns (endpoint, TTL setting) for url: the name under which
+        requests to it are timed, and the cache.ttl setting of its
+        responses."""
+        for (pattern, endpoint, ttl) in self._URL_CLASSES:
+            if pattern in url:
+                return (endpoint, ttl)
+        return ('other', 'default')
+
+    def _ttlFor(self, url):
+        """Returns the number of seconds a response from url stays fresh in
+        the cache."""
+        return self.registryValue('cache.ttl.' + self._classify(url)[1])
+
+    def _endpointFor(self, url):
+        """Returns the name under which requests to url are timed."""
+        return self._classify(url)[0]
+
+    def _getURL(self, url, force=False):
+        """Download the URL's content with the shared HTTP client. Fresh
+        responses are served from the cache; expired ones are revalidated
+        with the validators the server sent ('ETag' and 'Last-Modified').
+        The force flag skips the freshness check (but still revalidates).
+
+        A response that expired less than cache.staleWhileRevalidate seconds
+        ago is served right away and revalidated in the background. If the
+        request fails, a response that expired less than cache.maxStale
+        seconds ago is served instead, and marked as stale."""
+        if not force:
+            data = self._cache.get(url)
+            if data is not None:
+                return data
+            if self._store is not None and \
+                    self._endpointFor(url) in self._STORED_ENDPOINTS:
+                data = self._store.get(url)
+                if data is not None:
+                    self._cache.put(url, data, self._FINAL_TTL)
+                    return data
+            entry = self._cache.lookup(url)
+            if entry is not None and time.time() - entry.expires < \
+                    self.registryValue('cache.staleWhileRevalidate'):
+                self._revalidate(url)
+                return self._cache.peek(url) or entry.data
         try:
-            response = urllib.request.urlopen(request)
-        except urllib.error.HTTPError as error:
-            if use_cache and error.code == 304: # Cache hit
-                self.log.info("{} - 304"
-                              "(Last-Modified: "
-                              "{})".format(url, self._cachedDataLastModified()))
-                return self._cachedData()
-            else:
-                self.log.error("HTTP Error ({}): {}".format(url, error.code))
-                pass
+            return self._flights.do(url, self._fetchURL, url)
+        except requests.RequestException as e:
+            entry = self._cache.lookup(url)
+            if entry is None or time.time() - entry.expires >= \
+                    self.registryValue('cache.maxStale'):
+                raise
+            self.log.warning("{} - serving a stale copy ({})".format(url, e))
+            self._revalidate(url)
+            return self._cache.markStale(url) or entry.data
+
+    def _revalidate(self, url):
+        """Revalidates url on the thread pool, unless that's already being
+        done."""
+        with self._revalidatingLock:
+            if url in self._revalidating:
+                return
+            self._revalidating.add(url)
+        def revalidate():
+            try:
+                self._flights.do(url, self._fetchURL, url)
+            except requests.RequestException as e:
+                self.log.debug("{} - revalidation failed ({})".format(url, e))
+            finally:
+                with self._revalidatingLock:
+                    self._revalidating.discard(url)
+        self._executor.submit(revalidate)
+
+    def _fetchURL(self, url):
+        """Does the actual (conditional) request for _getURL and updates the
+        cache. Only one thread at a time runs this for a given URL."""
+        # (Conditional request to avoid unnecessary downloads.)
+        header = {}
+        entry = self._cache.lookup(url)
+        if entry is not None:
+            header.update(entry.conditionalHeaders())
+
+        ttl = self._ttlFor(url)
+        with self._metrics.span('fetch.' + self._endpointFor(url),
+                                url=url) as span:
+            response = self._http.get(url, headers=header)
+            span['status'] = response.status_code
+
+        if entry is not None and response.status_code == 304: # Cache hit
+            self.log.info("{} - 304"
+                          "(Last-Modified: "
+                          "{})".format(url, entry.last_modified))
+            data = self._cache.revalidate(url, ttl,
+                                          response.headers.get('last-modified'),
+                                          response.headers.get('etag'))
+            if data is None:
+                # The entry was evicted in the meantime: it's still the
+                # current body, so it goes back in the cache.
+                data = entry.data
+                self._cache.put(url, data, ttl,
+                                response.headers.get('last-modified') or
+                                entry.last_modified,
+                                response.headers.get('etag') or entry.etag)
+            return data
+        elif response.status_code != 200:
+            self.log.error("HTTP Error ({}): {}".format(url,
+                                                        response.status_code))
+            response.raise_for_status()
 
         self.log.info("{} - 200".format(url))
 
-        if not use_cache:
-            return response.read()
-
-        # Updating the cached data:
-        self._updateCache(url, response)
-        return self._cachedData()
+        data = response.content
+        self._cache.put(url, data, ttl,
+                        response.headers.get('last-modified'),
+                        response.headers.get('etag'))
+        return data
+
+    def _shortenURL(self, url):
+        """Returns a tinyurl for url, which _startShortening didn't find
+        in the shortener (see the shortener module)."""
+        return self._shortener.request(url)
+
+    def _requestShortURL(self, url):
+        with self._metrics.span('fetch.tinyurl', url=url):
+            response = self._http.get("http://tinyurl.com/api-create.php?" +
+                                      urlparse.urlencode({'url': url}))
+        response.raise_for_status()
+        return response.text.strip()
+
+    def _startShortening(self, urls):
+        """Returns a dict of url -> short link for the known links, or
+        url -> future for those being requested on the thread pool."""
+        links = {}
+        for url in urls:
+            links[url] = (self._shortener.cached(url) or
+                          self._executor.submit(self._shortenURL, url))
+        return links
+
+    def _finishShortening(self, links):
+        """Waits (at most fetch.timeout seconds) for the links started by
+        _startShortening. A link that isn't ready falls back to the long
+        URL."""
+        deadline = time.time() + self.registryValue('fetch.timeout')
+        result = {}
+        for (url, link) in links.items():
+            if isinstance(link, concurrent.futures.Future):
+                try:
+                    link = link.result(max(0, deadline - time.time()))
+                except Exception as e:
+                    self.log.warning("NHL: shortening {} failed: {!r}".format(
+                                     url, e))
+                    link = None
+            result[url] = link or url
+        return result
+
+    def _linksReady(self, links):
+        """Returns whether all the links started by _startShortening are
+        known, so that _finishShortening won't wait."""
+        return all(link.done() for link in links.values()
+                   if isinstance(link, concurrent.futures.Future))
+
+    def _messageLength(self, irc, msg):
+        """Returns the number of bytes a single reply to msg can carry."""
+        length = conf.get(conf.supybot.reply.mores.length,
+                          channel=msg.channel, network=irc.network)
+        if length:
+            return length
+        try:
+            return 512 - irc._replyOverhead(msg)
+        except AttributeError:
+            # Older Limnoria: assume the reply is prefixed with the nick.
+            return 512 - output.byteLength(":{} PRIVMSG {} :{}: \r\n".format(
+                irc.prefix, msg.args[0], msg.nick))
+
+    def _outputLines(self, lines, channel, network, length,
+                     separator=output.SEPARATOR, coalesce=None):
+        """Returns lines as they should be sent to channel (see the output
+        settings), in messages of at most length bytes. coalesce overrides
+        output.coalesce."""
+        if self.registryValue('output.compact', channel, network):
+            lines = [output.compact(line) for line in lines]
+        if coalesce is None:
+            coalesce = self.registryValue('output.coalesce', channel, network)
+        if coalesce:
+            lines = output.pack(lines, length, separator)
+        return lines
+
+    def _replyLines(self, irc, msg, lines, **kwargs):
+        """Replies with lines, packed into as few messages as possible (see
+        _outputLines for the keyword arguments)."""
+        for line in self._outputLines(lines, msg.channel, irc.network,
+                                      self._messageLength(irc, msg),
+                                      **kwargs):
+            irc.reply(line)
+
+    def _fanOut(self, jobs):
+        """Runs jobs, a dict of name -> (function, arg, ...), concurrently on
+        the plugin's thread pool and waits at most fetch.timeout seconds in
+        total. Returns a dict of name -> result, where a job that failed or
+        did not finish in time gets None so the caller can degrade."""
+        timeout = self.registryValue('fetch.timeout')
+        deadline = time.time() + timeout
+        futures = dict((name, self._executor.submit(*job))
+                       for (name, job) in jobs.items())
+        results = {}
+        for (name, future) in futures.items():
+            try:
+                results[name] = future.result(max(0, deadline - time.time()))
+            except concurrent.futures.TimeoutError:
+                future.cancel()
+                self.log.warning("NHL: {} timed out after {}s".format(
+                                 name, timeout))
+                results[name] = None
+            except Exception as e:
+                self.log.warning("NHL: {} failed: {}".format(name, e))
+                results[name] = None
+        return results
+
+    def _saveFinalGame(self, snap):
+        """Persists the final feed (if snap was parsed from the cached one)
+        and the cached report of a game that is over. The compression and
+        the write happen on the thread pool."""
+        (feed_url, report_url) = (self._getFeedURL(snap.gamepk),
+                                  report.reportURL(snap.gamepk))
+        # Every summary of the game gets here: once it's stored, there's
+        # nothing to read (or decompress) any more.
+        missing = self._store.missing([feed_url, report_url])
+        if not missing:
+            return
+        self._store.max_size = self.registryValue('store.maxSize')
+        responses = {}
+        if feed_url in missing and snap.stored is not None:
+            # A snapshot patched from the previous one has no response of
+            # its own; the cached one is then an earlier version of the
+            # feed.
+            entry = self._cache.lookup(feed_url)
+            if entry is not None and entry.stored == snap.stored:
+                responses[feed_url] = self._cache.peek(feed_url)
+        if report_url in missing:
+            responses[report_url] = self._cache.peek(report_url)
+        responses = dict((url, data) for (url, data) in responses.items()
+                         if data is not None)
+        if responses:
+            self._executor.submit(self._store.save, snap.gamepk, responses)
+
+    def _getReport(self, gamepk):
+        """Returns the GameReport of gamepk (parsed once and memoized), or
+        None if there is no report (yet)."""
+        record = self._reports.get(gamepk)
+        if record is not None:
+            return record
+        body = self._getURL(report.reportURL(gamepk))
+        with self._metrics.span('parse.report', gamepk=gamepk):
+            record = report.parseReport(body)
+        if record is not None:
+            self._reports.prune()
+            self._reports.put(gamepk, record,
+                              self.registryValue('cache.ttl.report'))
+        return record
+
+    def _getJSON(self, url):
+        """Returns the parsed JSON at url. Concurrent callers asking for the
+        same URL share the download and the parsing."""
+        def fetch():
+            body = self._getURL(url)
+            with self._metrics.span('parse.' + self._endpointFor(url)):
+                return self._extractJSON(body)
+        return self._flights.do(('json', url), fetch)
+
+    def _getSnapshot(self, gamepk, force=False):
+        """Returns the GameSnapshot of gamepk's current live feed. The feed
+        is only parsed when the response changed, and a new snapshot only
+        built when the game did (its metaData.timeStamp)."""
+        current = self._snapshots.get(gamepk)
+        if not force and current is not None:
+            # Games tracked by the poller are kept up to date without the
+            # cached response.
+            feed = self._feeds.fresh(gamepk)
+            if feed is not None and current.version == feed.timestamp:
+                return current
+        url = self._getFeedURL(gamepk)
+        body = self._getURL(url, force)
+        # The cached response is the same one as long as it's the same
+        # download (revalidating it doesn't change when it was stored); its
+        # body may be a new copy each time if it's kept compressed.
+        entry = self._cache.lookup(url)
+        stored = entry.stored if entry is not None else None
+        if current is not None and stored is not None and \
+                current.stored == stored:
+            return current
+        def build():
+            # Only the plays appended since the last version are decoded.
+            plays = current.plays if current is not None else None
+            if plays is None:
+                plays = feedparse.PlayIndex()
+            with self._metrics.span('parse.feed', gamepk=gamepk):
+                feed = feedparse.parseFeed(body, index=plays)
+            if current is not None and current.version is not None and \
+                    current.version == feed['metaData'].get('timeStamp'):
+                current.stored = stored
+                return current
+            built = snapshot.GameSnapshot(gamepk, feed, plays, current, stored)
+            self._snapshots.put(built)
+            return built
+        return self._flights.do(('snapshot', url), build)
+
+    def _refreshFeed(self, gamepk):
+        """Brings the live feed of gamepk up to date for the poller and
+        returns its GameSnapshot. With poller.diffPatch, once the whole feed
+        has been downloaded, only the changes since its timestamp are; if
+        they can't be fetched or don't apply, the whole feed is downloaded
+        again."""
+        if not self.registryValue('poller.diffPatch'):
+            self._feeds.drop(gamepk)
+            return self._getSnapshot(gamepk, force=True)
+        feed = self._feeds.get(gamepk)
+        if feed is not None:
+            try:
+                self._patchFeed(gamepk, feed)
+            except (requests.RequestException, ValueError) as e:
+                self.log.info("NHL: diffPatch of {} failed, downloading the "
+                              "whole feed: {}".format(gamepk, e))
+                feed = None
+        if feed is None:
+            body = self._getURL(self._getFeedURL(gamepk), force=True)
+            with self._metrics.span('parse.feedDocument', gamepk=gamepk):
+                feed = livefeed.LiveFeed(self._extractJSON(body))
+            self._feeds.put(gamepk, feed)
+        current = self._snapshots.get(gamepk)
+        if current is not None and current.version == feed.timestamp:
+            return current
+        built = snapshot.GameSnapshot(gamepk, feed.document, previous=current)
+        self._snapshots.put(built)
+        return built
+
+    def _patchFeed(self, gamepk, feed):
+        """Applies the changes to gamepk's live feed since feed.timestamp."""
+        url = (self._getFeedURL(gamepk) + "/diffPatch?startTimecode=" +
+               urlparse.quote(feed.timestamp))
+        with self._metrics.span('fetch.diffPatch', url=url) as span:
+            response = self._http.get(url)
+            span['status'] = response.status_code
+        response.raise_for_status()
+        with self._metrics.span('parse.diffPatch', gamepk=gamepk):
+            feed.update(self._extractJSON(response.content))
 
     def _extractJSON(self, body):
         return json.loads(body.decode('utf-8'))
 
-    def _parseGames(self, json, team):
-        """Extract all relevant fields from NHL.com's json
-        and return a list of games."""
-        games = []
-        if team.upper() == "GNJD":
-            team = 'NJD'
-        if json['totalGames'] == 0:
-            return games
-        for g in json['dates'][0]['games']:
-            if team in g['teams']['home']['team']['abbreviation'] or team in g['teams']['away']['team']['abbreviation']:
-                gamepk = str(g['gamePk'])
-        return gamepk
-
-    def _cachedData(self):
-        return self._today_scores_last_modified_data
-
-    def _haveCachedData(self, url):
-        return (self._today_scores_cached_url == url) and \
-                (self._today_scores_last_modified_time is not None)
-
-    def _cachedDataLastModified(self):
-        return self._today_scores_last_modified_time
-
-    def _updateCache(self, url, response):
-        self._today_scores_cached_url = url
-        self._today_scores_last_modified_time = response.headers['last-modified']
-        self._today_scores_last_modified_data = response.read()
-
-    # TBD add args for round results
-    @wrap
-    def nhlplayoffs(self, irc, msg, args):
-        """
-        Returns NHL playoff results for current round
-        """
-
-        # TBD switch out season=YYYYYYYY automatically
-        url = ("https://statsapi.web.nhl.com/api/v1/tournaments/playoffs" + 
-              "?expand=round.series&season=20162017&site=en_nhl")
-
-        # Fetch content
-        content = requests.get(url)
-        content_json = json.loads(content.text)
-        # Get rounds
-        current_round = content_json["defaultRound"]
-        round_index = current_round - 1
-        round_info = content_json["rounds"][round_index]
-
+    def _getBracket(self):
+        """Returns the playoffs Bracket of the current season, downloading
+        it again only once it expired (see the playoffs module)."""
+        season = playoffs.seasonFor(self._pacificTimeNow().date())
+        bracket = self._brackets.get(season)
+        if bracket is None:
+            url = playoffs.playoffsURL(season)
+            bracket = playoffs.Bracket(
+                season, self._getJSON(url),
+                self.registryValue('cache.ttl.playoffs'),
+                self._PLAYOFFS_IDLE_TTL)
+            # A stale bracket isn't kept, so the next call tries again.
+            if not self._cache.isStale(url):
+                self._brackets.put(bracket)
+        return bracket
+
+    def _staleNote(self, url):
+        """Returns what to append to a reply built from url's response when
+        it was served stale because the server failed."""
+        if self._cache.isStale(url):
+            return " \x0314(stale, {} is unavailable)\x03".format(
+                urlparse.urlsplit(url).netloc)
+        return ""
+
+    def _renderPlayoffRound(self, round_info):
+        """Returns the lines of a round of the playoffs."""
         round_name = round_info["names"]["name"]
 
         # Parse relevant info out of JSON
@@ -393,13 +884,47 @@ class NHL(callbacks.Plugin):
             # Find longest string
             padding = len(record) if len(record) > padding else padding
 
-        # Output
-        irc.reply(round_name)
+        lines = [round_name]
         for item in matchups:
-            irc.reply('{0} | {1:{width}} | {2}'.format(item["name"], 
-                                                       item["record"], 
-                                                       item["next"],
-                                                       width=str(padding)))
+            lines.append('{0} | {1:{width}} | {2}'.format(item["name"],
+                                                          item["record"],
+                                                          item["next"],
+                                                          width=str(padding)))
+        return lines
+
+    def _upstreamError(self, irc, e):
+        """Replies that the NHL API couldn't be reached (and there was no
+        stale copy to serve instead)."""
+        self.log.warning("NHL: upstream request failed: {}".format(e))
+        irc.error("Couldn't reach the NHL API, try again later.")
+
+    def nhlplayoffs(self, irc, msg, args, number):
+        """[<round>]
+
+        Returns NHL playoff results for the current round, or for the given
+        round of this season's playoffs.
+        """
+        try:
+            bracket = self._getBracket()
+        except requests.RequestException as e:
+            self._upstreamError(irc, e)
+            return
+        if number is None:
+            number = bracket.default_round
+        if number is None:
+            irc.error("There are no playoffs in the {} season yet.".format(
+                      bracket.season))
+            return
+        lines = bracket.lines(number, self._renderPlayoffRound)
+        if lines is None:
+            irc.error("There is no round {} in the {} playoffs.".format(
+                      number, bracket.season))
+            return
+        lines = list(lines)
+        lines[0] += self._staleNote(playoffs.playoffsURL(bracket.season))
+        self._replyLines(irc, msg, lines)
+
+    nhlplayoffs = wrap(nhlplayoffs, [optional('positiveInt')])
 
     def summary(self, irc, msg, args, optargs):
         """<team> [<date>]
@@ -409,115 +934,438 @@ class NHL(callbacks.Plugin):
         # Storing VidUrl to eventually get highlights link.
         # vidurl = ("http://statsapi.web.nhl.com/api/v1/schedule?expand=schedule.game.content.media.epg&leaderCategories=&site=en_nhl&gamePk=" + gamepk)
 
-        gamepk = self._findGamepk(optargs)
-        url = ("https://statsapi.web.nhl.com/api/v1/game/" + gamepk +"/feed/live")
-        content = requests.get(url)
-        content_json = json.loads(content.text)
-        game = content_json["gameData"]
-        live = content_json["liveData"]
-        year = gamepk[:4]
-        spacer, gameid = gamepk.split(year)
-        HTMLurl = "http://www.nhl.com/scores/htmlreports/{}2017/GS{}.HTM".format(year, gameid)
+        try:
+            gamepk = self._findGamepk(optargs)
+        except ValueError as e:
+            irc.error(str(e))
+            return
+        except requests.RequestException as e:
+            self._upstreamError(irc, e)
+            return
+        if gamepk is None:
+            irc.error("No game found for {}.".format(optargs))
+            return
+        url = self._getFeedURL(gamepk)
+        HTMLurl = report.reportURL(gamepk)
         VIDEOurl = ("http://statsapi.web.nhl.com/api/v1/schedule?expand=schedule.game.content.media.epg&leaderCategories=&site=en_nhl&gamePk=" + gamepk)
 
-        HTMLurl = utils.web.getUrl("http://tinyurl.com/api-create.php?url="+ HTMLurl)
-        HTMLcontent = requests.get(HTMLurl)
-        VIDcontent = requests.get(VIDEOurl)
-        Attendance = re.search("Attendance\s*(\d+,\d+)", HTMLcontent.text, re.S)
-        spacer, Attendance = Attendance.group(0).split(" ")
-        VIDEOurl = utils.web.getUrl("http://tinyurl.com/api-create.php?url="+ VIDEOurl)
-
-        # Title
-        Header = "\x02{} {} {} {} {}\x02 [Att {}] | SOG {}-{} | BK {}-{} | HITS {}-{} | PP {}/{} {}PIMS - PP {}/{} {}PIMS | FO {}-{} | TK {}-{} | GV {}-{}"
-        AwayTeam = game["teams"]["away"]["abbreviation"]
-        AwayGoals = live["boxscore"]["teams"]["away"]["teamStats"]["teamSkaterStats"]["goals"]
-        HomeTeam = game["teams"]["home"]["abbreviation"]
-        HomeGoals = live["boxscore"]["teams"]["home"]["teamStats"]["teamSkaterStats"]["goals"]
-        Status = game["status"]["detailedState"]
-        Arena = game["teams"]["home"]["venue"]["name"]
-        Location = game["teams"]["home"]["venue"]["city"]
-
-        # Powerplay Info
-        HomePPG = live["boxscore"]["teams"]["home"]["teamStats"]["teamSkaterStats"]["powerPlayGoals"]
-        HomePPG = str(HomePPG)
-        HomePPG = HomePPG.rstrip('0').rstrip('.')
-        AwayPPG = live["boxscore"]["teams"]["away"]["teamStats"]["teamSkaterStats"]["powerPlayGoals"]
-        AwayPPG = str(AwayPPG)
-        AwayPPG = AwayPPG.rstrip('0').rstrip('.')
-
-        AwayPPO = live["boxscore"]["teams"]["away"]["teamStats"]["teamSkaterStats"]["powerPlayOpportunities"]
-        AwayPPO = str(AwayPPO)
-        AwayPPO = AwayPPO.rstrip('0').rstrip('.')
-        HomePPO = live["boxscore"]["teams"]["home"]["teamStats"]["teamSkaterStats"]["powerPlayOpportunities"]
-        HomePPO = str(HomePPO)
-        HomePPO = HomePPO.rstrip('0').rstrip('.')
-
-        # Game Stats
-        AwayShots = live["boxscore"]["teams"]["away"]["teamStats"]["teamSkaterStats"]["shots"]
-        HomeShots = live["boxscore"]["teams"]["home"]["teamStats"]["teamSkaterStats"]["shots"]
-        AwayBK = live["boxscore"]["teams"]["away"]["teamStats"]["teamSkaterStats"]["blocked"]
-        HomeBK = live["boxscore"]["teams"]["home"]["teamStats"]["teamSkaterStats"]["blocked"]
-        AwayHits = live["boxscore"]["teams"]["away"]["teamStats"]["teamSkaterStats"]["hits"]
-        HomeHits = live["boxscore"]["teams"]["home"]["teamStats"]["teamSkaterStats"]["hits"]
-        AwayPIM = live["boxscore"]["teams"]["away"]["teamStats"]["teamSkaterStats"]["pim"]
-        HomePIM = live["boxscore"]["teams"]["home"]["teamStats"]["teamSkaterStats"]["pim"]
-        AwayFO = live["boxscore"]["teams"]["away"]["teamStats"]["teamSkaterStats"]["faceOffWinPercentage"]
-        HomeFO = live["boxscore"]["teams"]["home"]["teamStats"]["teamSkaterStats"]["faceOffWinPercentage"]
-        AwayTake = live["boxscore"]["teams"]["away"]["teamStats"]["teamSkaterStats"]["takeaways"]
-        HomeTake = live["boxscore"]["teams"]["home"]["teamStats"]["teamSkaterStats"]["takeaways"]
-        AwayGive = live["boxscore"]["teams"]["away"]["teamStats"]["teamSkaterStats"]["giveaways"]
-        HomeGive = live["boxscore"]["teams"]["home"]["teamStats"]["teamSkaterStats"]["giveaways"]
-
-        # Goals
-        try:
-            reply_string = self._goalSummary(content_json)
-            if type(reply_string) is list:
-                Goals_String = []
-                for item in reply_string:
-                    Goals_String.append("{}: {}".format(self._bold("Goals"), item))
-            else:
-                Goals_String = "{}: {}".format(self._bold("Goals"), self._goalSummary(content_json))
-        except:
-            Goals_String = None
-
-        # Three Stars
-        FirstStar = live["decisions"]["firstStar"]["fullName"]
-        SecondStar = live["decisions"]["secondStar"]["fullName"]
-        ThirdStar = live["decisions"]["thirdStar"]["fullName"]
-
-        # Goalies
-        Winner = live["decisions"]["winner"]["fullName"]
-        Loser = live["decisions"]["loser"]["fullName"]
-
-        # Refs
-        Referees = []
-        RefTable = re.search(r"Referee.*?<table.*?>(.*?)<\/table>", HTMLcontent.text, re.S)
-        RefList = re.findall(r"<tr.*?>(.*?)<\/tr>", RefTable.group(0), re.S)
-        for elem in RefList:
-            addref = re.search(r'<td.*?>(.*?)<\/td>', elem)
-            addref = re.sub("<.*?>", "", addref.group(0))
-            Referees.append(addref)
-
-        Referees = "{}".format(' '.join(Referees))
-        Referees = re.sub("#20 Tim Peel", "\x02\0034-!- #20 Tim Peel -!-", Referees)
-
-        # IRC Replies
-        irc.reply(Header.format(AwayTeam, AwayGoals, HomeTeam, HomeGoals, Status, Attendance,
-                                AwayShots, HomeShots, AwayBK, HomeBK, AwayHits, HomeHits, AwayPPG,
-                                AwayPPO, AwayPIM, HomePPG, HomePPO, HomePIM, AwayFO, HomeFO,
-                                AwayTake, HomeTake, AwayGive, HomeGive))
-        if Goals_String:
-            if type(Goals_String) is list:
-                for item in Goals_String:
-                    irc.reply("{}".format(item))
-            else:
-                irc.reply("{}".format(Goals_String))
-        irc.reply("\x02Three Stars\x02: 1.{} 2.{} 3.{}    [\x02Goalies\x02 W: {} L: {}]".format(FirstStar, SecondStar, ThirdStar, Winner, Loser))
-        irc.reply("\x02Referees\x02: {}".format(str(Referees)))
-        irc.reply("\x02HTML Report\x02: {} \x02Video Highlights\x02: {}".format(HTMLurl.decode(), VIDEOurl.decode()))
+        # The short links are only needed for the last line, so they are
+        # requested in the background (unless they are already known) and
+        # the stats lines don't wait for them.
+        links = self._startShortening([HTMLurl, VIDEOurl])
+
+        # Everything below only depends on the gamepk, so fetch it all at
+        # once. Only the live feed (the snapshot) is required; the report is
+        # left out of the reply if it fails or times out.
+        fetched = self._fanOut({
+            'snapshot': (self._getSnapshot, gamepk),
+            'report': (self._getReport, gamepk),
+        })
+        Snapshot = fetched['snapshot']
+        if Snapshot is None:
+            irc.error("Couldn't fetch the game feed for {}.".format(gamepk))
+            return
+
+        Report = fetched['report'] or report.GameReport()
+        if Snapshot.state == "Final":
+            self._reports.markFinal(gamepk)
+            if self._store is not None:
+                self._saveFinalGame(Snapshot)
+
+        with self._metrics.span('format.summary', gamepk=gamepk):
+            lines = list(Snapshot.lines(Report.attendance or 'N/A',
+                                        Report.referees))
+        lines[0] += self._staleNote(url)
+        # The links line only goes in the same messages as the rest if the
+        # links are already known; a slow shortener doesn't hold the stats
+        # back.
+        if not self._linksReady(links):
+            self._replyLines(irc, msg, lines)
+            lines = []
+        links = self._finishShortening(links)
+        lines.append("\x02HTML Report\x02: {} \x02Video Highlights\x02: {}".format(links[HTMLurl], links[VIDEOurl]))
+        self._replyLines(irc, msg, lines)
 
     summary = wrap(summary, (['text']))
 
+    def _formatScore(self, game):
+        """Returns the scoreboard entry of game, a game record of the
+        'scores' schedule profile."""
+        (away, home) = (game['teams']['away'], game['teams']['home'])
+        names = [away['team']['abbreviation'], home['team']['abbreviation']]
+        status = game['status']
+        linescore = game.get('linescore', {})
+        if status['abstractGameState'] == 'Preview':
+            if status['detailedState'] != 'Scheduled':
+                # Postponed, TBD...
+                when = status['detailedState']
+            else:
+                when = self._ISODateToEasternTime(game['gameDate'],
+                                                  '%-I:%M %p')
+            return "{} @ {} {}".format(names[0], names[1], when)
+
+        scores = [away.get('score', 0), home.get('score', 0)]
+        period = linescore.get('currentPeriodOrdinal', '')
+        if status['abstractGameState'] == 'Final':
+            when = 'Final'
+            if period in ('OT', 'SO'):
+                when += '/' + period
+            # The winner in bold
+            if scores[0] != scores[1]:
+                winner = 0 if scores[0] > scores[1] else 1
+                names[winner] = self._bold(names[winner])
+        elif linescore.get('intermissionInfo', {}).get('inIntermission'):
+            when = "{} INT".format(period)
+        else:
+            when = "{} {}".format(period, linescore.get(
+                'currentPeriodTimeRemaining', '')).strip()
+        return "{} {} {} {} {}".format(names[0], scores[0], names[1],
+                                       scores[1], when)
+
+    def nhlscores(self, irc, msg, args, optargs):
+        """[<team>] [<date>]
+
+        Returns the scores of every game of <date> (today by default), or
+        only of <team>'s game.
+        """
+        try:
+            (team, date) = self._parseTeamAndDate(optargs)
+        except ValueError as e:
+            irc.error(str(e))
+            return
+        date = date or self._getTodayDate()
+        team_id = None
+        try:
+            if team is not None:
+                team = self._normalizeTeam(team)
+                team_id = self._teamId(team)
+            url = self._getEndpointURL(date, profile='scores',
+                                       team_id=team_id)
+            sched = self._getJSON(url)
+        except requests.RequestException as e:
+            self._upstreamError(irc, e)
+            return
+        games = []
+        for day in sched.get('dates', []):
+            games.extend(day['games'])
+        if team is not None:
+            games = [game for game in games
+                     if team in (game['teams']['away']['team']['abbreviation'],
+                                 game['teams']['home']['team']['abbreviation'])]
+        if not games:
+            if team is None:
+                irc.reply("No games on {}.".format(date))
+            else:
+                irc.error("No game found for {} on {}.".format(team, date))
+            return
+        with self._metrics.span('format.scores'):
+            entries = [self._formatScore(game) for game in games]
+        entries[0] += self._staleNote(url)
+        # The games are always packed (with a lighter separator).
+        self._replyLines(irc, msg, entries, separator=' | ', coalesce=True)
+
+    nhlscores = wrap(nhlscores, [optional('text')])
+
+    def _followers(self, abbrevs):
+        """Returns a list of (irc, channel) for the channels the bot is in
+        that follow any of the teams with the abbreviations abbrevs."""
+        abbrevs = set(abbrevs)
+        followers = []
+        for irc in world.ircs:
+            for channel in list(irc.state.channels):
+                if abbrevs & self.registryValue('alerts.teams', channel,
+                                              irc.network):
+                    followers.append((irc, channel))
+        return followers
+
+    def _announce(self, game):
+        """Sends what happened in game (a GameSnapshot) since the poller's
+        previous look at it to the channels following either team."""
+        lines = self._alerts.update(game)
+        if not lines:
+            return
+        for (irc, channel) in self._followers([game.away.abbreviation,
+                                               game.home.abbreviation]):
+            length = 512 - output.byteLength(":{} PRIVMSG {} :\r\n".format(
+                irc.prefix, channel))
+            for line in self._outputLines(lines, channel, irc.network,
+                                          length):
+                irc.queueMsg(ircmsgs.privmsg(channel, line))
+
+    def nhlfollow(self, irc, msg, args, channel, team):
+        """[<channel>] <team>
+
+        Announces the goals, start and final score of <team>'s games in
+        <channel> (if alerts.enable is on). <channel> is only necessary if
+        the message isn't sent in the channel itself.
+        """
+        directory = self._getTeams()
+        if directory is None:
+            irc.error("Couldn't fetch the list of teams, try again later.")
+            return
+        resolved = directory.resolve(team)
+        if resolved is None:
+            irc.error("Unknown team: {}.".format(team))
+            return
+        followed = self.registryValue('alerts.teams', channel,
+                                      irc.network, value=False)
+        followed.setValue(followed() | set([resolved.abbreviation]))
+        irc.replySuccess()
+
+    nhlfollow = wrap(nhlfollow, ['op', 'somethingWithoutSpaces'])
+
+    def nhlunfollow(self, irc, msg, args, channel, team):
+        """[<channel>] <team>
+
+        Stops announcing <team>'s games in <channel>. <channel> is only
+        necessary if the message isn't sent in the channel itself.
+        """
+        followed = self.registryValue('alerts.teams', channel,
+                                      irc.network, value=False)
+        team = self._normalizeTeam(team)
+        if team not in followed():
+            irc.error("{} doesn't follow {}.".format(channel, team))
+            return
+        followed.setValue(followed() - set([team]))
+        irc.replySuccess()
+
+    nhlunfollow = wrap(nhlunfollow, ['op', 'somethingWithoutSpaces'])
+
+    def nhlfollowing(self, irc, msg, args, channel):
+        """[<channel>]
+
+        Lists the teams whose games are announced in <channel>. <channel> is
+        only necessary if the message isn't sent in the channel itself.
+        """
+        followed = sorted(self.registryValue('alerts.teams', channel,
+                                             irc.network))
+        if not followed:
+            irc.reply("{} doesn't follow any team.".format(channel))
+            return
+        reply = "{} follows {}.".format(channel, ", ".join(followed))
+        if not self.registryValue('alerts.enable'):
+            reply += " (Alerts are disabled, see alerts.enable.)"
+        irc.reply(reply)
+
+    nhlfollowing = wrap(nhlfollowing, ['channel'])
+
+    def _getSeasonStats(self, season):
+        """Returns the SeasonStats of season, loaded from the data
+        directory the first time."""
+        stats = self._seasonStats.get(season)
+        if stats is None:
+            stats = self._seasonStats[season] = seasonstats.SeasonStats.load(
+                self._seasonStatsDirectory(season), season)
+        return stats
+
+    def _seasonStatsDirectory(self, season):
+        return conf.supybot.directories.data.dirize(
+            os.path.join('NHL-stats', season))
+
+    def _backfillStats(self, season, since=None):
+        """Stores the stats of the regular season games of season that are
+        final and not stored yet, played from since (the start of the
+        season by default) until yesterday. Returns (number of games stored,
+        number of games whose boxscore couldn't be fetched)."""
+        stats = self._getSeasonStats(season)
+        yesterday = (self._pacificTimeNow().date() -
+                     datetime.timedelta(days=1))
+        start = since or datetime.date(int(season[:4]), 9, 1)
+        end = min(yesterday, datetime.date(int(season[4:]), 6, 30))
+        if start > end:
+            return (0, 0)
+        sched = self._getJSON(self._getEndpointURL(
+            start.isoformat(), end.isoformat(), profile='results'))
+        games = [(day['date'], game) for day in sched.get('dates', [])
+                 for game in day['games']
+                 if game.get('gameType') == 'R' and
+                    game['status']['abstractGameState'] == 'Final' and
+                    game['gamePk'] not in stats]
+        # The boxscores are fetched one at a time, from this thread: the
+        # host's rate limit is what bounds a backfill anyway, and the
+        # shared thread pool stays free for the other commands. They
+        # don't go through the response cache either, which they would
+        # flush.
+        (rows, stored, failed) = ([], 0, 0)
+        for (date, game) in games:
+            url = seasonstats.BOXSCORE_URL.format(game['gamePk'])
+            try:
+                with self._metrics.span('fetch.boxscore', url=url):
+                    response = self._http.get(url)
+                response.raise_for_status()
+                rows.extend(seasonstats.gameRows(date, game, response.json()))
+                stored += 1
+            except (requests.RequestException, ValueError, KeyError) as e:
+                self.log.warning("NHL: no boxscore for {}: {}".format(
+                                 game['gamePk'], e))
+                failed += 1
+            if len(rows) >= 200:
+                stats.add(rows)
+                stats.save(self._seasonStatsDirectory(season))
+                rows = []
+        stats.add(rows)
+        if stored:
+            stats.save(self._seasonStatsDirectory(season))
+        return (stored, failed)
+
+    def _topUpStats(self, season, since):
+        try:
+            (stored, failed) = self._backfillStats(season, since)
+        except Exception as e:
+            self.log.warning("NHL: couldn't top up the season stats: "
+                             "{}".format(e))
+            return
+        if stored:
+            self.log.info("NHL: stored {} more games of the {} season".format(
+                          stored, season))
+
+    def nhlbackfill(self, irc, msg, args, season):
+        """[<season>]
+
+        Stores the team stats of every final regular season game of
+        <season> (like 20162017, the current one by default) that isn't
+        stored yet, for nhlteamstats. This takes a few minutes for a whole
+        season.
+        """
+        if season is None:
+            season = playoffs.seasonFor(self._pacificTimeNow().date())
+        elif not re.match(r'^(\d{4})(\d{4})$', season) or \
+                int(season[4:]) != int(season[:4]) + 1:
+            irc.error("Seasons look like 20162017.")
+            return
+        try:
+            (stored, failed) = self._backfillStats(season)
+        except requests.RequestException as e:
+            irc.error("Couldn't fetch the {} schedule: {}".format(season, e))
+            return
+        self._statsToppedUp[season] = time.time()
+        reply = "Stored {} more games of the {} season ({} in total).".format(
+            stored, season, len(self._getSeasonStats(season)) // 2)
+        if failed:
+            reply += " {} boxscores couldn't be fetched.".format(failed)
+        irc.reply(reply)
+
+    nhlbackfill = wrap(nhlbackfill, ['owner',
+                                     optional('somethingWithoutSpaces')])
+
+    def nhlteamstats(self, irc, msg, args, team, games):
+        """<team> [<games>]
+
+        Returns <team>'s record and per-game averages over its last <games>
+        games of the current season (all of them by default). The games
+        must have been stored by nhlbackfill; the games played since are
+        added in the background, once an hour.
+        """
+        season = playoffs.seasonFor(self._pacificTimeNow().date())
+        stats = self._getSeasonStats(season)
+        if not len(stats):
+            irc.error("No games of the {} season are stored yet (see "
+                      "nhlbackfill).".format(season))
+            return
+        if time.time() - self._statsToppedUp.get(season, 0) > \
+                self._STATS_TOP_UP:
+            # The games played since are added in the background: this
+            # reply (and the next ones until it's done) uses what's stored.
+            self._statsToppedUp[season] = time.time()
+            self._executor.submit(self._topUpStats, season, stats.lastDate())
+        team = self._normalizeTeam(team)
+        team_id = self._teamId(team)
+        aggregate = stats.aggregate(team_id, games) if team_id else None
+        if aggregate is None:
+            irc.error("No games of {} are stored.".format(team))
+            return
+        with self._metrics.span('format.teamstats'):
+            irc.reply("{} {} ({} to {}): {}-{}-{} | GF {:.2f} GA {:.2f} | "
+                      "SOG {:.1f}-{:.1f} | PP {:.1f}% ({}/{}) | FO {:.1f}% | "
+                      "HITS {:.1f} | BK {:.1f} | PIM {:.1f} | "
+                      "TK {:.1f} GV {:.1f}".format(
+                      self._bold(team),
+                      "last {} games".format(aggregate.games)
+                      if games else "season", aggregate.first,
+                      aggregate.last, aggregate.win, aggregate.losses,
+                      aggregate.ot_loss, aggregate.average('goals'),
+                      aggregate.average('goals_against'),
+                      aggregate.average('shots'),
+                      aggregate.average('shots_against'),
+                      aggregate.powerPlayPercentage(), aggregate.pp_goals,
+                      aggregate.pp_opportunities,
+                      aggregate.average('faceoff_pct'),
+                      aggregate.average('hits'), aggregate.average('blocked'),
+                      aggregate.average('pim'), aggregate.average('takeaways'),
+                      aggregate.average('giveaways')))
+
+    nhlteamstats = wrap(nhlteamstats, ['somethingWithoutSpaces',
+                                       optional('positiveInt')])
+
+    def _formatTimings(self, title, prefix):
+        timings = []
+        for (name, histogram) in self._metrics.histograms(prefix):
+            timings.append("{} {}x {:.0f}/{:.0f}/{:.0f}ms".format(
+                name, histogram.count, histogram.percentile(50) * 1000,
+                histogram.percentile(95) * 1000, histogram.max * 1000))
+        return "{}: {}".format(self._bold(title),
+                               " | ".join(timings) or "nothing yet")
+
+    def _formatRatio(self, hits, misses):
+        lookups = hits + misses
+        if not lookups:
+            return "no lookups"
+        return "{:.0%} of {}".format(hits / lookups, lookups)
+
+    def nhlstats(self, irc, msg, args, reset):
+        """[reset]
+
+        Shows the timings (median/95th percentile/maximum) of the commands,
+        upstream requests, parsing and reply formatting, the cache hit ratios
+        and the requests in flight. With 'reset', the timings start over.
+        """
+        if reset:
+            self._metrics.reset()
+            irc.replySuccess()
+            return
+        lines = [self._formatTimings("Commands", 'command.'),
+                 self._formatTimings("Upstream", 'fetch.'),
+                 "{} {}".format(self._formatTimings("Parsing", 'parse.'),
+                                self._formatTimings("Formatting", 'format.'))]
+
+        responses = self._cache.stats()
+        links = self._shortener.stats()
+        memory = "{:.1f}".format(responses['bytes'] / 2**20)
+        if responses['max_bytes']:
+            memory += "/{:.1f}".format(responses['max_bytes'] / 2**20)
+        caches = ["responses {} ({} revalidated, {} evicted, {}/{} "
+                  "entries, {} MiB, compressed {:.1f}x)".format(
+                      self._formatRatio(responses['hits'],
+                                        responses['misses']),
+                      responses['revalidations'], responses['evictions'],
+                      responses['entries'], responses['max_entries'],
+                      memory, responses['compression_ratio']),
+                  "links {}".format(self._formatRatio(links['hits'],
+                                                      links['misses']))]
+        if self._store is not None:
+            caches.append("store {}".format(self._formatRatio(
+                self._store.hits, self._store.misses)))
+        open_spans = self._metrics.inFlight()
+        fetching = sum(count for (name, count) in open_spans.items()
+                       if name.startswith('fetch.'))
+        flights = self._flights.stats()
+        failing = self._http.guards.failing()
+        if failing:
+            lines.append("{}: {}".format(self._bold("Failing hosts"),
+                ", ".join("{} (retrying in {:.0f}s)".format(host, remaining)
+                          for (host, remaining) in sorted(failing.items()))))
+        lines.append("{}: {} | {}: {} upstream requests, {} shared by "
+                     "concurrent callers since loaded | Timings since "
+                     "{}".format(self._bold("Caches"), ", ".join(caches),
+                                 self._bold("In flight"), fetching,
+                                 flights['saved'],
+                                 time.strftime('%Y-%m-%d %H:%M',
+                                               time.localtime(
+                                                   self._metrics.started))))
+        self._replyLines(irc, msg, lines)
+
+    nhlstats = wrap(nhlstats, ['owner', optional(('literal', ['reset']))])
+
 Class = NHL
 
 # vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
\ No newline at end of file
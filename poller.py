@@ -0,0 +1,249 @@
+###
+# Copyright (c) 2017, cottongin
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE
+###
+
+###
+# Includes contributions from Santiago Gil and Jonathan "grateful" Surman
+###
+
+
+"""
+Background poller that keeps the live feed of current games warm.
+
+Every few minutes the poller reads today's (cached) schedule and starts
+tracking the games that are in progress or about to start. Each tracked game
+has its own supybot.schedule event that refreshes its live feed (the
+'feed/live' response in the plugin's cache, or the full document patched
+with diffPatch, see NHL._refreshFeed) and re-arms itself: quickly while the puck is in play,
+slowly during intermissions and before the game, and not at all once the
+game is Final. Commands asking about a tracked game are then answered from
+memory, and each new version of the game is checked for alerts (see the
+alerts module).
+
+The poller runs when poller.enable is on, tracking every game, or when
+alerts.enable is on, tracking the games of the teams followed by a channel.
+
+Schedule events run in the bot's main loop, so they only hand the actual
+network work over to the plugin's thread pool.
+"""
+
+import threading
+import time
+
+import dateutil.parser
+
+import supybot.schedule as schedule
+
+
+
+SCAN_EVENT = 'NHL.poller.scan'
+
+# A game that still hasn't started this long after its scheduled start
+# (postponed or suspended) isn't polled any more.
+START_GRACE = 4 * 3600
+
+
+class LiveGamePoller(object):
+    """Tracks in-progress games and refreshes their live feeds."""
+
+    def __init__(self, plugin):
+        self.plugin = plugin
+        self.log = plugin.log
+        # gamepk -> name of the scheduled event that will poll it next
+        self.games = {}
+        # gamepk -> scheduled start (a timestamp) of the tracked games
+        self.starts = {}
+        self._lock = threading.Lock()
+
+    def start(self):
+        schedule.addPeriodicEvent(self._submit(self.scan),
+                                  self.plugin.registryValue(
+                                      'poller.scanInterval'),
+                                  name=SCAN_EVENT, now=False)
+
+    def stop(self):
+        with self._lock:
+            names = [SCAN_EVENT] + list(self.games.values())
+            self.games.clear()
+            self.starts.clear()
+        for name in names:
+            try:
+                schedule.removeEvent(name)
+            except KeyError:
+                pass
+
+    def enabled(self):
+        return (self.plugin.registryValue('poller.enable') or
+                self.plugin.registryValue('alerts.enable'))
+
+    def _submit(self, f, *args):
+        """Returns a callable that runs f(*args) on the plugin's thread pool
+        instead of blocking the main loop."""
+        def submit():
+            self.plugin._executor.submit(self._run, f, *args)
+        return submit
+
+    def _run(self, f, *args):
+        try:
+            f(*args)
+        except Exception as e:
+            self.log.exception('NHL: poller error in {}: {}'.format(
+                               f.__name__, e))
+
+    def scan(self):
+        """Starts tracking every game of today's schedule (as found in the
+        schedule index) that is in progress or starts within
+        poller.lookahead minutes. With only alerts enabled, the games
+        without followers are left out. Tracked games that are no longer
+        in the schedule stop being tracked, unless they are in progress."""
+        if not self.enabled():
+            return
+        everything = self.plugin.registryValue('poller.enable')
+        lookahead = self.plugin.registryValue('poller.lookahead') * 60
+        now = time.time()
+        games = self.plugin._getTodayGames()
+        scheduled = set(str(game['gamePk']) for game in games)
+        with self._lock:
+            gone = [gamepk for gamepk in self.games
+                    if gamepk not in scheduled]
+        for gamepk in gone:
+            current = self.plugin._snapshots.get(gamepk)
+            if current is None or current.state != 'Live':
+                self.log.info('NHL: game {} is no longer scheduled, poller '
+                              'stops tracking it'.format(gamepk))
+                self._stopTracking(gamepk)
+        for game in games:
+            state = game['status']['abstractGameState']
+            if state == 'Final':
+                continue
+            if not everything and not self.plugin._followers(
+                    [game['teams'][side]['team'].get('abbreviation', '')
+                     for side in ('away', 'home')]):
+                continue
+            start = dateutil.parser.parse(game['gameDate']).timestamp()
+            if state == 'Live' or start - now <= lookahead:
+                self.track(str(game['gamePk']), start)
+
+    def track(self, gamepk, start=None):
+        """Polls gamepk (scheduled to start at the timestamp start) right
+        away unless it is already being tracked."""
+        with self._lock:
+            if gamepk in self.games:
+                return
+            self.games[gamepk] = None
+            if start is not None:
+                self.starts[gamepk] = start
+        self.log.info('NHL: poller tracking game {}'.format(gamepk))
+        self._schedule(gamepk, 0)
+
+    def _schedule(self, gamepk, delay):
+        name = 'NHL.poller.{}'.format(gamepk)
+        with self._lock:
+            if gamepk not in self.games:
+                # Stopped while we were fetching.
+                return
+            self.games[gamepk] = name
+        try:
+            schedule.removeEvent(name)
+        except KeyError:
+            pass
+        schedule.addEvent(self._submit(self.poll, gamepk),
+                          time.time() + delay, name=name)
+
+    def poll(self, gamepk):
+        """Refreshes the live feed of gamepk and schedules the next refresh
+        according to the state of the game."""
+        if not self.enabled():
+            self._untrack(gamepk)
+            return
+        url = self.plugin._getFeedURL(gamepk)
+        try:
+            game = self.plugin._refreshFeed(gamepk)
+        except Exception as e:
+            self.log.warning('NHL: poller could not refresh {}: {}'.format(
+                             gamepk, e))
+            self._schedule(gamepk,
+                           self.plugin.registryValue('poller.interval.pregame'))
+            return
+        if self.plugin.registryValue('alerts.enable'):
+            self.plugin._announce(game)
+        interval = self.nextInterval(game)
+        if interval is None:
+            self.log.info('NHL: game {} is final, poller stops tracking '
+                          'it'.format(gamepk))
+            self._stopTracking(gamepk)
+            return
+        with self._lock:
+            start = self.starts.get(gamepk)
+        if game.state != 'Live' and start is not None and \
+                time.time() - start > START_GRACE:
+            self.log.info('NHL: game {} still hasn\'t started, poller stops '
+                          'tracking it'.format(gamepk))
+            self._stopTracking(gamepk)
+            return
+        # Keep the feed fresh until the next poll replaces it, so that
+        # commands never hit the network for a tracked game. A feed kept up
+        # to date with diffPatch is newer than the cached response, which
+        # is only as recent as the last full download.
+        if self.plugin._feeds.get(gamepk) is not None:
+            self.plugin._feeds.extend(gamepk, interval + 5)
+        else:
+            self.plugin._cache.extend(url, interval + 5)
+        self._schedule(gamepk, interval)
+
+    def _stopTracking(self, gamepk):
+        """Untracks gamepk and forgets its patched feed."""
+        self._untrack(gamepk)
+        if self.plugin._feeds.drop(gamepk) is not None:
+            # The cached response is older than the patched feed.
+            self.plugin._cache.invalidate(self.plugin._getFeedURL(gamepk))
+
+    def _untrack(self, gamepk):
+        with self._lock:
+            name = self.games.pop(gamepk, None)
+            self.starts.pop(gamepk, None)
+        self.plugin._alerts.forget(gamepk)
+        if name is not None:
+            try:
+                schedule.removeEvent(name)
+            except KeyError:
+                pass
+
+    def nextInterval(self, game):
+        """Returns the number of seconds until the feed of game (a
+        GameSnapshot) should be refreshed, or None if the game is over."""
+        if game.state == 'Final':
+            return None
+        elif game.state != 'Live':
+            return self.plugin.registryValue('poller.interval.pregame')
+        elif game.intermission:
+            return self.plugin.registryValue('poller.interval.intermission')
+        return self.plugin.registryValue('poller.interval.live')
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
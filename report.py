@@ -0,0 +1,156 @@
+###
+# Copyright (c) 2017, cottongin
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE
+###
+
+###
+# Includes contributions from Santiago Gil and Jonathan "grateful" Surman
+###
+
+
+"""
+Parser for the NHL 'Game Summary' (GS) HTML report.
+
+The report is a large HTML document of which the plugin only needs the
+attendance and the officials. The patterns below are compiled once and the
+document is scanned forward a single time: attendance first, then the
+officials header, then the referees' and linesmen's tables that follow it.
+"""
+
+import html
+import re
+import threading
+import time
+
+
+_ATTENDANCE = re.compile(r'Attendance\s*(\d[\d,]*)')
+_OFFICIALS = re.compile(r'>\s*Referee\s*<', re.I)
+_TABLE = re.compile(r'<table[^>]*>(.*?)</table>', re.I | re.S)
+_CELL = re.compile(r'<td[^>]*>(.*?)</td>', re.I | re.S)
+_TAG = re.compile(r'<[^>]*>')
+
+
+def reportURL(gamepk):
+    """Returns the URL of the GS report of gamepk. The first four digits of
+    a gamePk are the year the season started."""
+    gamepk = str(gamepk)
+    year = int(gamepk[:4])
+    return ("http://www.nhl.com/scores/htmlreports/{}{}/GS{}.HTM".format(
+            year, year + 1, gamepk[4:]))
+
+
+class GameReport(object):
+    """What the plugin uses from a GS report."""
+    __slots__ = ('attendance', 'referees', 'linesmen')
+
+    def __init__(self, attendance=None, referees=(), linesmen=()):
+        self.attendance = attendance
+        self.referees = list(referees)
+        self.linesmen = list(linesmen)
+
+    def __repr__(self):
+        return 'GameReport({!r}, {!r}, {!r})'.format(
+            self.attendance, self.referees, self.linesmen)
+
+
+def _names(table):
+    names = []
+    for cell in _CELL.findall(table):
+        name = html.unescape(_TAG.sub('', cell)).strip()
+        if name:
+            names.append(name)
+    return names
+
+
+def parseReport(body):
+    """Returns a GameReport for body (bytes or str), or None if there is no
+    report. Missing parts are left empty instead of raising."""
+    if not body:
+        return None
+    if isinstance(body, bytes):
+        body = body.decode('utf-8', 'replace')
+    report = GameReport()
+    position = 0
+    match = _ATTENDANCE.search(body)
+    if match:
+        report.attendance = match.group(1)
+        position = match.end()
+    match = _OFFICIALS.search(body, position)
+    if match:
+        referees = _TABLE.search(body, match.end())
+        if referees:
+            report.referees = _names(referees.group(1))
+            linesmen = _TABLE.search(body, referees.end())
+            if linesmen:
+                report.linesmen = _names(linesmen.group(1))
+    return report
+
+
+class ReportCache(object):
+    """Parsed reports by gamePk. A report expires after its TTL until the
+    game is marked final; then it is kept for good, since it won't change
+    anymore (the records are tiny)."""
+
+    def __init__(self):
+        self._reports = {}
+        self._lock = threading.Lock()
+
+    def get(self, gamepk):
+        with self._lock:
+            item = self._reports.get(gamepk)
+        if item is None:
+            return None
+        (report, expires) = item
+        if expires is not None and expires < time.time():
+            return None
+        return report
+
+    def put(self, gamepk, report, ttl):
+        with self._lock:
+            item = self._reports.get(gamepk)
+            if item is not None and item[1] is None:
+                # Already final
+                return
+            self._reports[gamepk] = (report, time.time() + ttl)
+
+    def markFinal(self, gamepk):
+        with self._lock:
+            item = self._reports.get(gamepk)
+            if item is not None:
+                self._reports[gamepk] = (item[0], None)
+
+    def prune(self):
+        """Drops the expired reports of games that aren't final."""
+        now = time.time()
+        with self._lock:
+            for gamepk in [gamepk for (gamepk, (report, expires))
+                           in self._reports.items()
+                           if expires is not None and expires < now]:
+                del self._reports[gamepk]
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -0,0 +1,199 @@
+###
+# Copyright (c) 2017, cottongin
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE
+###
+
+###
+# Includes contributions from Santiago Gil and Jonathan "grateful" Surman
+###
+
+
+"""
+Protection of the upstream hosts, and of the bot from them.
+
+Each host gets a HostGuard made of:
+
+* a token bucket, which spreads the requests to the host out to a sustained
+  rate with some room for bursts (a command that would have to wait longer
+  than allowed for its turn fails right away instead);
+* a circuit breaker, which opens after a number of consecutive failures:
+  requests then fail right away, without touching the network, until a
+  cooldown has passed. A single probe request is then let through; if it
+  fails the circuit opens again for twice as long (up to a limit).
+
+Failures raise UpstreamUnavailable, a requests.RequestException, so callers
+handle them like any other failed request (typically by serving a stale
+copy from the cache).
+"""
+
+import threading
+import time
+
+import requests
+
+
+class UpstreamUnavailable(requests.RequestException):
+    """The request was not sent: the host's circuit is open, or it is being
+    sent too many requests."""
+
+
+class TokenBucket(object):
+    """Allows rate requests per second on average, and up to burst at
+    once."""
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, max_wait):
+        """Takes a token and returns the number of seconds to wait before
+        using it, or None (taking nothing) if that is more than max_wait."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens +
+                               (now - self._updated) * self.rate)
+            self._updated = now
+            wait = max(0.0, (1 - self._tokens) / self.rate)
+            if wait > max_wait:
+                return None
+            self._tokens -= 1
+            return wait
+
+
+class CircuitBreaker(object):
+    """Opens after threshold consecutive failures, for cooldown seconds at
+    first, then twice as long after each failed probe (up to
+    max_cooldown)."""
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, threshold, cooldown, max_cooldown=600):
+        self.threshold = threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.state = self.CLOSED
+        self.failures = 0
+        self.cooldown = cooldown
+        self.opened = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Returns whether a request may be sent now."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            elif self.state == self.OPEN and \
+                    time.monotonic() - self.opened >= self.cooldown:
+                # Let a single probe through
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self.cooldown = self.base_cooldown
+
+    def failure(self):
+        """Records a failure and returns whether the circuit (re)opened."""
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN:
+                self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+            elif self.state == self.OPEN or self.failures < self.threshold:
+                return False
+            self.state = self.OPEN
+            self.opened = time.monotonic()
+            return True
+
+    def remaining(self):
+        """Returns the number of seconds until the next probe."""
+        with self._lock:
+            if self.state != self.OPEN:
+                return 0
+            return max(0, self.cooldown - (time.monotonic() - self.opened))
+
+
+class HostGuard(object):
+    """The token bucket and circuit breaker of a host."""
+
+    def __init__(self, host, rate, burst, threshold, cooldown):
+        self.host = host
+        self.bucket = TokenBucket(rate, burst)
+        self.breaker = CircuitBreaker(threshold, cooldown)
+
+    def enter(self, max_wait):
+        """Waits for the turn of a request to the host, or raises
+        UpstreamUnavailable."""
+        wait = self.bucket.reserve(max_wait)
+        if wait is None:
+            raise UpstreamUnavailable('Too many requests to {}'.format(
+                                      self.host))
+        if not self.breaker.allow():
+            raise UpstreamUnavailable('{} is failing, not retrying for '
+                                      '{:.0f}s'.format(
+                                      self.host, self.breaker.remaining()))
+        if wait:
+            time.sleep(wait)
+
+
+class HostGuards(object):
+    """A HostGuard per host, created on first use."""
+
+    def __init__(self, rate=5.0, burst=10, threshold=5, cooldown=30):
+        self.rate = rate
+        self.burst = burst
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._guards = {}
+        self._lock = threading.Lock()
+
+    def get(self, host):
+        with self._lock:
+            guard = self._guards.get(host)
+            if guard is None:
+                guard = self._guards[host] = HostGuard(
+                    host, self.rate, self.burst, self.threshold,
+                    self.cooldown)
+            return guard
+
+    def failing(self):
+        """Returns a dict of host -> seconds until the next probe, for the
+        hosts whose circuit isn't closed."""
+        with self._lock:
+            guards = list(self._guards.values())
+        return dict((guard.host, guard.breaker.remaining())
+                    for guard in guards
+                    if guard.breaker.state != CircuitBreaker.CLOSED)
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
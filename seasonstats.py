@@ -0,0 +1,275 @@
+###
+# Copyright (c) 2017, cottongin
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE
+###
+
+###
+# Includes contributions from Santiago Gil and Jonathan "grateful" Surman
+###
+
+
+"""
+Columnar store of the team stats of a season's games.
+
+Each game adds a row per team: goals for and against, shots, hits, power
+plays, faceoffs... Every stat is a column of its own, an array.array of
+machine values, and the rows are kept ordered by team and date. A team's
+games are therefore a contiguous slice of each column, its last N games the
+end of that slice, and an aggregate is a sum() over slices, run in C,
+instead of a walk through the nested boxscores of N live feeds.
+
+The columns are saved as raw files, one per column (array.tofile), and
+loaded back with a single fromfile each. The rows come from the boxscores
+of the season's final games (see the nhlbackfill command).
+"""
+
+import array
+import datetime
+import json
+import os
+import sys
+import threading
+
+
+# name -> array typecode, in the order of the rows' fields
+COLUMNS = [
+    ('gamepk', 'q'),
+    # datetime.date.toordinal() of the game's (local) date
+    ('date', 'i'),
+    ('team', 'h'),
+    ('opponent', 'h'),
+    ('home', 'b'),
+    ('win', 'b'),
+    # Lost in overtime or in a shootout
+    ('ot_loss', 'b'),
+    ('goals', 'h'),
+    ('goals_against', 'h'),
+    ('shots', 'h'),
+    ('shots_against', 'h'),
+    ('hits', 'h'),
+    ('pim', 'h'),
+    ('pp_goals', 'h'),
+    ('pp_opportunities', 'h'),
+    ('faceoff_pct', 'f'),
+    ('blocked', 'h'),
+    ('takeaways', 'h'),
+    ('giveaways', 'h'),
+]
+
+_TYPECODES = dict(COLUMNS)
+
+BOXSCORE_URL = "https://statsapi.web.nhl.com/api/v1/game/{}/boxscore"
+
+
+def _integer(value):
+    """The API sends some counts as floats or strings ("1.0")."""
+    return int(float(value or 0))
+
+
+def gameRows(date, game, boxscore):
+    """Returns the two rows (dicts of column -> value) of game, a record of
+    the 'results' schedule profile played on date ('YYYY-MM-DD'), from its
+    boxscore."""
+    ordinal = datetime.datetime.strptime(date, '%Y-%m-%d').toordinal()
+    overtime = game.get('linescore', {}).get('currentPeriod', 3) > 3
+    sides = {}
+    for side in ('away', 'home'):
+        team = boxscore['teams'][side]
+        stats = team['teamStats']['teamSkaterStats']
+        sides[side] = (team['team']['id'], stats,
+                       game['teams'][side].get('score', 0))
+    rows = []
+    for (side, other) in (('away', 'home'), ('home', 'away')):
+        (team, stats, score) = sides[side]
+        (opponent, against, opponent_score) = sides[other]
+        rows.append({
+            'gamepk': game['gamePk'], 'date': ordinal, 'team': team,
+            'opponent': opponent, 'home': side == 'home',
+            'win': score > opponent_score,
+            'ot_loss': overtime and score < opponent_score,
+            'goals': _integer(stats.get('goals')),
+            'goals_against': _integer(against.get('goals')),
+            'shots': _integer(stats.get('shots')),
+            'shots_against': _integer(against.get('shots')),
+            'hits': _integer(stats.get('hits')),
+            'pim': _integer(stats.get('pim')),
+            'pp_goals': _integer(stats.get('powerPlayGoals')),
+            'pp_opportunities': _integer(
+                stats.get('powerPlayOpportunities')),
+            'faceoff_pct': float(stats.get('faceOffWinPercentage') or 0),
+            'blocked': _integer(stats.get('blocked')),
+            'takeaways': _integer(stats.get('takeaways')),
+            'giveaways': _integer(stats.get('giveaways')),
+        })
+    return rows
+
+
+class TeamAggregate(object):
+    """Totals of a team's stats over a range of games."""
+    __slots__ = ['games', 'first', 'last'] + [name for (name, code)
+                                               in COLUMNS[5:]]
+
+    def __init__(self, columns, start, end):
+        self.games = end - start
+        self.first = datetime.date.fromordinal(columns['date'][start])
+        self.last = datetime.date.fromordinal(columns['date'][end - 1])
+        for (name, code) in COLUMNS[5:]:
+            setattr(self, name, sum(columns[name][start:end]))
+
+    @property
+    def losses(self):
+        return self.games - self.win - self.ot_loss
+
+    def average(self, name):
+        """Returns the per-game average of the stat name."""
+        return getattr(self, name) / self.games
+
+    def powerPlayPercentage(self):
+        if not self.pp_opportunities:
+            return 0.0
+        return 100.0 * self.pp_goals / self.pp_opportunities
+
+
+class SeasonStats(object):
+    """The team rows of a season, in columns ordered by team and date."""
+
+    def __init__(self, season):
+        self.season = season
+        self._columns = dict((name, array.array(code))
+                             for (name, code) in COLUMNS)
+        # team id -> (start, end) of its rows
+        self._ranges = {}
+        self._games = set()
+        # (gamepk, team) of every row
+        self._keys = set()
+        self._lock = threading.Lock()
+        # A backfill and a top-up may save at the same time, to the same
+        # temporary files.
+        self._saveLock = threading.Lock()
+
+    def __len__(self):
+        return len(self._columns['gamepk'])
+
+    def __contains__(self, gamepk):
+        return gamepk in self._games
+
+    def lastDate(self):
+        """Returns the date of the most recent stored game, or None."""
+        with self._lock:
+            dates = self._columns['date']
+            if not dates:
+                return None
+            return datetime.date.fromordinal(max(dates))
+
+    def add(self, rows):
+        """Stores rows (see gameRows), skipping the games already
+        stored."""
+        with self._lock:
+            added = False
+            for row in rows:
+                key = (row['gamepk'], row['team'])
+                if key in self._keys:
+                    continue
+                self._keys.add(key)
+                for (name, code) in COLUMNS:
+                    self._columns[name].append(row[name])
+                added = True
+            if added:
+                self._reindex()
+
+    def _reindex(self):
+        """Sorts the rows by team and date and finds each team's range."""
+        (gamepks, dates, teams) = (self._columns['gamepk'],
+                                   self._columns['date'],
+                                   self._columns['team'])
+        order = sorted(range(len(gamepks)),
+                       key=lambda i: (teams[i], dates[i], gamepks[i]))
+        for (name, code) in COLUMNS:
+            column = self._columns[name]
+            self._columns[name] = array.array(code, [column[i]
+                                                     for i in order])
+        self._ranges = {}
+        for (index, team) in enumerate(self._columns['team']):
+            (start, end) = self._ranges.get(team, (index, index))
+            self._ranges[team] = (start, index + 1)
+        self._games = set(self._columns['gamepk'])
+        self._keys = set(zip(self._columns['gamepk'], self._columns['team']))
+
+    def aggregate(self, team, last=None):
+        """Returns the TeamAggregate of the team with id team over its last
+        games (all of them if last is None), or None if it has none."""
+        with self._lock:
+            (start, end) = self._ranges.get(team, (0, 0))
+            if last is not None:
+                start = max(start, end - last)
+            if start == end:
+                return None
+            return TeamAggregate(self._columns, start, end)
+
+    def save(self, directory):
+        """Writes the columns to directory, one raw file each."""
+        os.makedirs(directory, exist_ok=True)
+        with self._saveLock:
+            with self._lock:
+                for (name, code) in COLUMNS:
+                    filename = os.path.join(directory, name + '.bin')
+                    with open(filename + '.tmp', 'wb') as fd:
+                        self._columns[name].tofile(fd)
+                    os.replace(filename + '.tmp', filename)
+                meta = {'season': self.season, 'rows': len(self),
+                        'byteorder': sys.byteorder, 'columns': _TYPECODES}
+            filename = os.path.join(directory, 'meta.json')
+            with open(filename + '.tmp', 'w') as fd:
+                json.dump(meta, fd)
+            os.replace(filename + '.tmp', filename)
+
+    @classmethod
+    def load(cls, directory, season):
+        """Returns the SeasonStats saved in directory, or an empty one if
+        there is none (or it doesn't match the current columns)."""
+        stats = cls(season)
+        try:
+            with open(os.path.join(directory, 'meta.json')) as fd:
+                meta = json.load(fd)
+            if meta['columns'] != _TYPECODES or meta['season'] != season:
+                return stats
+            columns = {}
+            for (name, code) in COLUMNS:
+                column = array.array(code)
+                with open(os.path.join(directory, name + '.bin'), 'rb') as fd:
+                    column.fromfile(fd, meta['rows'])
+                if meta['byteorder'] != sys.byteorder:
+                    column.byteswap()
+                columns[name] = column
+        except (OSError, ValueError, KeyError, EOFError):
+            return stats
+        stats._columns = columns
+        stats._reindex()
+        return stats
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
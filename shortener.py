@@ -0,0 +1,120 @@
+###
+# Copyright (c) 2017, cottongin
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE
+###
+
+###
+# Includes contributions from Santiago Gil and Jonathan "grateful" Surman
+###
+
+
+"""
+Memoized URL shortening.
+
+A short link never changes for a given long URL, so each one is only ever
+requested once: links are remembered in memory (most recently used first)
+and, if a store is given, on disk so they survive restarts.
+"""
+
+import threading
+from collections import OrderedDict
+
+from . import cache
+
+
+class LinkShortener(object):
+    """Remembers the short links returned by fetch(long_url)."""
+
+    def __init__(self, fetch, store=None, max_entries=1024):
+        self._fetch = fetch
+        self._store = store
+        self.max_entries = max_entries
+        self._links = OrderedDict()
+        self._lock = threading.Lock()
+        self._flights = cache.SingleFlight()
+        self.hits = 0
+        self.misses = 0
+
+    def cached(self, url):
+        """Returns the short link for url if it is known, without any
+        network request, or None."""
+        with self._lock:
+            link = self._links.get(url)
+            if link is not None:
+                self._links.move_to_end(url)
+                self.hits += 1
+                return link
+        if self._store is not None:
+            link = self._store.getLink(url)
+            if link is not None:
+                self._remember(url, link)
+                with self._lock:
+                    self.hits += 1
+                return link
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def shorten(self, url):
+        """Returns the short link for url, requesting it if needed.
+        Concurrent requests for the same url share one request."""
+        link = self.cached(url)
+        if link is not None:
+            return link
+        return self.request(url)
+
+    def request(self, url):
+        """Returns the short link for url, requesting it unless another
+        thread just did, for a caller whose cached() lookup already missed
+        (and was counted)."""
+        with self._lock:
+            link = self._links.get(url)
+        if link is not None:
+            return link
+        return self._flights.do(url, self._resolve, url)
+
+    def _resolve(self, url):
+        link = self._fetch(url)
+        self._remember(url, link)
+        if self._store is not None:
+            self._store.saveLink(url, link)
+        return link
+
+    def _remember(self, url, link):
+        with self._lock:
+            self._links[url] = link
+            self._links.move_to_end(url)
+            while len(self._links) > self.max_entries:
+                self._links.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._links), 'hits': self.hits,
+                    'misses': self.misses}
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -0,0 +1,261 @@
+###
+# Copyright (c) 2017, cottongin
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE
+###
+
+###
+# Includes contributions from Santiago Gil and Jonathan "grateful" Surman
+###
+
+
+"""
+Compact model of a game, built once per version of its live feed.
+
+A GameSnapshot holds the few dozen values of the live feed that the summary
+command shows, as plain attributes, instead of the nested dicts of the feed.
+It is built from the parsed feed once, kept as long as the feed doesn't
+change, and memoizes the IRC lines rendered from it, so a summary of a game
+that hasn't changed since the last one is neither parsed nor formatted
+again.
+
+When the feed does change, the goals scored before are carried over from the
+previous snapshot, formatted text included: the feedparse.PlayIndex of the
+game hands back the very same play objects for the plays it had already
+seen, so only the new goals are built.
+"""
+
+import threading
+from collections import OrderedDict
+
+import supybot.ircutils as ircutils
+
+
+def _number(value):
+    """Formats a number of the API (which are sometimes floats, like 1.0)
+    without a useless fractional part."""
+    if isinstance(value, float):
+        return '{:g}'.format(value)
+    return str(value)
+
+
+def _shortName(name):
+    """'Sidney Crosby' -> 'S.Crosby', 'James van Riemsdyk' ->
+    'J.van Riemsdyk'"""
+    parts = name.split()
+    if not parts:
+        return ''
+    short = parts[0][0] + '.'
+    if len(parts) > 2:
+        short += parts[1] + ' '
+    return short + parts[-1]
+
+
+class TeamStats(object):
+    """A team's side of the boxscore."""
+    __slots__ = ('abbreviation', 'goals', 'shots', 'blocked', 'hits', 'pim',
+                 'power_play_goals', 'power_play_opportunities',
+                 'faceoff_pct', 'takeaways', 'giveaways')
+
+    def __init__(self, abbreviation, stats):
+        self.abbreviation = abbreviation
+        self.goals = stats.get('goals', 0)
+        self.shots = stats.get('shots', 0)
+        self.blocked = stats.get('blocked', 0)
+        self.hits = stats.get('hits', 0)
+        self.pim = stats.get('pim', 0)
+        self.power_play_goals = _number(stats.get('powerPlayGoals', 0))
+        self.power_play_opportunities = _number(
+            stats.get('powerPlayOpportunities', 0))
+        self.faceoff_pct = stats.get('faceOffWinPercentage', '0.0')
+        self.takeaways = stats.get('takeaways', 0)
+        self.giveaways = stats.get('giveaways', 0)
+
+
+class Goal(object):
+    """A scoring play. The names are already shortened, and the scorer's
+    has their number of goals on the season appended."""
+    __slots__ = ('play', 'event', 'team', 'period', 'time', 'strength',
+                 'scorer', 'assists', '_text')
+
+    def __init__(self, play):
+        self.play = play
+        self.team = play['team']['triCode']
+        self.period = play['about']['ordinalNum']
+        self.time = play['about']['periodTime']
+        # Identifies the goal from one version of the feed to the next
+        self.event = play['about'].get('eventId',
+                                       (self.period, self.time, self.team))
+        code = play['result']['strength']['code']
+        if 'PPG' in code:
+            self.strength = 'PP'
+        elif 'SHG' in code:
+            self.strength = 'SH'
+        else:
+            self.strength = None
+        names = []
+        for player in play.get('players', []):
+            # We don't care about the goalie
+            if 'Goalie' in player['playerType']:
+                continue
+            name = _shortName(player['player'].get('fullName', ''))
+            if 'Scorer' in player['playerType']:
+                name += '({})'.format(player.get('seasonTotal', '?'))
+            names.append(name)
+        # The feed sometimes lists a goal before its players
+        self.scorer = names[0] if names else None
+        self.assists = names[1:]
+        self._text = None
+
+    def format(self):
+        if self._text is None:
+            names = ircutils.bold(self.scorer or 'Unknown scorer')
+            if self.assists:
+                names += ' ({})'.format(', '.join(self.assists))
+            self._text = '{} {} [{}/{}{}]'.format(
+                ircutils.bold(self.team), names, self.period, self.time,
+                ' ' + self.strength if self.strength else '')
+        return self._text
+
+
+class GameSnapshot(object):
+    """What the plugin shows of a game, as of one version of its feed."""
+    __slots__ = ('gamepk', 'version', 'stored', 'plays', 'state', 'status',
+                 'intermission', 'away', 'home', 'goals', 'stars', 'winner',
+                 'loser', '_lines')
+
+    def __init__(self, gamepk, feed, plays=None, previous=None, stored=None):
+        """feed is the (parsed) live feed of gamepk, plays the PlayIndex it
+        was parsed with and stored the time its response was cached (None
+        if it was patched). The goals of previous (the game's snapshot
+        before this one) are reused."""
+        game = feed['gameData']
+        live = feed['liveData']
+        self.gamepk = gamepk
+        self.version = feed.get('metaData', {}).get('timeStamp')
+        self.stored = stored
+        self.plays = plays
+        self.state = game['status']['abstractGameState']
+        self.status = game['status']['detailedState']
+        linescore = live.get('linescore', {})
+        self.intermission = bool(linescore.get('intermissionInfo', {})
+                                 .get('inIntermission'))
+        boxscore = live['boxscore']['teams']
+        self.away = TeamStats(
+            game['teams']['away']['abbreviation'],
+            boxscore['away']['teamStats'].get('teamSkaterStats', {}))
+        self.home = TeamStats(
+            game['teams']['home']['abbreviation'],
+            boxscore['home']['teamStats'].get('teamSkaterStats', {}))
+        known = {}
+        if previous is not None:
+            known = dict((id(goal.play), goal) for goal in previous.goals)
+        goals = []
+        for play in live['plays']['allPlays']:
+            if play['result']['eventTypeId'] != 'GOAL':
+                continue
+            goal = known.get(id(play))
+            if goal is None or goal.play is not play:
+                try:
+                    goal = Goal(play)
+                except (KeyError, TypeError):
+                    # A malformed play only costs its own goal.
+                    continue
+            goals.append(goal)
+        self.goals = tuple(goals)
+        decisions = live.get('decisions', {})
+        def name(key):
+            return decisions.get(key, {}).get('fullName')
+        self.stars = tuple(star for star in (name('firstStar'),
+                                             name('secondStar'),
+                                             name('thirdStar')) if star)
+        self.winner = name('winner')
+        self.loser = name('loser')
+        self._lines = {}
+
+    def lines(self, attendance, referees):
+        """Returns the lines of the summary of the game. They are rendered
+        once per attendance and referees (which come from the GS report)."""
+        key = (attendance, tuple(referees))
+        lines = self._lines.get(key)
+        if lines is None:
+            lines = self._lines[key] = self._render(attendance, referees)
+        return lines
+
+    def _render(self, attendance, referees):
+        (away, home) = (self.away, self.home)
+        lines = ["\x02{} {} {} {} {}\x02 [Att {}] | SOG {}-{} | BK {}-{} | "
+                 "HITS {}-{} | PP {}/{} {}PIMS - PP {}/{} {}PIMS | "
+                 "FO {}-{} | TK {}-{} | GV {}-{}".format(
+                 away.abbreviation, away.goals, home.abbreviation,
+                 home.goals, self.status, attendance, away.shots, home.shots,
+                 away.blocked, home.blocked, away.hits, home.hits,
+                 away.power_play_goals, away.power_play_opportunities,
+                 away.pim, home.power_play_goals,
+                 home.power_play_opportunities, home.pim, away.faceoff_pct,
+                 home.faceoff_pct, away.takeaways, home.takeaways,
+                 away.giveaways, home.giveaways)]
+        # Five goals per line at most
+        goals = [goal.format() for goal in self.goals]
+        for start in range(0, len(goals), 5):
+            lines.append('{}: {}'.format(ircutils.bold('Goals'),
+                                         ' | '.join(goals[start:start + 5])))
+        if len(self.stars) == 3:
+            lines.append("\x02Three Stars\x02: 1.{} 2.{} 3.{}    "
+                         "[\x02Goalies\x02 W: {} L: {}]".format(
+                         self.stars[0], self.stars[1], self.stars[2],
+                         self.winner, self.loser))
+        if referees:
+            lines.append("\x02Referees\x02: {}".format(
+                ' '.join(referees).replace(
+                    "#20 Tim Peel", "\x02\0034-!- #20 Tim Peel -!-")))
+        return lines
+
+
+class SnapshotCache(object):
+    """The latest snapshot of each game, least recently used first out."""
+
+    def __init__(self, max_entries=64):
+        self.max_entries = max_entries
+        self._snapshots = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, gamepk):
+        with self._lock:
+            snapshot = self._snapshots.get(gamepk)
+            if snapshot is not None:
+                self._snapshots.move_to_end(gamepk)
+            return snapshot
+
+    def put(self, snapshot):
+        with self._lock:
+            self._snapshots[snapshot.gamepk] = snapshot
+            self._snapshots.move_to_end(snapshot.gamepk)
+            while len(self._snapshots) > self.max_entries:
+                self._snapshots.popitem(last=False)
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
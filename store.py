@@ -0,0 +1,194 @@
+###
+# Copyright (c) 2017, cottongin
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE
+###
+
+###
+# Includes contributions from Santiago Gil and Jonathan "grateful" Surman
+###
+
+
+"""
+Persistent store for the data of finished games.
+
+Once a game is Final its live feed and HTML report never change again, so
+they are kept on disk in a SQLite database, keyed by the URL they were
+fetched from and grouped by gamePk. Bodies are stored zlib-compressed. When
+the database grows past its size limit the games stored the longest ago are
+dropped first. Short links, which never change either, are kept in a table
+of their own.
+
+A few documents that change rarely (the teams) are kept by name too, with
+the time they were stored so the caller can tell when to refresh them.
+"""
+
+import sqlite3
+import threading
+import time
+import zlib
+
+
+class GameStore(object):
+    """SQLite-backed store of immutable per-game responses."""
+
+    def __init__(self, filename, max_size=None):
+        self.filename = filename
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(filename, check_same_thread=False)
+        with self._db:
+            self._db.execute("""CREATE TABLE IF NOT EXISTS responses (
+                                url TEXT PRIMARY KEY,
+                                gamepk TEXT NOT NULL,
+                                data BLOB NOT NULL,
+                                size INTEGER NOT NULL,
+                                stored REAL NOT NULL)""")
+            self._db.execute("""CREATE INDEX IF NOT EXISTS responses_gamepk
+                                ON responses (gamepk)""")
+            self._db.execute("""CREATE TABLE IF NOT EXISTS links (
+                                url TEXT PRIMARY KEY,
+                                link TEXT NOT NULL)""")
+            self._db.execute("""CREATE TABLE IF NOT EXISTS documents (
+                                name TEXT PRIMARY KEY,
+                                data BLOB NOT NULL,
+                                stored REAL NOT NULL)""")
+        self.hits = 0
+        self.misses = 0
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def get(self, url):
+        """Returns the stored body for url, or None."""
+        with self._lock:
+            row = self._db.execute("SELECT data FROM responses WHERE url=?",
+                                   (url,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return zlib.decompress(row[0])
+
+    def getLink(self, url):
+        """Returns the short link stored for url, or None."""
+        with self._lock:
+            row = self._db.execute("SELECT link FROM links WHERE url=?",
+                                   (url,)).fetchone()
+        return row[0] if row is not None else None
+
+    def saveLink(self, url, link):
+        with self._lock:
+            with self._db:
+                self._db.execute("INSERT OR REPLACE INTO links VALUES (?, ?)",
+                                 (url, link))
+
+    def getDocument(self, name):
+        """Returns (body, time it was stored) for the document name, or
+        None."""
+        with self._lock:
+            row = self._db.execute("SELECT data, stored FROM documents "
+                                   "WHERE name=?", (name,)).fetchone()
+        if row is None:
+            return None
+        return (zlib.decompress(row[0]), row[1])
+
+    def saveDocument(self, name, data):
+        with self._lock:
+            with self._db:
+                self._db.execute("INSERT OR REPLACE INTO documents "
+                                 "VALUES (?, ?, ?)",
+                                 (name, zlib.compress(data), time.time()))
+
+    def missing(self, urls):
+        """Returns the urls that are not stored yet."""
+        with self._lock:
+            return [url for url in urls if self._db.execute(
+                        "SELECT 1 FROM responses WHERE url=?",
+                        (url,)).fetchone() is None]
+
+    def save(self, gamepk, responses):
+        """Stores responses, a dict of url -> body, for gamepk. URLs that are
+        already stored are left alone. Prunes the store if needed."""
+        now = time.time()
+        rows = []
+        for url in self.missing(list(responses)):
+            data = zlib.compress(responses[url])
+            rows.append((url, gamepk, data, len(data), now))
+        if not rows:
+            return
+        with self._lock:
+            with self._db:
+                self._db.executemany("""INSERT OR IGNORE INTO responses
+                                        VALUES (?, ?, ?, ?, ?)""", rows)
+        if self.max_size is not None:
+            self.prune(self.max_size)
+
+    def size(self):
+        """Returns the total size in bytes of the stored (compressed)
+        bodies."""
+        with self._lock:
+            return self._db.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def prune(self, max_size):
+        """Drops whole games, oldest first, until the stored bodies take
+        less than max_size bytes. Returns the number of games dropped."""
+        dropped = 0
+        with self._lock:
+            total = self._db.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total <= max_size:
+                return 0
+            games = self._db.execute("""SELECT gamepk, SUM(size)
+                                        FROM responses GROUP BY gamepk
+                                        ORDER BY MAX(stored)""").fetchall()
+            with self._db:
+                for (gamepk, size) in games:
+                    if total <= max_size:
+                        break
+                    self._db.execute("DELETE FROM responses WHERE gamepk=?",
+                                     (gamepk,))
+                    total -= size
+                    dropped += 1
+        return dropped
+
+    def recent(self, games):
+        """Yields (url, body) for every response of the most recently
+        stored games."""
+        with self._lock:
+            rows = self._db.execute("""SELECT url, data FROM responses
+                                       WHERE gamepk IN (
+                                           SELECT gamepk FROM responses
+                                           GROUP BY gamepk
+                                           ORDER BY MAX(stored) DESC
+                                           LIMIT ?)""", (games,)).fetchall()
+        for (url, data) in rows:
+            yield (url, zlib.decompress(data))
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
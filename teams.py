@@ -0,0 +1,133 @@
+###
+# Copyright (c) 2017, cottongin
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE
+###
+
+###
+# Includes contributions from Santiago Gil and Jonathan "grateful" Surman
+###
+
+
+"""
+Directory of the NHL teams, built from the statsapi /teams endpoint.
+
+Every way a user may name a team (its abbreviation, full name, nickname,
+city, with or without accents, spaces and punctuation) is normalized and
+mapped to the team once, when the directory is built. So are the prefixes
+of those names that only one team starts with ("bru", "canad"). Resolving
+user input is then a single dict lookup. Names shared by several teams
+("New York") resolve to none of them.
+"""
+
+import json
+import re
+import unicodedata
+
+
+TEAMS_URL = "https://statsapi.web.nhl.com/api/v1/teams"
+
+# Shortest prefix of a name that resolves to its team
+MIN_PREFIX = 3
+
+# Names that aren't in the /teams data: alias -> abbreviation
+LEGACY_ALIASES = {'gnjd': 'NJD'}
+
+_NOT_ALNUM = re.compile('[^a-z0-9]')
+
+
+def normalize(name):
+    """Returns name in lower case, without accents or anything but letters
+    and digits."""
+    name = unicodedata.normalize('NFKD', name)
+    name = ''.join(c for c in name if not unicodedata.combining(c))
+    return _NOT_ALNUM.sub('', name.lower())
+
+
+class Team(object):
+    __slots__ = ('id', 'abbreviation', 'name', 'nickname', 'city')
+
+    def __init__(self, record):
+        self.id = record['id']
+        self.abbreviation = record['abbreviation']
+        self.name = record.get('name', self.abbreviation)
+        self.nickname = record.get('teamName')
+        self.city = record.get('locationName')
+
+    def names(self):
+        return [name for name in (self.abbreviation, self.name,
+                                  self.nickname, self.city,
+                                  '{} {}'.format(self.city, self.nickname))
+                if name]
+
+
+class TeamDirectory(object):
+    """The teams of the /teams payload, and the aliases resolving to them."""
+
+    def __init__(self, payload):
+        self.teams = [Team(record) for record in payload.get('teams', [])]
+        self.byId = dict((team.id, team) for team in self.teams)
+        self.byAbbreviation = dict((team.abbreviation, team)
+                                   for team in self.teams)
+        # alias -> set of teams, for the exact names and the prefixes
+        exact = {}
+        prefixes = {}
+        for team in self.teams:
+            for name in team.names():
+                name = normalize(name)
+                exact.setdefault(name, set()).add(team)
+                for length in range(MIN_PREFIX, len(name)):
+                    prefixes.setdefault(name[:length], set()).add(team)
+        self._aliases = {}
+        for (alias, teams) in prefixes.items():
+            if len(teams) == 1:
+                self._aliases[alias] = next(iter(teams))
+        # Exact names win over prefixes; ambiguous ones resolve to nothing
+        for (alias, teams) in exact.items():
+            if len(teams) == 1:
+                self._aliases[alias] = next(iter(teams))
+            else:
+                self._aliases.pop(alias, None)
+        for (alias, abbreviation) in LEGACY_ALIASES.items():
+            team = self.byAbbreviation.get(abbreviation)
+            if team is not None:
+                self._aliases[alias] = team
+
+    @classmethod
+    def fromJSON(cls, body):
+        if isinstance(body, bytes):
+            body = body.decode('utf-8')
+        return cls(json.loads(body))
+
+    def __len__(self):
+        return len(self.teams)
+
+    def resolve(self, name):
+        """Returns the Team name refers to, or None."""
+        return self._aliases.get(normalize(name))
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -31,11 +31,1196 @@
 # Includes contributions from Santiago Gil and Jonathan "grateful" Surman
 ###
 
+import asyncio
+import datetime
+import gzip
+import http.server
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import requests
+
 from supybot.test import *
 
+from . import alerts
+from . import cache
+from . import client
+from . import engine
+from . import feedparse
+from . import gameindex
+from . import livefeed
+from . import metrics
+from . import output
+from . import playoffs
+from . import poller
+from . import report
+from . import resilience
+from . import seasonstats
+from . import shortener
+from . import snapshot
+from . import store
+from . import teams
+
+
+def _liveFeed(timestamp='20170412_230000'):
+    """Returns a live feed (as parsed) of a game in progress, with one
+    goal."""
+    def team(abbreviation, goals):
+        return {'abbreviation': abbreviation}, {'teamStats': {
+            'teamSkaterStats': {'goals': goals, 'shots': 30,
+                                'powerPlayGoals': 1.0,
+                                'powerPlayOpportunities': 10.0,
+                                'faceOffWinPercentage': '50.0'}}}
+    (away, away_box) = team('OTT', 1)
+    (home, home_box) = team('BOS', 0)
+    goal = {'result': {'eventTypeId': 'GOAL',
+                       'strength': {'code': 'PPG'}},
+            'about': {'ordinalNum': '2nd', 'periodTime': '04:12'},
+            'team': {'triCode': 'OTT'},
+            'players': [
+                {'playerType': 'Scorer', 'seasonTotal': 7,
+                 'player': {'fullName': 'James van Riemsdyk'}},
+                {'playerType': 'Assist',
+                 'player': {'fullName': 'Erik Karlsson'}},
+                {'playerType': 'Goalie',
+                 'player': {'fullName': 'Tuukka Rask'}}]}
+    return {'metaData': {'timeStamp': timestamp},
+            'gameData': {'status': {'abstractGameState': 'Live',
+                                    'detailedState': 'In Progress'},
+                         'teams': {'away': away, 'home': home}},
+            'liveData': {'plays': {'allPlays': [goal]},
+                         'boxscore': {'teams': {'away': away_box,
+                                                'home': home_box}},
+                         'decisions': {}}}
+
 
 class NHLTestCase(PluginTestCase):
     plugins = ('NHL',)
 
+    def testCommands(self):
+        self.assertRegexp('list NHL', 'nhlplayoffs.*summary')
+
+    def testStats(self):
+        self.assertNotError('nhlstats reset')
+        # The lines are packed into one message
+        self.assertRegexp('nhlstats', 'Commands.*nhlstats 1x.*Caches')
+
+    def testClassify(self):
+        cb = self.irc.getCallback('NHL')
+        self.assertEqual(cb._classify(cb._getFeedURL('2016020001')),
+                         ('feed', 'liveFeed'))
+        self.assertEqual(cb._endpointFor(cb._getEndpointURL('2017-04-12')),
+                         'schedule')
+        self.assertEqual(cb._endpointFor(teams.TEAMS_URL), 'teams')
+        self.assertEqual(cb._ttlFor('http://tinyurl.com/x'),
+                         conf.supybot.plugins.NHL.cache.ttl.default())
+
+    def testSaveFinalGame(self):
+        cb = self.irc.getCallback('NHL')
+        (fd, filename) = tempfile.mkstemp()
+        os.close(fd)
+        saved = store.GameStore(filename)
+        (previous, cb._store) = (cb._store, saved)
+        responses = cb._cache
+        cb._cache = cache.ResponseCache(max_bytes=10**6, compress=True)
+        executor = cb._executor
+        class Inline(object):
+            def submit(self, function, *args):
+                function(*args)
+        cb._executor = Inline()
+        try:
+            gamepk = '2016020001'
+            (feed_url, report_url) = (cb._getFeedURL(gamepk),
+                                      report.reportURL(gamepk))
+            (final, html) = (b'{"final": true}' + b' ' * 2000,
+                             b'<html>' + b' ' * 2000)
+            cb._cache.put(feed_url, final, ttl=60)
+            cb._cache.put(report_url, html, ttl=60)
+            stored = cb._cache.lookup(feed_url).stored
+            def snap(stored):
+                return snapshot.GameSnapshot(gamepk, _liveFeed(),
+                                             stored=stored)
+            # Patched, or parsed from an earlier download than the cached
+            # one: the cached feed isn't the final one
+            cb._saveFinalGame(snap(None))
+            cb._saveFinalGame(snap(stored - 1))
+            self.assertEqual(saved.get(feed_url), None)
+            self.assertEqual(saved.get(report_url), html)
+            cb._saveFinalGame(snap(stored))
+            self.assertEqual(saved.get(feed_url), final)
+            # Once stored, the cached bodies aren't even decompressed
+            cb._cache.clear()
+            cb._cache.put(feed_url, final, ttl=60)
+            cb._cache.put(report_url, html, ttl=60)
+            cb._cache._hot.clear()
+            cb._cache._hotBytes = 0
+            cb._saveFinalGame(snap(cb._cache.lookup(feed_url).stored))
+            self.assertEqual(cb._cache.stats()['hot_bytes'], 0)
+        finally:
+            (cb._store, cb._executor) = (previous, executor)
+            cb._cache = responses
+            saved.close()
+            os.remove(filename)
+
+    def testUnchangedFeedIsNotParsedAgain(self):
+        cb = self.irc.getCallback('NHL')
+        feed = _liveFeed()
+        feed['padding'] = 'x' * 5000
+        body = json.dumps(feed).encode('utf-8')
+        (previous, cb._cache) = (cb._cache, cache.ResponseCache(
+                                     max_bytes=10**6, compress=True))
+        parses = []
+        def parseFeed(body, index=None):
+            parses.append(body)
+            return parse(body, index=index)
+        parse = feedparse.parseFeed
+        feedparse.parseFeed = parseFeed
+        try:
+            cb._cache.put(cb._getFeedURL('2016020001'), body, ttl=60)
+            first = cb._getSnapshot('2016020001')
+            # Its body is decompressed again, as a new copy
+            cb._cache._hot.clear()
+            cb._cache._hotBytes = 0
+            self.assertIs(cb._getSnapshot('2016020001'), first)
+            self.assertEqual(len(parses), 1)
+        finally:
+            feedparse.parseFeed = parse
+            cb._cache = previous
+            cb._snapshots = snapshot.SnapshotCache()
+
+    def testUpstreamDown(self):
+        cb = self.irc.getCallback('NHL')
+        def get(url, headers=None, timeout=None):
+            raise requests.ConnectionError('Connection refused')
+        cb._http.get = get
+        try:
+            for command in ('summary BOS', 'nhlscores', 'nhlplayoffs'):
+                self.assertRegexp(command, "Couldn't reach the NHL API")
+        finally:
+            del cb._http.get
+
+    def testNotModifiedAfterEviction(self):
+        cb = self.irc.getCallback('NHL')
+        url = cb._getFeedURL('2016020001')
+        cb._cache.put(url, b'{}', ttl=0, etag='"x"')
+        def get(url, headers=None, timeout=None):
+            self.assertEqual(headers, {'If-None-Match': '"x"'})
+            # Evicted while the request was under way
+            cb._cache.invalidate(url)
+            response = requests.Response()
+            response.status_code = 304
+            return response
+        cb._http.get = get
+        try:
+            self.assertEqual(cb._fetchURL(url), b'{}')
+            self.assertEqual(cb._cache.get(url), b'{}')
+        finally:
+            del cb._http.get
+            cb._cache.clear()
+
+    def testFanOut(self):
+        cb = self.irc.getCallback('NHL')
+        def fail():
+            raise requests.ConnectionError('Connection refused')
+        with conf.supybot.plugins.NHL.fetch.timeout.context(0.2):
+            started = time.time()
+            results = cb._fanOut({'ok': (lambda x: x * 2, 21),
+                                  'failing': (fail,),
+                                  'slow': (time.sleep, 1)})
+            self.assertLess(time.time() - started, 0.9)
+        # Failing and late jobs degrade to None instead of raising
+        self.assertEqual(results, {'ok': 42, 'failing': None, 'slow': None})
+
+    def testEndpointURL(self):
+        cb = self.irc.getCallback('NHL')
+        url = cb._getEndpointURL('2017-04-12')
+        self.assertIn('startDate=2017-04-12&endDate=2017-04-12', url)
+        self.assertIn('&expand=schedule.teams&', url)
+        self.assertNotIn('teamId', url)
+        fields = url.split('&fields=')[1].split(',')
+        self.assertEqual(fields, cb._SCHEDULE_PROFILES['games'][1])
+        url = cb._getEndpointURL('2017-04-12', '2017-04-19',
+                                 profile='scores', team_id=6)
+        self.assertIn('endDate=2017-04-19&site=en_nhl&teamId=6&', url)
+        self.assertIn('&expand=schedule.teams,schedule.linescore&', url)
+        self.assertIn('currentPeriodOrdinal', url)
+        # Each profile has its own URL, and so its own cache entry
+        self.assertEqual(len(set(cb._getEndpointURL('2017-04-12', profile=p)
+                                 for p in cb._SCHEDULE_PROFILES)),
+                         len(cb._SCHEDULE_PROFILES))
+        self.assertRaises(KeyError, cb._getEndpointURL, '2017-04-12',
+                          profile='everything')
+
+    def testTeamsRetry(self):
+        cb = self.irc.getCallback('NHL')
+        urls = []
+        def getURL(url, force=False):
+            urls.append(url)
+            raise requests.ConnectionError('Connection refused')
+        cb._getURL = getURL
+        try:
+            self.assertEqual(cb._getTeams(), None)
+            self.assertEqual(cb._getTeams(), None)
+            self.assertEqual(urls, [teams.TEAMS_URL])
+        finally:
+            del cb._getURL
+            (cb._teams, cb._teamsExpire) = (None, 0)
+
+    def testStoreOnlyKeepsFinalGames(self):
+        cb = self.irc.getCallback('NHL')
+        (fd, filename) = tempfile.mkstemp()
+        os.close(fd)
+        (previous, cb._store) = (cb._store, store.GameStore(filename))
+        def get(url, headers=None, timeout=None):
+            response = requests.Response()
+            (response.status_code, response._content) = (200, b'{}')
+            return response
+        cb._http.get = get
+        try:
+            cb._getURL(cb._getEndpointURL('2017-04-12'))
+            cb._getURL(teams.TEAMS_URL)
+            # Only the responses it may have are looked up in the store
+            self.assertEqual(cb._store.misses, 0)
+            cb._getURL(cb._getFeedURL('2016020001'))
+            self.assertEqual(cb._store.misses, 1)
+        finally:
+            del cb._http.get
+            cb._store.close()
+            cb._store = previous
+            cb._cache.clear()
+            os.remove(filename)
+
+    def testFormatScore(self):
+        cb = self.irc.getCallback('NHL')
+        def game(state, detailed='', period='', clock='', intermission=False):
+            return {'gameDate': '2017-04-12T23:00:00Z',
+                    'status': {'abstractGameState': state,
+                               'detailedState': detailed},
+                    'teams': {'away': {'score': 2,
+                                       'team': {'abbreviation': 'TOR'}},
+                              'home': {'score': 3,
+                                       'team': {'abbreviation': 'MTL'}}},
+                    'linescore': {'currentPeriodOrdinal': period,
+                                  'currentPeriodTimeRemaining': clock,
+                                  'intermissionInfo': {
+                                      'inIntermission': intermission}}}
+        self.assertEqual(cb._formatScore(game('Preview', 'Scheduled')),
+                         'TOR @ MTL 7:00 PM ET')
+        self.assertEqual(cb._formatScore(game('Preview', 'Postponed')),
+                         'TOR @ MTL Postponed')
+        self.assertEqual(cb._formatScore(game('Live', 'In Progress', '2nd',
+                                              '08:12')),
+                         'TOR 2 MTL 3 2nd 08:12')
+        self.assertEqual(cb._formatScore(game('Live', 'In Progress', '2nd',
+                                              'END', True)),
+                         'TOR 2 MTL 3 2nd INT')
+        self.assertEqual(cb._formatScore(game('Final', 'Final', 'OT')),
+                         'TOR 2 \x02MTL\x02 3 Final/OT')
+
+    def testScoresArguments(self):
+        cb = self.irc.getCallback('NHL')
+        self.assertEqual(cb._parseTeamAndDate(None), (None, None))
+        self.assertEqual(cb._parseTeamAndDate('2017-04-12 bos'),
+                         ('bos', '2017-04-12'))
+        self.assertRaises(ValueError, cb._parseTeamAndDate, 'bos nyr')
+        self.assertRaises(ValueError, cb._parseTeamAndDate, 'bos 2017-13-01')
+        # summary takes its arguments the same way
+        self.assertRaises(ValueError, cb._findGamepk, 'bos nyr')
+        self.assertRaises(ValueError, cb._findGamepk, 'today')
+        self.assertRegexp('summary bos nyr', 'Expected a team and a date')
+
+
+def _teams(*names):
+    """Returns a /teams payload of (id, abbreviation, name, nickname, city)
+    tuples."""
+    return {'teams': [{'id': tid, 'abbreviation': abbreviation, 'name': name,
+                       'teamName': nickname, 'locationName': city}
+                      for (tid, abbreviation, name, nickname, city) in names]}
+
+
+TEAMS = _teams((6, 'BOS', 'Boston Bruins', 'Bruins', 'Boston'),
+               (1, 'NJD', 'New Jersey Devils', 'Devils', 'New Jersey'),
+               (3, 'NYR', 'New York Rangers', 'Rangers', 'New York'),
+               (2, 'NYI', 'New York Islanders', 'Islanders', 'New York'),
+               (8, 'MTL', 'Montréal Canadiens', 'Canadiens', 'Montréal'))
+
+
+class NHLChannelTestCase(ChannelPluginTestCase):
+    plugins = ('NHL',)
+
+    def setUp(self):
+        ChannelPluginTestCase.setUp(self)
+        # Instead of downloading them
+        cb = self.irc.getCallback('NHL')
+        cb._teams = teams.TeamDirectory(TEAMS)
+        cb._teamsExpire = time.time() + 3600
+
+    def testFollow(self):
+        self.assertRegexp('nhlfollowing', "doesn't follow any team")
+        self.assertNotError('nhlfollow bruins')
+        self.assertNotError('nhlfollow GNJD')
+        self.assertRegexp('nhlfollow foo', 'Unknown team: foo')
+        # 'New York' could be either team
+        self.assertError('nhlfollow newyork')
+        self.assertRegexp('nhlfollowing', 'follows BOS, NJD')
+        self.assertNotError('nhlunfollow BOS')
+        self.assertError('nhlunfollow BOS')
+        self.assertRegexp('nhlfollowing', 'follows NJD')
+
+
+class ResponseCacheTestCase(SupyTestCase):
+    def testLRUEviction(self):
+        c = cache.ResponseCache(max_entries=2)
+        c.put('a', b'1', ttl=60)
+        c.put('b', b'2', ttl=60)
+        self.assertEqual(c.get('a'), b'1')
+        c.put('c', b'3', ttl=60)
+        self.assertEqual(c.get('b'), None)
+        self.assertEqual(c.get('a'), b'1')
+        self.assertEqual(c.evictions, 1)
+
+    def testExpiryAndRevalidation(self):
+        c = cache.ResponseCache()
+        c.put('a', b'1', ttl=0, last_modified='Mon', etag='"x"')
+        self.assertEqual(c.get('a'), None)
+        entry = c.lookup('a')
+        self.assertEqual(entry.conditionalHeaders(),
+                         {'If-None-Match': '"x"', 'If-Modified-Since': 'Mon'})
+        self.assertEqual(c.revalidate('a', ttl=60), b'1')
+        self.assertEqual(c.get('a'), b'1')
+        stats = c.stats()
+        self.assertEqual((stats['hits'], stats['misses'],
+                          stats['revalidations']), (1, 1, 1))
+
+    def testStale(self):
+        c = cache.ResponseCache()
+        self.assertEqual(c.markStale('a'), None)
+        c.put('a', b'1', ttl=0)
+        self.assertFalse(c.isStale('a'))
+        self.assertEqual(c.markStale('a'), b'1')
+        self.assertTrue(c.isStale('a'))
+        c.revalidate('a', ttl=60)
+        self.assertFalse(c.isStale('a'))
+
+    def testCompression(self):
+        body = b'{"gamePk": 2018020001, "period": 1}' * 200
+        c = cache.ResponseCache(max_bytes=10**6, compress=True)
+        c.put('a', body, ttl=60)
+        c.put('b', b'{}', ttl=60)
+        self.assertTrue(c.lookup('a').compressed)
+        self.assertFalse(c.lookup('b').compressed)
+        # The decompressed body is kept: the same object comes back
+        self.assertIs(c.get('a'), body)
+        c.clear()
+        c.put('a', body, ttl=60)
+        c._hot.clear()
+        c._hotBytes = 0
+        first = c.get('a')
+        self.assertEqual(first, body)
+        self.assertIs(c.get('a'), first)
+        stats = c.stats()
+        self.assertEqual(stats['raw_bytes'], len(body))
+        self.assertGreater(stats['compression_ratio'], 10)
+
+    def testByteBudget(self):
+        c = cache.ResponseCache(max_bytes=2500)
+        c.put('a', b'1' * 1000, ttl=60)
+        c.put('b', b'2' * 1000, ttl=60)
+        c.put('c', b'3' * 1000, ttl=60)
+        self.assertNotIn('a', c)
+        self.assertEqual(c.stats()['bytes'], 2000)
+        c.resize(256, 1500)
+        self.assertEqual(list(c._entries), ['c'])
+        c.invalidate('c')
+        self.assertEqual(c.stats()['bytes'], 0)
+
+
+class SingleFlightTestCase(SupyTestCase):
+    def testConcurrentCallsShareOneFetch(self):
+        flights = cache.SingleFlight()
+        fetches = []
+        def fetch():
+            fetches.append(1)
+            time.sleep(0.1)
+            return 'data'
+        results = []
+        threads = [threading.Thread(
+                       target=lambda: results.append(flights.do('k', fetch)))
+                   for i in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(results, ['data'] * 5)
+        self.assertEqual(len(fetches), 1)
+        self.assertEqual(flights.saved, 4)
+        self.assertEqual(flights.inFlight(), 0)
+
+
+class ResilienceTestCase(SupyTestCase):
+    def testTokenBucket(self):
+        bucket = resilience.TokenBucket(rate=10, burst=2)
+        self.assertEqual(bucket.reserve(0), 0)
+        self.assertEqual(bucket.reserve(0), 0)
+        # The third request has to wait for a token
+        self.assertEqual(bucket.reserve(0.01), None)
+        self.assertAlmostEqual(bucket.reserve(1), 0.1, places=2)
+
+    def testCircuitBreaker(self):
+        breaker = resilience.CircuitBreaker(threshold=2, cooldown=0.05)
+        self.assertFalse(breaker.failure())
+        self.assertTrue(breaker.allow())
+        self.assertTrue(breaker.failure())
+        self.assertFalse(breaker.allow())
+        time.sleep(0.06)
+        # A single probe gets through, and its failure doubles the wait
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        self.assertTrue(breaker.failure())
+        self.assertEqual(breaker.cooldown, 0.1)
+        time.sleep(0.11)
+        self.assertTrue(breaker.allow())
+        breaker.success()
+        self.assertEqual((breaker.state, breaker.cooldown),
+                         (breaker.CLOSED, 0.05))
+
+    def testHostGuard(self):
+        guards = resilience.HostGuards(threshold=1, cooldown=60)
+        guard = guards.get('statsapi.web.nhl.com')
+        self.assertIs(guards.get('statsapi.web.nhl.com'), guard)
+        guard.enter(0)
+        guard.breaker.failure()
+        self.assertRaises(resilience.UpstreamUnavailable, guard.enter, 0)
+        self.assertEqual(list(guards.failing()), ['statsapi.web.nhl.com'])
+
+
+class HTTPClientTestCase(SupyTestCase):
+    URL = 'https://statsapi.web.nhl.com/api/v1/schedule'
+
+    def _client(self, outcomes, **kwargs):
+        """Returns an HTTPClient whose session answers with outcomes in
+        turn: a status code or an exception to raise."""
+        kwargs.setdefault('guards', resilience.HostGuards(
+            rate=1e6, burst=100, threshold=2, cooldown=0.05))
+        http = client.HTTPClient(backoff=0, **kwargs)
+        outcomes = list(outcomes)
+        self.sent = 0
+        def get(url, headers=None, timeout=None):
+            self.sent += 1
+            outcome = outcomes.pop(0)
+            if isinstance(outcome, Exception):
+                raise outcome
+            response = requests.Response()
+            response.status_code = outcome
+            return response
+        http.session.get = get
+        return http
+
+    def _breaker(self, http):
+        return http.guards.get('statsapi.web.nhl.com').breaker
+
+    def testSessionReuse(self):
+        ports = []
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                ports.append(self.client_address[1])
+                body = b'{"gamePk": 1}'
+                if 'gzip' in self.headers.get('Accept-Encoding', ''):
+                    body = gzip.compress(body)
+                self.send_response(200)
+                self.send_header('Content-Encoding', 'gzip')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        http_client = client.HTTPClient()
+        try:
+            url = 'http://127.0.0.1:{}/feed'.format(server.server_port)
+            for i in range(3):
+                self.assertEqual(http_client.get(url).json(), {'gamePk': 1})
+            # One keep-alive connection served every request
+            self.assertEqual(len(ports), 3)
+            self.assertEqual(len(set(ports)), 1)
+        finally:
+            http_client.close()
+            server.shutdown()
+            server.server_close()
+
+    def testBackoff(self):
+        http = client.HTTPClient(backoff=0.5, read_timeout=10.0)
+        self.assertTrue(0.375 <= http._delay(1, None) <= 0.5)
+        self.assertTrue(1.5 <= http._delay(3, None) <= 2.0)
+        self.assertEqual(http._delay(10, None), 10.0)
+        response = requests.Response()
+        response.headers['Retry-After'] = '3'
+        self.assertEqual(http._delay(1, response), 3.0)
+        response.headers['Retry-After'] = '3600'
+        self.assertEqual(http._delay(1, response), 10.0)
+        # Only a number of seconds is understood
+        response.headers['Retry-After'] = 'Wed, 12 Apr 2017 23:00:00 GMT'
+        self.assertLessEqual(http._delay(1, response), 0.5)
+
+    def testRetries(self):
+        http = self._client([requests.ConnectionError(), 503, 200],
+                            retries=2, guards=resilience.HostGuards(
+                                rate=1e6, burst=100, threshold=3))
+        self.assertEqual(http.get(self.URL).status_code, 200)
+        self.assertEqual(self.sent, 3)
+        self.assertEqual(self._breaker(http).state, 'closed')
+        # Once the retries are exhausted, the last answer is returned
+        http = self._client([503, 502], retries=1,
+                            guards=resilience.HostGuards(rate=1e6, burst=100))
+        self.assertEqual(http.get(self.URL).status_code, 502)
+        http = self._client([requests.Timeout()], retries=0)
+        self.assertRaises(requests.Timeout, http.get, self.URL)
+
+    def testBreakerStopsRetrying(self):
+        http = self._client([503, 503, 200], retries=5)
+        self.assertEqual(http.get(self.URL).status_code, 503)
+        self.assertEqual(self.sent, 2)
+        self.assertRaises(resilience.UpstreamUnavailable, http.get, self.URL)
+        time.sleep(0.06)
+        # The probe gets through and closes the circuit again
+        self.assertEqual(http.get(self.URL).status_code, 200)
+        self.assertEqual(self._breaker(http).state, 'closed')
+
+    def testProbeFailingOtherwise(self):
+        http = self._client([requests.ConnectionError(),
+                             requests.ConnectionError(),
+                             requests.exceptions.ChunkedEncodingError(),
+                             200], retries=1)
+        self.assertRaises(requests.ConnectionError, http.get, self.URL)
+        time.sleep(0.06)
+        self.assertRaises(requests.exceptions.ChunkedEncodingError,
+                          http.get, self.URL)
+        # The failed probe reopened the circuit instead of leaving it
+        # half-open for good
+        breaker = self._breaker(http)
+        self.assertEqual(breaker.state, 'open')
+        time.sleep(breaker.remaining() + 0.01)
+        self.assertEqual(http.get(self.URL).status_code, 200)
+
+
+class EngineTestCase(SupyTestCase):
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            if self.path == '/moved':
+                self.send_response(302)
+                self.send_header('Location', '/gzip')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+            elif self.path == '/gzip':
+                body = gzip.compress(b'{"gamePk": 1}')
+                self.send_response(200)
+                self.send_header('Content-Encoding', 'gzip')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            elif self.path == '/slow':
+                time.sleep(0.5)
+                self.send_response(204)
+                self.end_headers()
+            elif self.headers.get('If-None-Match') == '"x"':
+                self.send_response(304)
+                self.end_headers()
+            else:
+                self.send_response(200)
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.send_header('ETag', '"x"')
+                self.end_headers()
+                self.wfile.write(b'3\r\nabc\r\n2\r\nde\r\n0\r\n\r\n')
+
+        def log_message(self, format, *args):
+            pass
+
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0),
+                                                      self.Handler)
+        threading.Thread(target=self.server.serve_forever,
+                         daemon=True).start()
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_port)
+        self.engine = engine.Engine(concurrency=2, backlog=2)
+
+    def tearDown(self):
+        self.engine.close()
+        self.server.shutdown()
+        self.server.server_close()
+        SupyTestCase.tearDown(self)
+
+    def testGet(self):
+        response = self.engine.get(self.url + '/chunked')
+        self.assertEqual((response.status_code, response.content),
+                         (200, b'abcde'))
+        self.assertEqual(response.headers['etag'], '"x"')
+        response = self.engine.get(self.url + '/chunked',
+                                   {'If-None-Match': '"x"'})
+        self.assertEqual((response.status_code, response.content),
+                         (304, b''))
+        response = self.engine.get(self.url + '/moved')
+        self.assertEqual(response.json(), {'gamePk': 1})
+        # Every request went over the same connection
+        self.assertEqual(self.engine.idleConnections(), 1)
+
+    def testCancelledRequestClosesItsConnection(self):
+        connections = []
+        connect = self.engine._connect
+        async def recordingConnect(origin, timeout):
+            (connection, reused) = await connect(origin, timeout)
+            connections.append(connection)
+            return (connection, reused)
+        self.engine._connect = recordingConnect
+        future = asyncio.run_coroutine_threadsafe(
+            self.engine._get(self.url + '/slow', {}, (5, 5)),
+            self.engine._loop)
+        time.sleep(0.1)
+        future.cancel()
+        time.sleep(0.1)
+        self.assertEqual(len(connections), 1)
+        self.assertTrue(connections[0][1].is_closing())
+        self.assertEqual(self.engine.idleConnections(), 0)
+
+    def testConnectionError(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.assertRaises(requests.ConnectionError, self.engine.get,
+                          self.url + '/chunked')
+
+
+class LiveFeedTestCase(SupyTestCase):
+    def _document(self):
+        return {'metaData': {'timeStamp': '20170412_230000'},
+                'gameData': {'status': {'abstractGameState': 'Live'}},
+                'liveData': {'plays': {'allPlays': [{'n': 0}, {'n': 1}]},
+                             'linescore': {'currentPeriod': 1}}}
+
+    def testPatch(self):
+        document = self._document()
+        patched = livefeed.patch(document, [
+            {'op': 'replace', 'path': '/metaData/timeStamp',
+             'value': '20170412_230500'},
+            {'op': 'add', 'path': '/liveData/plays/allPlays/-',
+             'value': {'n': 2}},
+            {'op': 'replace', 'path': '/liveData/plays/allPlays/1/n',
+             'value': 11},
+            {'op': 'move', 'from': '/liveData/linescore/currentPeriod',
+             'path': '/liveData/linescore/period'},
+            {'op': 'test', 'path': '/liveData/linescore/period',
+             'value': 1}])
+        self.assertEqual(patched['liveData']['plays']['allPlays'],
+                         [{'n': 0}, {'n': 11}, {'n': 2}])
+        self.assertEqual(patched['liveData']['linescore'], {'period': 1})
+        # Copy on write: the original is intact and untouched parts shared
+        self.assertEqual(document, self._document())
+        self.assertIs(patched['gameData'], document['gameData'])
+        self.assertIs(patched['liveData']['plays']['allPlays'][0],
+                      document['liveData']['plays']['allPlays'][0])
+        for operations in ([{'op': 'remove', 'path': '/liveData/nope'}],
+                           [{'op': 'add', 'path': '/liveData/plays/'
+                                                  'allPlays/3', 'value': 1}],
+                           [{'op': 'test', 'path': '/gameData', 'value': 1}],
+                           [{'op': 'replace', 'path': 'metaData'}]):
+            self.assertRaises(livefeed.PatchError, livefeed.patch,
+                              document, operations)
+
+    def testUpdate(self):
+        feed = livefeed.LiveFeed(self._document())
+        feed.update([{'diff': [{'op': 'replace',
+                                'path': '/metaData/timeStamp',
+                                'value': '20170412_230500'}]},
+                     {'diff': [{'op': 'add', 'path': '/liveData/x',
+                                'value': 1}]}])
+        self.assertEqual(feed.timestamp, '20170412_230500')
+        self.assertEqual(feed.document['liveData']['x'], 1)
+        for diffs in ({'gamePk': 1},
+                      [{'diff': [{'op': 'remove', 'path': '/gameData'}]}],
+                      [{'diff': [{'op': 'add', 'path': '/liveData/y',
+                                  'value': 1}]}]):
+            self.assertRaises(livefeed.PatchError, feed.update, diffs)
+        self.assertNotIn('y', feed.document['liveData'])
+
+    def testLiveFeedsAreBounded(self):
+        feeds = livefeed.LiveFeeds(max_entries=2)
+        for gamepk in ('1', '2', '3'):
+            feeds.put(gamepk, livefeed.LiveFeed(self._document()))
+        self.assertEqual(len(feeds), 2)
+        self.assertEqual(feeds.get('1'), None)
+
+
+class MetricsTestCase(SupyTestCase):
+    def testHistogram(self):
+        h = metrics.Histogram()
+        for seconds in [0.002] * 90 + [0.3] * 9 + [42]:
+            h.add(seconds)
+        self.assertEqual(h.count, 100)
+        self.assertEqual(h.percentile(50), 0.0025)
+        self.assertEqual(h.percentile(95), 0.5)
+        self.assertEqual(h.percentile(100), 42)
+
+    def testSpans(self):
+        m = metrics.Metrics()
+        with m.span('fetch.feed'):
+            self.assertEqual(m.inFlight(), {'fetch.feed': 1})
+        try:
+            with m.span('fetch.feed'):
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertEqual(m.inFlight(), {})
+        self.assertEqual([(name, h.count) for (name, h)
+                          in m.histograms('fetch.')], [('feed', 2)])
+
+
+class OutputTestCase(SupyTestCase):
+    def testLeavesFormatting(self):
+        self.assertFalse(output.leavesFormatting('\x02Goals\x02: BOS'))
+        self.assertTrue(output.leavesFormatting('\x02Referees\x02: \x02x'))
+        self.assertTrue(output.leavesFormatting('\x034-!- #20 Tim Peel'))
+        self.assertFalse(output.leavesFormatting('\x0304,01red\x03 plain'))
+        self.assertFalse(output.leavesFormatting('\x02\x034bold red\x0f'))
+
+    def testPack(self):
+        lines = ['\x02a\x02', '\x02b', 'c' * 5, 'é' * 5]
+        self.assertEqual(output.pack(lines, 100),
+                         ['\x02a\x02 || \x02b\x0f || ccccc || ééééé'])
+        # Bytes are counted, not characters
+        self.assertEqual(output.pack(lines, 27),
+                         ['\x02a\x02 || \x02b\x0f || ccccc', 'ééééé'])
+        self.assertEqual(output.pack(['x' * 10, 'y'], 5), ['x' * 10, 'y'])
+        self.assertEqual(output.pack([], 5), [])
+
+    def testCompact(self):
+        self.assertEqual(output.compact('\x02CAR-NYR\x02 | 2-1    | Game 4'),
+                         'CAR-NYR | 2-1 | Game 4')
+
+
+class GameSnapshotTestCase(SupyTestCase):
+    def testLines(self):
+        game = snapshot.GameSnapshot(2016020001, _liveFeed())
+        lines = game.lines('17,565', ['#20 Tim Peel'])
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[0].startswith(
+            '\x02OTT 1 BOS 0 In Progress\x02 [Att 17,565] | SOG 30-30'))
+        self.assertIn('PP 1/10 0PIMS', lines[0])
+        self.assertEqual(lines[1], '\x02Goals\x02: \x02OTT\x02 '
+                         '\x02J.van Riemsdyk(7)\x02 (E.Karlsson) [2nd/04:12 PP]')
+        self.assertIn('-!- #20 Tim Peel -!-', lines[2])
+        # Memoized
+        self.assertIs(game.lines('17,565', ['#20 Tim Peel']), lines)
+        self.assertEqual(len(game.lines('N/A', [])), 2)
+
+    def testGoalsWithoutScorer(self):
+        feed = _liveFeed()
+        plays = feed['liveData']['plays']['allPlays']
+        plays[0]['players'] = []
+        plays.append(dict(plays[0], players=[
+            {'playerType': 'Goalie', 'player': {'fullName': 'Tuukka Rask'}}]))
+        plays.append({'result': {'eventTypeId': 'GOAL'}})
+        game = snapshot.GameSnapshot(2016020001, feed)
+        # The malformed play is left out, the others shown without scorer
+        self.assertEqual(len(game.goals), 2)
+        self.assertIn('\x02Unknown scorer\x02 [2nd/04:12 PP]',
+                      game.lines('N/A', [])[1])
+        self.assertEqual(snapshot._shortName(''), '')
+        self.assertEqual(snapshot._shortName('Sebastian'), 'S.Sebastian')
+
+    def testGoalsAreCarriedOver(self):
+        first = snapshot.GameSnapshot(2016020001, _liveFeed())
+        feed = _liveFeed('20170412_231500')
+        feed['liveData']['plays']['allPlays'][:0] = \
+            [p.play for p in first.goals]
+        second = snapshot.GameSnapshot(2016020001, feed, previous=first)
+        self.assertEqual(len(second.goals), 2)
+        self.assertIs(second.goals[0], first.goals[0])
+        self.assertIsNot(second.goals[1], first.goals[0])
+
+
+class BracketTestCase(SupyTestCase):
+    def _data(self, *statuses):
+        return {'defaultRound': 1, 'rounds': [{'number': 1, 'series': [
+            {'currentGame': {'seriesSummary': {
+                'gameTime': gameTime, 'seriesStatus': status}}}
+            for (gameTime, status) in statuses]}]}
+
+    def testSeason(self):
+        self.assertEqual(playoffs.seasonFor(datetime.date(2017, 4, 12)),
+                         '20162017')
+        self.assertEqual(playoffs.seasonFor(datetime.date(2017, 10, 4)),
+                         '20172018')
+
+    def testExpiry(self):
+        now = 1492383600 # 2017-04-16T23:00:00Z
+        bracket = playoffs.Bracket('20162017', self._data(
+            ('2017-04-17T23:00:00Z', 'BOS leads 2-1'),
+            ('2017-04-18T00:00:00Z', 'NYR leads 2-0'),
+            ('2017-04-12T23:00:00Z', 'MTL wins 4-0')), 300, 3600, now)
+        self.assertEqual(bracket.expires, now + 24 * 3600)
+        bracket = playoffs.Bracket('20162017', self._data(
+            ('2017-04-16T22:00:00Z', 'BOS leads 2-1'),
+            ('2017-04-18T00:00:00Z', 'NYR leads 2-0')), 300, 3600, now)
+        self.assertEqual(bracket.expires, now + 300)
+        bracket = playoffs.Bracket('20162017', self._data(), 300, 3600, now)
+        self.assertEqual(bracket.expires, now + 3600)
+
+    def testLines(self):
+        bracket = playoffs.Bracket('20162017', self._data(), 300, 3600)
+        rendered = []
+        def render(round_info):
+            rendered.append(round_info['number'])
+            return ['Round {}'.format(round_info['number'])]
+        self.assertEqual(bracket.lines(1, render), ['Round 1'])
+        self.assertEqual(bracket.lines(1, render), ['Round 1'])
+        self.assertEqual(bracket.lines(2, render), None)
+        self.assertEqual(rendered, [1])
+
+
+class AlertWatcherTestCase(SupyTestCase):
+    def _snapshot(self, feed, state='Live', goals=1):
+        feed['gameData']['status'] = {'abstractGameState': state,
+                                      'detailedState': state}
+        plays = feed['liveData']['plays']['allPlays']
+        del plays[goals:]
+        for n in range(1, goals):
+            play = json.loads(json.dumps(plays[0]))
+            play['about']['periodTime'] = '1{}:00'.format(n)
+            plays.append(play)
+        return snapshot.GameSnapshot(2016020001, feed)
+
+    def testAnnouncements(self):
+        watcher = alerts.AlertWatcher()
+        self.assertEqual(watcher.update(self._snapshot(_liveFeed(),
+                                                       'Preview', 0)), [])
+        lines = watcher.update(self._snapshot(_liveFeed(), 'Live', 1))
+        self.assertEqual(len(lines), 2)
+        self.assertIn('under way', lines[0])
+        self.assertIn('J.van Riemsdyk(7)', lines[1])
+        self.assertTrue(lines[1].endswith('| OTT 1 BOS 0'))
+        self.assertEqual(watcher.update(self._snapshot(_liveFeed())), [])
+        lines = watcher.update(self._snapshot(_liveFeed(), 'Final', 2))
+        self.assertEqual(len(lines), 2)
+        self.assertIn('[2nd/11:00 PP]', lines[0])
+        self.assertEqual(lines[1], '\x02Final\x02: OTT 1 BOS 0')
+        # Nothing to say about a game seen for the first time
+        watcher = alerts.AlertWatcher()
+        self.assertEqual(watcher.update(self._snapshot(_liveFeed(), 'Live',
+                                                       3)), [])
+
+
+class LiveGamePollerTestCase(SupyTestCase):
+    class Plugin(object):
+        """Just enough of the NHL plugin for the poller."""
+
+        def __init__(self, games):
+            self.games = games
+            self.state = 'Preview'
+            self.log = log
+            self._cache = cache.ResponseCache()
+            self._feeds = livefeed.LiveFeeds()
+            self._snapshots = snapshot.SnapshotCache()
+            self._alerts = alerts.AlertWatcher()
+
+        def registryValue(self, name):
+            return {'poller.enable': True, 'alerts.enable': False,
+                    'poller.lookahead': 60,
+                    'poller.interval.pregame': 300,
+                    'poller.interval.live': 30}[name]
+
+        def _getTodayGames(self):
+            return self.games
+
+        def _getFeedURL(self, gamepk):
+            return 'feed/' + gamepk
+
+        def _refreshFeed(self, gamepk):
+            feed = _liveFeed()
+            feed['gameData']['status']['abstractGameState'] = self.state
+            return snapshot.GameSnapshot(gamepk, feed)
+
+    def _game(self, gamepk, start):
+        return {'gamePk': gamepk, 'gameDate': time.strftime(
+                    '%Y-%m-%dT%H:%M:%SZ', time.gmtime(start)),
+                'status': {'abstractGameState': 'Preview'},
+                'teams': {'away': {'team': {}}, 'home': {'team': {}}}}
+
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        now = time.time()
+        self.plugin = self.Plugin([self._game(1, now + 600),
+                                   self._game(2, now - 5 * 3600)])
+        self.poller = poller.LiveGamePoller(self.plugin)
+
+    def tearDown(self):
+        self.poller.stop()
+        SupyTestCase.tearDown(self)
+
+    def testGamesThatDontStart(self):
+        self.poller.scan()
+        self.assertEqual(sorted(self.poller.games), ['1', '2'])
+        # Long past its start and still not under way
+        self.poller.poll('2')
+        self.assertEqual(list(self.poller.games), ['1'])
+        self.poller.poll('1')
+        self.assertEqual(list(self.poller.games), ['1'])
+        # Out of the schedule (postponed)
+        self.plugin.games = []
+        self.poller.scan()
+        self.assertEqual(self.poller.games, {})
+
+    def testExtendsOnlyRefreshedResponses(self):
+        self.plugin.state = 'Live'
+        self.poller.track('1')
+        self.plugin._cache.put('feed/1', b'{}', ttl=0)
+        self.poller.poll('1')
+        self.assertTrue(self.plugin._cache.lookup('feed/1').isFresh())
+        # With diffPatch, the patched feed is newer than the response
+        self.plugin._cache.put('feed/1', b'{}', ttl=0)
+        self.plugin._feeds.put('1', livefeed.LiveFeed(_liveFeed()))
+        self.poller.poll('1')
+        self.assertFalse(self.plugin._cache.lookup('feed/1').isFresh())
+        self.assertIsNotNone(self.plugin._feeds.fresh('1'))
+
+
+class TeamDirectoryTestCase(SupyTestCase):
+    def testResolve(self):
+        directory = teams.TeamDirectory(TEAMS)
+        for name in ('BOS', 'bos', 'Bruins', 'boston', 'bru', 'Boston Bruins'):
+            self.assertEqual(directory.resolve(name).abbreviation, 'BOS')
+        self.assertEqual(directory.resolve('montreal').id, 8)
+        self.assertEqual(directory.resolve('Montréal Canadiens').id, 8)
+        self.assertEqual(directory.resolve('isl').abbreviation, 'NYI')
+        self.assertEqual(directory.resolve('gnjd').abbreviation, 'NJD')
+        # Shared by several teams, or too short
+        for name in ('New York', 'new', 'bo', 'xyz'):
+            self.assertEqual(directory.resolve(name), None)
+
+    def testFromJSON(self):
+        directory = teams.TeamDirectory.fromJSON(
+            json.dumps(TEAMS).encode('utf-8'))
+        self.assertEqual(len(directory), 5)
+        self.assertEqual(directory.byId[3].abbreviation, 'NYR')
+
+
+class SeasonStatsTestCase(SupyTestCase):
+    def _rows(self, gamepk, date, away, home, overtime=False):
+        """Returns the rows of a game where team id away scored away[0]
+        goals on away[1] shots (and the same for home)."""
+        def side(team, goals, shots):
+            return {'team': {'id': team}, 'teamStats': {'teamSkaterStats': {
+                'goals': goals, 'shots': shots, 'hits': 20, 'pim': 4,
+                'powerPlayGoals': '1.0', 'powerPlayOpportunities': 3.0,
+                'faceOffWinPercentage': '50.0', 'blocked': 10,
+                'takeaways': 5, 'giveaways': 5}}}
+        game = {'gamePk': gamepk,
+                'teams': {'away': {'score': away[1]},
+                          'home': {'score': home[1]}},
+                'linescore': {'currentPeriod': 4 if overtime else 3}}
+        boxscore = {'teams': {'away': side(*away), 'home': side(*home)}}
+        return seasonstats.gameRows(date, game, boxscore)
+
+    def testAggregates(self):
+        stats = seasonstats.SeasonStats('20162017')
+        stats.add(self._rows(2, '2016-10-14', (6, 2, 30), (9, 3, 25), True))
+        stats.add(self._rows(1, '2016-10-12', (9, 1, 20), (6, 4, 40)))
+        stats.add(self._rows(3, '2016-10-16', (6, 5, 35), (3, 0, 15)))
+        # Already stored
+        stats.add(self._rows(3, '2016-10-16', (6, 5, 35), (3, 0, 15)))
+        self.assertEqual(len(stats), 6)
+        self.assertTrue(2 in stats)
+        self.assertEqual(stats.lastDate(), datetime.date(2016, 10, 16))
+
+        season = stats.aggregate(6)
+        self.assertEqual((season.games, season.win, season.losses,
+                          season.ot_loss), (3, 2, 0, 1))
+        self.assertEqual((season.goals, season.goals_against), (11, 4))
+        self.assertEqual(season.average('shots'), 35)
+        self.assertEqual(season.powerPlayPercentage(), 100.0 / 3)
+        self.assertEqual(season.first, datetime.date(2016, 10, 12))
+        last = stats.aggregate(6, last=2)
+        self.assertEqual((last.games, last.first, last.goals),
+                         (2, datetime.date(2016, 10, 14), 7))
+        self.assertEqual(stats.aggregate(9).shots_against, 70)
+        self.assertEqual(stats.aggregate(1), None)
+
+    def testSaveAndLoad(self):
+        stats = seasonstats.SeasonStats('20162017')
+        stats.add(self._rows(1, '2016-10-12', (9, 1, 20), (6, 4, 40)))
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        stats.save(directory)
+        loaded = seasonstats.SeasonStats.load(directory, '20162017')
+        self.assertEqual(len(loaded), 2)
+        self.assertEqual(loaded.aggregate(6).goals, 4)
+        self.assertEqual(len(seasonstats.SeasonStats.load(directory,
+                                                          '20172018')), 0)
+        self.assertEqual(len(seasonstats.SeasonStats.load(
+            os.path.join(directory, 'nothing'), '20162017')), 0)
+        # Concurrent saves don't trip over each other's temporary files
+        threads = [threading.Thread(target=stats.save, args=(directory,))
+                   for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(seasonstats.SeasonStats.load(directory,
+                                                          '20162017')), 2)
+        self.assertFalse([name for name in os.listdir(directory)
+                          if name.endswith('.tmp')])
+
+
+class ScheduleIndexTestCase(SupyTestCase):
+    def _game(self, pk, away, home):
+        return {'gamePk': pk,
+                'teams': {'away': {'team': {'abbreviation': away}},
+                          'home': {'team': {'abbreviation': home}}}}
+
+    def testIncrementalWindow(self):
+        fetches = []
+        def fetch(start, end):
+            fetches.append((start, end))
+            return {'dates': [{'date': d, 'games': [self._game(n, 'BOS', 'OTT')]}
+                    for (n, d) in enumerate(gameindex.dateRange(start, end))]}
+        index = gameindex.ScheduleIndex(fetch)
+        index.ensure('2017-04-10', '2017-04-12', 3600)
+        self.assertEqual(fetches, [('2017-04-10', '2017-04-12')])
+        self.assertEqual(index.games('2017-04-11', 'bos')[0]['gamePk'], 1)
+        self.assertEqual(index.games('2017-04-11', 'BUF'), [])
+        index.prune('2017-04-11', '2017-04-13')
+        index.ensure('2017-04-11', '2017-04-13', 3600)
+        self.assertEqual(fetches[-1], ('2017-04-13', '2017-04-13'))
+        self.assertFalse('2017-04-10' in index)
+        self.assertEqual(index.games('2017-04-10', 'BOS'), [])
+
+
+class GameStoreTestCase(SupyTestCase):
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        (fd, self.filename) = tempfile.mkstemp()
+        os.close(fd)
+        self.store = store.GameStore(self.filename)
+
+    def tearDown(self):
+        self.store.close()
+        os.remove(self.filename)
+        SupyTestCase.tearDown(self)
+
+    def testSaveAndPrune(self):
+        self.store.save('1', {'a': b'x' * 1000, 'b': b'report'})
+        time.sleep(0.01)
+        self.store.save('2', {'c': os.urandom(1000)})
+        self.assertEqual(self.store.get('a'), b'x' * 1000)
+        self.assertEqual(self.store.missing(['a', 'c', 'd']), ['d'])
+        self.assertEqual(sorted(url for (url, data) in self.store.recent(1)),
+                         ['c'])
+        self.assertEqual(self.store.prune(self.store.size() - 1), 1)
+        self.assertEqual(self.store.get('a'), None)
+        self.assertNotEqual(self.store.get('c'), None)
+
+    def testShortLinksArePersisted(self):
+        requests = []
+        def fetch(url):
+            requests.append(url)
+            return 'http://tinyurl.com/' + url
+        links = shortener.LinkShortener(fetch, self.store)
+        self.assertEqual(links.cached('x'), None)
+        self.assertEqual(links.shorten('x'), 'http://tinyurl.com/x')
+        self.assertEqual(links.shorten('x'), 'http://tinyurl.com/x')
+        links = shortener.LinkShortener(fetch, self.store)
+        self.assertEqual(links.cached('x'), 'http://tinyurl.com/x')
+        self.assertEqual(requests, ['x'])
+        # A miss is counted once, even when the link is requested after it
+        self.assertEqual(links.cached('y'), None)
+        self.assertEqual(links.request('y'), 'http://tinyurl.com/y')
+        self.assertEqual((links.hits, links.misses), (1, 1))
+
+    def testDocuments(self):
+        self.assertEqual(self.store.getDocument('teams'), None)
+        self.store.saveDocument('teams', b'{"teams": []}')
+        (data, stored) = self.store.getDocument('teams')
+        self.assertEqual(data, b'{"teams": []}')
+        self.assertTrue(time.time() - stored < 60)
+
+
+class FeedParseTestCase(SupyTestCase):
+    def testSelectsScoringPlays(self):
+        plays = [{'result': {'eventTypeId': 'FACEOFF'}},
+                 {'result': {'eventTypeId': 'GOAL'}, 'about': {'eventIdx': 1}},
+                 {'result': {'eventTypeId': 'SHOT', 'description': '"}]'}}]
+        feed = {'gameData': {'status': {'detailedState': 'Final'},
+                             'players': {'ID1': {'fullName': 'A B'}}},
+                'liveData': {'plays': {'allPlays': plays,
+                                       'scoringPlays': [1]},
+                             'boxscore': {'teams': {
+                                 'away': {'teamStats': {'a': 1},
+                                          'players': {}},
+                                 'home': {'teamStats': {'h': 2}}}}}}
+        for body in (json.dumps(feed), json.dumps(feed, indent=2).encode()):
+            self.assertEqual(feedparse.parseFeed(body), {
+                'gameData': {'status': {'detailedState': 'Final'}},
+                'liveData': {'plays': {'allPlays': [plays[1]],
+                                       'scoringPlays': [1]},
+                             'boxscore': {'teams': {
+                                 'away': {'teamStats': {'a': 1}},
+                                 'home': {'teamStats': {'h': 2}}}}}})
+        self.assertRaises(ValueError, feedparse.parseFeed, '{"gamePk": 1} x')
+
+
+    def testPlayIndex(self):
+        def play(n):
+            return {'result': {'eventTypeId': 'GOAL' if n % 3 else 'HIT'},
+                    'about': {'eventIdx': n}}
+        def body(plays):
+            scoring = [n for n in range(plays) if n % 3]
+            return json.dumps({'metaData': {'timeStamp': str(plays)},
+                               'liveData': {'plays': {
+                                   'allPlays': [play(n) for n in range(plays)],
+                                   'scoringPlays': scoring}}}, indent=2)
+        index = feedparse.PlayIndex()
+        for plays in (0, 4, 5, 5, 9):
+            self.assertEqual(feedparse.parseFeed(body(plays), index=index),
+                             feedparse.parseFeed(body(plays)))
+        self.assertEqual((index.count, index.positions),
+                         (9, (1, 2, 4, 5, 7, 8)))
+        # The plays carried over are the same objects
+        first = feedparse.parseFeed(body(10), index=index)
+        second = feedparse.parseFeed(body(11), index=index)
+        self.assertIs(first['liveData']['plays']['allPlays'][0],
+                      second['liveData']['plays']['allPlays'][0])
+        # An edited play means starting over
+        edited = body(12).replace('"eventIdx": 1', '"eventIdx": 42')
+        self.assertEqual(feedparse.parseFeed(edited, index=index),
+                         feedparse.parseFeed(edited))
+
+
+class GameReportTestCase(SupyTestCase):
+    def testParse(self):
+        body = ('<td>Attendance 17,565 at TD Garden</td>'
+                '<tr><td class="bold">Referee</td>'
+                '<td class="bold">Linesperson</td></tr>'
+                '<tr><td><table><tr><td align="left">#20 Tim Peel</td></tr>'
+                '<tr><td>#9 Dan O&#39;Rourke</td></tr></table></td>'
+                '<td><table><tr><td>#50 Scott Cherrey</td></tr></table></td>')
+        record = report.parseReport(body.encode())
+        self.assertEqual(record.attendance, '17,565')
+        self.assertEqual(record.referees, ['#20 Tim Peel', "#9 Dan O'Rourke"])
+        self.assertEqual(record.linesmen, ['#50 Scott Cherrey'])
+        self.assertEqual(report.parseReport(None), None)
+        self.assertEqual(report.parseReport(b'<html></html>').referees, [])
+
+    def testURL(self):
+        self.assertEqual(report.reportURL('2017020001'),
+            'http://www.nhl.com/scores/htmlreports/20172018/GS020001.HTM')
+
 
 # vim:set shiftwidth=4 tabstop=4 expandtab textwidth=79: